@@ -13,4 +13,16 @@ if not os.path.exists(MODEL_PATH):
 model = SentenceTransformer(MODEL_NAME)
 model.save(MODEL_PATH)
 
-print("Model downloaded and saved successfully!")
\ No newline at end of file
+print("Model downloaded and saved successfully!")
+
+# tokenizer ของ LLM สำหรับนับ token (utils/token_budget.py โหลดจากโฟลเดอร์นี้โดยไม่ต้องต่อ internet)
+from transformers import AutoTokenizer
+
+TOKENIZER_NAME = os.getenv("LLM_TOKENIZER", "scb10x/llama3.1-typhoon2-8b-instruct")
+TOKENIZER_PATH = './models/tokenizer'
+
+print(f"Downloading tokenizer '{TOKENIZER_NAME}' to '{TOKENIZER_PATH}'...")
+tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+tokenizer.save_pretrained(TOKENIZER_PATH)
+
+print("Tokenizer downloaded and saved successfully!")
@@ -0,0 +1,131 @@
+# เปรียบเทียบเวลาเรนเดอร์ PDF เป็นภาพระหว่าง pdf2image (poppler/pdftoppm) กับ PyMuPDF ที่หน้าเว็บใช้
+# รันจากโฟลเดอร์หลักของ repo: python experiment/OCR/benchmark_pdf_render.py --repeats 5
+import io
+import sys
+import time
+import shutil
+import argparse
+import statistics
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import fitz
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT))
+
+from utils.file_helper import render_pdf_page, RENDER_COLORSPACES  # noqa: E402
+
+try:
+    from pdf2image import convert_from_bytes
+except ImportError:
+    convert_from_bytes = None
+
+INPUT_DIRS = sorted(Path(__file__).resolve().parent.glob("input_pdfs-*"))
+
+
+def render_poppler(pdf_bytes: bytes, dpi: int, colorspace: str) -> list:
+    return convert_from_bytes(pdf_bytes, dpi=dpi, grayscale=(colorspace == "gray"))
+
+
+def render_pymupdf(pdf_bytes: bytes, dpi: int, colorspace: str) -> list:
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        return [render_pdf_page(page, dpi=dpi, colorspace=colorspace) for page in pdf_document]
+
+
+def encode_png(images: list) -> int:
+    """PNG-encodes every page as the OCR upload does; returns the total payload size in bytes."""
+    total = 0
+    for image in images:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        total += buffer.tell()
+    return total
+
+
+def time_backend(render, pdf_bytes: bytes, dpi: int, colorspace: str, repeats: int) -> dict:
+    render_times, total_times = [], []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        images = render(pdf_bytes, dpi, colorspace)
+        rendered = time.perf_counter()
+        png_bytes = encode_png(images)
+        render_times.append(rendered - started)
+        total_times.append(time.perf_counter() - started)
+    return {
+        "images": images,
+        "render_s": statistics.median(render_times),
+        "render_png_s": statistics.median(total_times),
+        "png_kb": round(png_bytes / 1024),
+    }
+
+
+def pixel_difference(images_a: list, images_b: list):
+    """Mean absolute per-pixel difference (0-255) between two renderings, None if page sizes differ."""
+    diffs = []
+    for a, b in zip(images_a, images_b):
+        if a.size != b.size or a.mode != b.mode:
+            return None
+        diffs.append(np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)).mean())
+    return round(float(np.mean(diffs)), 2) if diffs else None
+
+
+def benchmark(pdf_paths: list, dpi: int, colorspace: str, repeats: int, use_poppler: bool) -> pd.DataFrame:
+    rows = []
+    for pdf_path in pdf_paths:
+        pdf_bytes = pdf_path.read_bytes()
+        pymupdf = time_backend(render_pymupdf, pdf_bytes, dpi, colorspace, repeats)
+        row = {
+            "file": f"{pdf_path.parent.name}/{pdf_path.name}",
+            "pages": len(pymupdf["images"]),
+            "pymupdf_render_s": round(pymupdf["render_s"], 3),
+            "pymupdf_render_png_s": round(pymupdf["render_png_s"], 3),
+            "pymupdf_png_kb": pymupdf["png_kb"],
+        }
+        if use_poppler:
+            poppler = time_backend(render_poppler, pdf_bytes, dpi, colorspace, repeats)
+            row.update({
+                "poppler_render_s": round(poppler["render_s"], 3),
+                "poppler_render_png_s": round(poppler["render_png_s"], 3),
+                "poppler_png_kb": poppler["png_kb"],
+                "speedup": round(poppler["render_png_s"] / pymupdf["render_png_s"], 2),
+                "mean_pixel_diff": pixel_difference(poppler["images"], pymupdf["images"]),
+            })
+        rows.append(row)
+        print(f"✅ {row['file']}: {row['pages']} page(s)")
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pdf2image (poppler) against PyMuPDF page rendering.")
+    parser.add_argument("pdfs", nargs="*", help="PDF files (default: experiment/OCR/input_pdfs-*/*.pdf)")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--colorspace", choices=sorted(RENDER_COLORSPACES), default="rgb")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per file; the median is reported.")
+    parser.add_argument("--csv", help="Also write the per-file results to this CSV.")
+    args = parser.parse_args()
+
+    pdf_paths = [Path(p) for p in args.pdfs] or sorted(p for d in INPUT_DIRS for p in d.glob("*.pdf"))
+    if not pdf_paths:
+        raise SystemExit("❌ No PDF files found.")
+    use_poppler = convert_from_bytes is not None and shutil.which("pdftoppm") is not None
+    if not use_poppler:
+        print("⚠️ pdf2image/pdftoppm not available, timing PyMuPDF only.")
+
+    results = benchmark(pdf_paths, args.dpi, args.colorspace, args.repeats, use_poppler)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(results.to_string(index=False))
+    totals = results.sum(numeric_only=True)
+    print(f"\n--- {len(results)} file(s), {int(totals['pages'])} page(s) at {args.dpi} dpi ({args.colorspace}) ---")
+    print(f"PyMuPDF: {totals['pymupdf_render_s']:.2f}s render, {totals['pymupdf_render_png_s']:.2f}s render+PNG")
+    if use_poppler:
+        print(f"poppler: {totals['poppler_render_s']:.2f}s render, {totals['poppler_render_png_s']:.2f}s render+PNG "
+              f"({totals['poppler_render_png_s'] / totals['pymupdf_render_png_s']:.2f}x slower)")
+    if args.csv:
+        results.to_csv(args.csv, index=False, encoding="utf-8-sig")
+
+
+if __name__ == "__main__":
+    main()
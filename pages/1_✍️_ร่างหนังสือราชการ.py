@@ -1,11 +1,19 @@
 import streamlit as st
 import ollama
+import io
+import os
+import hashlib
+import pandas as pd
 
 from styles.main_style import load_css
-from utils.ui_helper import render_sidebar
-from utils.llm_helper import init_ollama_client, draft_generation
+from utils.llm_clients import get_ollama_client, ollama_available
+from utils.ui_helper import render_sidebar, queue_position_notice
+from utils.llm_helper import draft_generation_stream
+from utils.bulk_drafting import JOB_FIELDS, load_jobs_csv, run_bulk_drafts
+from utils.cache_store import CACHE_DIR
 
-ollama_client, OLLAMA_AVAILABLE = init_ollama_client()
+ollama_client = get_ollama_client()
+OLLAMA_AVAILABLE = ollama_available()
 
 # --- PAGE CONFIG & SETUP ---
 st.set_page_config(
@@ -73,12 +81,22 @@ if 'user_prompt_for_feedback' not in st.session_state:
 
 # --- Logic for Generating Content ---
 if generate_button and user_prompt:
-    with st.spinner("🧠 AI กำลังประมวลผลและร่างเนื้อหา..."):
-        generated_text = draft_generation(ollama_client, user_prompt, doc_type, formality_level, doc_salutation)
-        st.session_state.generated_content = generated_text
-        st.session_state.original_ai_text = generated_text # Store the pristine AI output
-        st.session_state.user_prompt_for_feedback = user_prompt
-        st.session_state.editing_mode = False # Always reset to read-only mode after new generation
+    st.write("")
+    with st.container(border=True):
+        st.subheader("ผลลัพธ์จาก AI")
+        # แสดงข้อความทันทีที่ AI สร้างออกมา แทนการรอจนเสร็จทั้งหมด
+        draft_stream = draft_generation_stream(ollama_client, user_prompt, doc_type, formality_level, doc_salutation)
+        try:
+            with queue_position_notice():
+                generated_text = st.write_stream(draft_stream)
+        finally:
+            # ถ้าผู้ใช้กดหยุด, rerun หรือออกจากหน้า ให้ปิดการเชื่อมต่อเพื่อหยุดการ generate ฝั่ง Ollama
+            draft_stream.close()
+    st.session_state.generated_content = generated_text
+    st.session_state.original_ai_text = generated_text # Store the pristine AI output
+    st.session_state.user_prompt_for_feedback = user_prompt
+    st.session_state.editing_mode = False # Always reset to read-only mode after new generation
+    st.rerun() # Re-render the streamed text into the editable result area below
 
 # --- Display Results and Actions ---
 if st.session_state.generated_content:
@@ -155,4 +173,37 @@ if st.session_state.generated_content:
                     </button>
                     """,
                     height=50,
-                )
\ No newline at end of file
+                )
+# --- Bulk Drafting from CSV ---
+st.write("")
+with st.expander("📦 ร่างหลายฉบับจากไฟล์ CSV"):
+    st.caption(
+        "อัปโหลดไฟล์ CSV ที่มีคอลัมน์ " + ", ".join(f"`{field}`" for field in JOB_FIELDS)
+        + " (ถ้าไม่ระบุ doc_type/formality_level จะใช้ค่าเริ่มต้น) ระบบจะร่างหลายฉบับพร้อมกันและบันทึกผลทีละฉบับ"
+        + " หากระบบขัดข้องระหว่างทาง ให้อัปโหลดไฟล์เดิมอีกครั้งเพื่อร่างต่อจากฉบับที่ค้างไว้"
+    )
+    bulk_file = st.file_uploader("ไฟล์ CSV", type=["csv"], key="bulk_draft_csv")
+    if bulk_file is not None:
+        bulk_bytes = bulk_file.getvalue()
+        bulk_jobs = load_jobs_csv(io.StringIO(bulk_bytes.decode("utf-8-sig")))
+        bulk_output_path = os.path.join(CACHE_DIR, "bulk_drafts", f"{hashlib.sha256(bulk_bytes).hexdigest()[:16]}.csv")
+        st.write(f"พบ {len(bulk_jobs)} รายการ")
+
+        if st.button("🚀 เริ่มร่างทั้งหมด", use_container_width=True, disabled=not OLLAMA_AVAILABLE or not bulk_jobs):
+            progress_bar = st.progress(0.0, text="กำลังเริ่ม...")
+            for result, finished, total in run_bulk_drafts(ollama_client, bulk_jobs, bulk_output_path):
+                status_icon = "✅" if result["status"] == "ok" else "❌"
+                progress_bar.progress(finished / total, text=f"{status_icon} เสร็จแล้ว {finished}/{total} ฉบับ")
+            progress_bar.progress(1.0, text="ร่างครบทุกฉบับแล้ว")
+
+        if os.path.exists(bulk_output_path):
+            with open(bulk_output_path, "rb") as f:
+                bulk_results = f.read()
+            st.dataframe(pd.read_csv(io.BytesIO(bulk_results)).drop_duplicates("job_id", keep="last").sort_values("index"), use_container_width=True)
+            st.download_button(
+                "📥 ดาวน์โหลดผลลัพธ์ (CSV)",
+                data=bulk_results,
+                file_name=f"bulk_drafts_{bulk_file.name}",
+                mime="text/csv",
+                use_container_width=True,
+            )
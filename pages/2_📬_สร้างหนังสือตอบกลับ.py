@@ -1,5 +1,4 @@
 import streamlit as st
-import requests
 import json
 import io
 import time
@@ -8,16 +7,22 @@ import numpy as np
 import cv2
 import streamlit.components.v1 as components
 
-from pdf2image import convert_from_bytes
 from PIL import Image
 from styles.main_style import load_css
-from utils.ui_helper import render_sidebar, reset_workflow_states
+from utils.file_helper import classify_pdf_pages, render_pdf_pages, PDF_RENDER_DPI, PAGE_SOURCE_OCR, PAGE_SOURCE_TEXT_LAYER
+from utils.ocr_cache import page_cache_key, get_cached_page, store_page, ocr_cache_stats
+from utils.ocr_client import ocr_images_concurrently
+from utils.llm_clients import get_ollama_client, ollama_available
+from utils.ui_helper import render_sidebar, reset_workflow_states, queue_position_notice
+from utils.prefetch_helper import input_fingerprint, start_prefetch, take_prefetched, discard_prefetch
 from utils.llm_helper import (
     LLM_MODEL,
     replySec234_generation,
     extract_structured_data,
-    init_ollama_client,
+    extract_structured_data_paged,
+    should_extract_paged,
     post_process_ocr_text,
+    post_process_profile,
     replySec1_generation,
     get_extraction,
     create_docx_from_text,
@@ -35,14 +40,19 @@ st.set_page_config(
 )
 
 # --- INITIALIZATION ---
-ollama_client, OLLAMA_AVAILABLE = init_ollama_client()
+ollama_client = get_ollama_client()
+OLLAMA_AVAILABLE = ollama_available()
 load_css()
 render_sidebar()
-TYPHOON_OCR_IMAGE_ENDPOINT = "http://typhoon-ocr:8000/process"
+OCR_PAGE_SEPARATOR = "\n\n--- End of Page ---\n\n"
+# เปลี่ยนค่านี้ทุกครั้งที่แก้ preprocess_image เพื่อไม่ให้ใช้ผล OCR ที่แคชไว้จากภาพแบบเดิม (ตอนนี้ส่งภาพต้นฉบับ)
+PREPROCESS_PROFILE = "passthrough-v1"
 
 # --- SESSION STATE INITIALIZATION ---
 states_to_init = {
     'ocr_text_content': None,
+    'ocr_page_texts': None,
+    'ocr_page_sources': None,
     'extracted_data': None,
     'current_doc_type_for_data': None,
     'reply_content': "",
@@ -99,30 +109,92 @@ def preprocess_image(pil_image: Image.Image) -> Image.Image:
         st.warning(f"เกิดข้อผิดพลาดระหว่าง Image Preprocessing: {e}. ใช้ภาพต้นฉบับแทน")
         return pil_image
 
-def ocr_from_images(image_bytes_list, file_name_for_log="image"):
-    """Sends a list of image bytes to Typhoon-OCR and aggregates results."""
-    full_text_from_all_images = []
+def render_pages_for_ocr(file_bytes: bytes, page_numbers: list):
+    """Yields `(page_number, cache_key, image)` for each page, rendering one page at a time.
+
+    Pages are rendered only as OCR slots free up, so memory is bounded by the pages
+    in flight rather than the length of the document.
+    """
+    # เรนเดอร์ด้วย PyMuPDF ใน process เดียวกัน (DPI/colorspace ตั้งผ่าน PDF_RENDER_DPI, PDF_RENDER_COLORSPACE)
+    for page_number, image in render_pdf_pages(file_bytes, page_numbers):
+        yield page_number, page_cache_key(image, PDF_RENDER_DPI, PREPROCESS_PROFILE), image
+
+def encode_page_for_ocr(image: Image.Image) -> bytes:
+    """Preprocesses a rendered page and encodes it as the PNG sent to Typhoon-OCR; closes the images."""
+    processed_img = preprocess_image(image)
+    img_byte_arr = io.BytesIO()
+    processed_img.save(img_byte_arr, format='PNG')
+    image.close()
+    processed_img.close()
+    return img_byte_arr.getvalue()
+
+def ocr_from_images(page_images, page_count: int, fuzzy_enabled: bool = False, file_name_for_log="image"):
+    """OCRs `(page_number, cache_key, image)` triples and post-processes the text, reusing the page cache.
+
+    Only cache misses are sent to Typhoon-OCR, several pages at a time (`OCR_MAX_IN_FLIGHT`).
+    Returns one processed text per image in the original order (None where OCR failed),
+    which pages came from the cache, and whether any page failed. `page_images` may be
+    a generator; it is consumed only as OCR slots free up.
+    """
+    full_text_from_all_images = [None] * page_count
+    from_cache = [False] * page_count
     has_errors = False
+    profile = post_process_profile(fuzzy_enabled)
     progress_bar = st.progress(0, text="กำลังทำ OCR...")
-
-    for i, img_bytes in enumerate(image_bytes_list):
-        files = {'file': (f'page_{i+1}.png', img_bytes, 'image/png')}
-        try:
-            response = requests.post(TYPHOON_OCR_IMAGE_ENDPOINT, files=files, timeout=180)
-            response.raise_for_status()
-            ocr_result_single_image = response.json()
-            if isinstance(ocr_result_single_image, dict) and "result" in ocr_result_single_image:
-                full_text_from_all_images.append(ocr_result_single_image["result"].strip())
-        except Exception as e:
-            st.warning(f"เกิดข้อผิดพลาดในการ OCR หน้า {i+1}: {str(e)[:100]}...")
+    progress = {"done": 0}
+    miss_slots = []  # index ที่ ocr_images_concurrently คืนมา -> (ลำดับหน้าใน page_images, cache key)
+
+    def page_finished(page_number):
+        progress["done"] += 1
+        progress_bar.progress(progress["done"] / page_count, text=f"กำลังทำ OCR หน้าที่ {page_number} ({progress['done']}/{page_count})")
+
+    def cache_misses():
+        # generator นี้ถูกดึงจาก thread ของหน้าเว็บ (ใน ocr_images_concurrently) จึงอัปเดต progress bar ได้
+        for slot, (page_number, key, image) in enumerate(page_images):
+            entry = get_cached_page(key)
+            if entry is None:
+                miss_slots.append((slot, key))
+                yield page_number, encode_page_for_ocr(image)
+                continue
+            image.close()
+            page_text = entry["processed"].get(profile)
+            if page_text is None:
+                # เคย OCR หน้านี้แล้วแต่ด้วยการแก้คำคนละแบบ ใช้ข้อความดิบเดิมแก้คำใหม่โดยไม่ต้อง OCR ซ้ำ
+                page_text = post_process_ocr_text(entry["raw_text"], fuzzy_enabled=fuzzy_enabled)
+                store_page(key, entry["raw_text"], profile, page_text, entry=entry)
+            full_text_from_all_images[slot] = page_text
+            from_cache[slot] = True
+            page_finished(page_number)
+
+    # หน้าเสร็จไม่ตามลำดับ แต่ผลถูกวางกลับตาม index เดิม และ progress bar/คำเตือนอัปเดตจาก thread ของหน้าเว็บเท่านั้น
+    for i, page_number, raw_text, error in ocr_images_concurrently(cache_misses()):
+        slot, key = miss_slots[i]
+        if error is not None:
+            st.warning(f"เกิดข้อผิดพลาดในการ OCR หน้า {page_number}: {str(error)[:100]}...")
             has_errors = True
-        
-        # Update progress bar
-        progress_bar.progress((i + 1) / len(image_bytes_list), text=f"กำลังทำ OCR หน้าที่ {i+1}/{len(image_bytes_list)}")
-    
+        elif raw_text:
+            page_text = post_process_ocr_text(raw_text, fuzzy_enabled=fuzzy_enabled)
+            store_page(key, raw_text, profile, page_text)
+            full_text_from_all_images[slot] = page_text
+        page_finished(page_number)
+
     progress_bar.empty()
-    separator = "\n\n--- End of Page ---\n\n"
-    return separator.join(full_text_from_all_images), has_errors
+    print(f"INFO [ocr]: '{file_name_for_log}' {sum(from_cache)}/{page_count} page(s) from OCR cache.")
+    return full_text_from_all_images, from_cache, has_errors
+
+OPENING_PREFETCH_KEY = "opening_options_prefetch"
+
+def opening_inputs_fingerprint():
+    # None กับ "" ให้ผลเหมือนกันใน replySec1_generation จึงถือว่าเป็นค่าเดียวกัน (ฟอร์มแก้ไขจะแปลง None เป็น "")
+    normalized_data = {k: "" if v is None else str(v) for k, v in (st.session_state.extracted_data or {}).items()}
+    return input_fingerprint(normalized_data, st.session_state.ocr_text_content)
+
+def prefetch_opening_options():
+    """Starts generating the 'ข้อ ๑' options while the user reviews the extracted fields."""
+    start_prefetch(
+        st.session_state, OPENING_PREFETCH_KEY, opening_inputs_fingerprint(),
+        replySec1_generation, ollama_client, dict(st.session_state.extracted_data), st.session_state.ocr_text_content
+    )
 
 def sync_opening_paragraph():
     """Syncs the radio button choice to the text area."""
@@ -158,27 +230,66 @@ with st.container(border=True):
             with st.spinner(f"กำลังประมวลผลไฟล์ '{uploaded_file.name}'..."):
                 try:
                     file_bytes = uploaded_file.getvalue()
-                    pil_images = convert_from_bytes(file_bytes, dpi=300, fmt='png', thread_count=4)
-                    
-                    image_bytes_list = []
-                    for image in pil_images:
-                        processed_img = preprocess_image(image)
-                        img_byte_arr = io.BytesIO()
-                        processed_img.save(img_byte_arr, format='PNG')
-                        image_bytes_list.append(img_byte_arr.getvalue())
-
-                    ocr_text_from_func, ocr_errors = ocr_from_images(image_bytes_list, uploaded_file.name)
-                    ocr_text_processed = post_process_ocr_text(ocr_text_from_func, fuzzy_enabled=use_fuzzy_matching)
-                    st.session_state.ocr_text_content = ocr_text_processed
+                    # หน้าที่มีชั้นข้อความดีอ่านด้วย PyMuPDF ได้ทันที เฉพาะหน้าสแกนเท่านั้นที่ต้องแปลงเป็นภาพและส่ง OCR
+                    page_plan = classify_pdf_pages(file_bytes)
+                    ocr_page_numbers = [entry["page"] for entry in page_plan if entry["source"] == PAGE_SOURCE_OCR]
+
+                    ocr_texts = {}
+                    cached_pages = set()
+                    if ocr_page_numbers:
+                        # render -> (แคช) -> preprocess -> OCR ทีละหน้าแบบ pipeline ไม่โหลดภาพทุกหน้าไว้ในหน่วยความจำพร้อมกัน
+                        # ข้อความ OCR ถูกแก้คำทีละหน้าแล้วเก็บแยกไว้ใช้กับการสกัดแบบแยกหน้า (fuzzy matching ต่อคำใหม่ทั้งข้อความ ตัวคั่นหน้าจึงไม่คงรูปเดิม)
+                        page_images = render_pages_for_ocr(file_bytes, ocr_page_numbers)
+                        page_ocr_texts, page_from_cache, ocr_errors = ocr_from_images(
+                            page_images, len(ocr_page_numbers), fuzzy_enabled=use_fuzzy_matching, file_name_for_log=uploaded_file.name
+                        )
+                        ocr_texts = dict(zip(ocr_page_numbers, page_ocr_texts))
+                        cached_pages = {page for page, cached in zip(ocr_page_numbers, page_from_cache) if cached}
+
+                    # ข้อความจากชั้นข้อความของ PDF ถูกต้องตามต้นฉบับอยู่แล้ว จึงไม่ผ่านการแก้คำผิดของ OCR
+                    processed_pages = []
+                    page_sources = []
+                    for entry in page_plan:
+                        if entry["source"] == PAGE_SOURCE_TEXT_LAYER:
+                            page_text = entry["text"]
+                        else:
+                            page_text = ocr_texts.get(entry["page"])
+                        if page_text:
+                            processed_pages.append(page_text)
+                        page_sources.append({
+                            "page": entry["page"],
+                            "source": entry["source"] if page_text else "failed",
+                            "cached": entry["page"] in cached_pages,
+                        })
+                    print(f"INFO [ocr]: '{uploaded_file.name}' page sources: {page_sources}")
+                    st.session_state.ocr_page_texts = processed_pages
+                    st.session_state.ocr_page_sources = page_sources
+                    st.session_state.ocr_text_content = OCR_PAGE_SEPARATOR.join(processed_pages)
                     st.rerun()
                 except Exception as e:
                     st.error(f"เกิดข้อผิดพลาดร้ายแรงในกระบวนการ OCR: {e}")
                     st.session_state.ocr_text_content = None # Ensure state is cleared on error
+                    st.session_state.ocr_page_texts = None
+                    st.session_state.ocr_page_sources = None
 
         # --- Main Workflow (executes only if OCR content exists) ---
         if st.session_state.ocr_text_content:
             with st.expander("แสดงตัวอย่างเนื้อหาจาก OCR", expanded=True):
                 st.text_area("OCR Content:", st.session_state.ocr_text_content, height=200, disabled=True, label_visibility="collapsed")
+                if st.session_state.ocr_page_sources:
+                    source_labels = {PAGE_SOURCE_TEXT_LAYER: "ข้อความใน PDF", PAGE_SOURCE_OCR: "OCR", "failed": "อ่านไม่สำเร็จ"}
+                    st.caption("ที่มาของข้อความ: " + " · ".join(
+                        f"หน้า {entry['page']} {source_labels[entry['source']]}" + (" (แคช)" if entry.get("cached") else "")
+                        for entry in st.session_state.ocr_page_sources
+                    ))
+                    ocr_pages = [entry for entry in st.session_state.ocr_page_sources if entry["source"] != PAGE_SOURCE_TEXT_LAYER]
+                    if ocr_pages:
+                        cache_stats = ocr_cache_stats()
+                        st.caption(
+                            f"แคช OCR: ไฟล์นี้ใช้ผลเดิม {sum(1 for entry in ocr_pages if entry.get('cached'))}/{len(ocr_pages)} หน้า"
+                            f" · อัตรา hit ทั้งระบบ {cache_stats['hit_rate']:.0%}"
+                            f" ({cache_stats['memory_hits'] + cache_stats['disk_hits']}/{cache_stats['memory_hits'] + cache_stats['disk_hits'] + cache_stats['misses']} หน้า)"
+                        )
 
             st.markdown("#### ขั้นตอนที่ 1.1: โปรดระบุประเภทของหนังสือรับ")
             doc_types = ["บันทึกข้อความ", "กระดาษข่าวร่วม (ทท.)"]
@@ -208,17 +319,22 @@ with st.container(border=True):
                 if st.session_state.extracted_data:
                     if st.button("🗑️ ล้างข้อมูล", use_container_width=True):
                         st.session_state.extracted_data = None
+                        discard_prefetch(st.session_state, OPENING_PREFETCH_KEY)
                         st.rerun()
 
             if extract_button:
                 st.session_state.current_doc_type_for_data = selected_doc_type
-                with st.spinner(f"🧠 AI กำลังวิเคราะห์และสกัดข้อมูลสำหรับ '{selected_doc_type}'..."):
+                with st.spinner(f"🧠 AI กำลังวิเคราะห์และสกัดข้อมูลสำหรับ '{selected_doc_type}'..."), queue_position_notice():
                     try:
                         system_prompt, user_prompt_template, field_keys = get_extraction(selected_doc_type)
-                        raw_extracted = extract_structured_data(ollama_client, st.session_state.ocr_text_content, selected_doc_type, system_prompt, user_prompt_template)
+                        if should_extract_paged(st.session_state.ocr_page_texts):
+                            raw_extracted = extract_structured_data_paged(ollama_client, st.session_state.ocr_page_texts, selected_doc_type, system_prompt, user_prompt_template)
+                        else:
+                            raw_extracted = extract_structured_data(ollama_client, st.session_state.ocr_text_content, selected_doc_type, system_prompt, user_prompt_template)
                         
                         if raw_extracted and isinstance(raw_extracted, dict):
                              st.session_state.extracted_data = {key: raw_extracted.get(key) for key in field_keys}
+                             prefetch_opening_options()
                              st.success("สกัดข้อมูลสำเร็จ!")
                              time.sleep(1) # Short pause to let user see the success message
                              st.rerun()
@@ -254,7 +370,11 @@ with st.container(border=True):
                     
                     if st.form_submit_button("💾 บันทึกการแก้ไขข้อมูล", use_container_width=True):
                         has_changed = any(str(st.session_state.extracted_data.get(k, '')) != str(v) for k, v in temp_edited_data.items())
+                        fingerprint_before_edit = opening_inputs_fingerprint()
                         st.session_state.extracted_data.update(temp_edited_data)
+                        if opening_inputs_fingerprint() != fingerprint_before_edit:
+                            # ตัวเลือก 'ข้อ ๑' ที่สร้างล่วงหน้าจากข้อมูลเดิมใช้ไม่ได้แล้ว
+                            discard_prefetch(st.session_state, OPENING_PREFETCH_KEY)
                         st.success("บันทึกการแก้ไขเรียบร้อยแล้ว!")
                         if has_changed and st.session_state.opening_options:
                             st.warning("ข้อมูลหลักมีการเปลี่ยนแปลง! เพื่อความถูกต้อง ควรสร้าง 'ข้อ ๑' ใหม่อีกครั้ง")
@@ -267,8 +387,10 @@ with st.container(border=True):
                 st.markdown("##### ➡️ ขั้นตอนที่ 2.1: สร้างและยืนยัน 'ข้อ ๑'")
                 
                 if st.button("✨ สร้างตัวเลือก 'ข้อ ๑' ของหนังสือตอบกลับ", use_container_width=True):
-                    with st.spinner("AI กำลังสร้างตัวเลือกการเริ่มต้นหนังสือ (ข้อ ๑)..."):
-                        options = replySec1_generation(ollama_client, st.session_state.extracted_data, st.session_state.ocr_text_content)
+                    with st.spinner("AI กำลังสร้างตัวเลือกการเริ่มต้นหนังสือ (ข้อ ๑)..."), queue_position_notice():
+                        options = take_prefetched(st.session_state, OPENING_PREFETCH_KEY, opening_inputs_fingerprint())
+                        if not options:
+                            options = replySec1_generation(ollama_client, st.session_state.extracted_data, st.session_state.ocr_text_content)
                         if options:
                             st.session_state.opening_options = options
                             st.session_state.selected_opening = options[0]
@@ -335,7 +457,7 @@ with st.container(border=True):
                             selected_intent_for_llm = reply_intent_options[selected_intent_display]
                     
                     if st.button("🤖 ให้ AI ช่วยร่างเนื้อหาต่อ (ข้อ ๒, ๓, ...)", use_container_width=True):
-                        with st.spinner(f"AI กำลังร่างเนื้อหาต่อโดยมีเจตนาคือ '{selected_intent_display}'..."):
+                        with st.spinner(f"AI กำลังร่างเนื้อหาต่อโดยมีเจตนาคือ '{selected_intent_display}'..."), queue_position_notice():
                             try:
                                 info_for_analysis = st.session_state.extracted_data.copy()
                                 info_for_analysis["user_provided_opening_paragraph"] = st.session_state.confirmed_opening_paragraph
@@ -5,11 +5,20 @@ import qdrant_client
 
 from pathlib import Path
 from styles.main_style import load_css 
-from utils.ui_helper import render_sidebar
+from utils.llm_clients import get_ollama_client, ollama_available
+from utils.ui_helper import render_sidebar, queue_position_notice
 from utils.file_helper import image_to_base64
-from utils.llm_helper import init_ollama_client, call_chatbot
+from utils.chat_memory import ConversationMemory, memory_messages, refresh_summary_async
+from utils.llm_helper import (
+    contextual_query,
+    lookup_cached_answer,
+    retrieve_chatbot_context,
+    remember_chatbot_answer,
+    call_chatbot_stream
+)
 
-ollama_client, OLLAMA_AVAILABLE = init_ollama_client()
+ollama_client = get_ollama_client()
+OLLAMA_AVAILABLE = ollama_available()
 
 # --- PAGE CONFIG & SETUP ---
 st.set_page_config(
@@ -31,11 +40,26 @@ def handle_new_question(prompt_text):
     if prompt_text:
         st.session_state.messages.append({"role": "user", "content": prompt_text})
         st.rerun()    
+
+def stop_generation():
+    """Keeps the partially streamed answer so the same question is not sent to the LLM again."""
+    partial_answer = st.session_state.get("streaming_answer", "")
+    stopped_note = "_(หยุดการสร้างคำตอบแล้ว)_"
+    st.session_state.messages.append({"role": "assistant", "content": f"{partial_answer}\n\n{stopped_note}" if partial_answer else stopped_note})
+    st.session_state.streaming_answer = ""
+
+def collect_stream(stream):
+    st.session_state.streaming_answer = ""
+    for piece in stream:
+        st.session_state.streaming_answer += piece
+        yield piece
         
 # main function
 
 if "messages" not in st.session_state:
     st.session_state.messages = [{"role": "assistant", "content": "สวัสดีครับ มีอะไรให้ผมช่วยเหลือ? สามารถเลือกจากคำถามที่พบบ่อย หรือพิมพ์คำถามของคุณได้เลยครับ"}]
+if "chat_memory" not in st.session_state:
+    st.session_state.chat_memory = ConversationMemory()
     
 for i, message in enumerate(st.session_state.messages):
     with st.chat_message(message["role"]):
@@ -73,11 +97,39 @@ if len(st.session_state.messages) <= 1:
                 handle_new_question(q)
 
 if st.session_state.messages[-1]["role"] == "user":
+    user_query = st.session_state.messages[-1]["content"]
+    # คำถามต่อเนื่องค้นหาและเทียบ cache ร่วมกับคำถามก่อนหน้า
+    lookup_query = contextual_query(st.session_state.messages)
     with st.chat_message("assistant"):
-        with st.spinner("🧠 กำลังประมวลผลหาคำตอบ..."):
-            response = call_chatbot(st.session_state.messages)
-            st.session_state.messages.append({"role": "assistant", "content": response})
-            st.rerun()
+        with st.spinner("🧠 กำลังค้นหาข้อมูลในฐานความรู้..."):
+            cached, query_embedding = lookup_cached_answer(lookup_query)
+            relevant_context = cached["context"] if cached else retrieve_chatbot_context(lookup_query, query_embedding)
+        with st.expander("📚 ข้อมูลอ้างอิงที่ใช้ตอบคำถามนี้"):
+            st.text(relevant_context)
+
+        if cached:
+            # คำถามนี้ (หรือคำถามที่ความหมายใกล้เคียงกัน) เคยถูกตอบแล้ว ใช้คำตอบเดิมโดยไม่ต้องเรียก AI
+            response = cached["answer"]
+            st.markdown(response)
+        else:
+            st.button("⏹️ หยุดการสร้างคำตอบ", key="stop_generation_button", on_click=stop_generation)
+            history = memory_messages(st.session_state.chat_memory, st.session_state.messages)
+            stream_outcome = {}
+            answer_stream = call_chatbot_stream(ollama_client, user_query, relevant_context, history=history, outcome=stream_outcome)
+            try:
+                with queue_position_notice():
+                    response = st.write_stream(collect_stream(answer_stream))
+            finally:
+                # ถ้าผู้ใช้กดหยุดหรือออกจากหน้า ให้ปิดการเชื่อมต่อเพื่อหยุดการ generate ฝั่ง Ollama
+                answer_stream.close()
+            # เก็บเข้า cache เฉพาะคำตอบที่ stream จบสมบูรณ์ ไม่ใช่คำตอบที่ล้มเหลวหรือถูกหยุดกลางทาง
+            remember_chatbot_answer(lookup_query, query_embedding, relevant_context, response, stream_outcome.get("completed", False))
+
+    st.session_state.messages.append({"role": "assistant", "content": response})
+    st.session_state.streaming_answer = ""
+    # สรุปรอบเก่าที่หลุดจากหน้าต่างใน background ไม่ทำให้คำตอบถัดไปช้าลง
+    refresh_summary_async(ollama_client, st.session_state.chat_memory, st.session_state.messages)
+    st.rerun()
 
             
 if prompt := st.chat_input("พิมพ์คำถามของคุณ...", disabled=not OLLAMA_AVAILABLE):
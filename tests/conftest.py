@@ -0,0 +1,69 @@
+import os
+import sys
+import types
+import hashlib
+import tempfile
+import importlib.util
+
+import numpy as np
+
+# utils.llm_helper โหลด embedding model, Qdrant client และไลบรารีของหน้าเว็บตั้งแต่ตอน import
+# ชุดทดสอบจึงแทนไลบรารีที่ไม่ได้ติดตั้งด้วยโมดูลจำลอง เพื่อให้ pytest รันได้บนเครื่องที่ clone มาใหม่
+# cache ของแอป (LLM, OCR, semantic cache, telemetry) ไปอยู่ในโฟลเดอร์ชั่วคราว ไม่ปนกับ cache/ ของเครื่อง
+os.environ.setdefault("APP_CACHE_DIR", tempfile.mkdtemp(prefix="rtarf-test-cache-"))
+
+EMBEDDING_DIM = 64
+
+
+def _installed(name: str) -> bool:
+    return name in sys.modules or importlib.util.find_spec(name) is not None
+
+
+def _stub(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def _passthrough_cache(func=None, **kwargs):
+    """`st.cache_resource` / `st.cache_data` with or without arguments, without caching."""
+    return func if func is not None else (lambda f: f)
+
+
+class FakeSentenceTransformer:
+    """Deterministic stand-in for the embedding model: the same text always gets the same unit vector."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def _embed(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, sentences, normalize_embeddings: bool = False, **kwargs):
+        if isinstance(sentences, str):
+            return self._embed(sentences)
+        return np.vstack([self._embed(s) for s in sentences])
+
+
+# โมเดล embedding จริงต้องดาวน์โหลดน้ำหนักโมเดลตอน import จึงใช้ตัวจำลองเสมอ
+_stub("sentence_transformers", SentenceTransformer=FakeSentenceTransformer)
+
+if not _installed("streamlit"):
+    _stub("streamlit", cache_resource=_passthrough_cache, cache_data=_passthrough_cache)
+
+if not _installed("docx"):
+    _stub("docx", Document=None)
+    _stub("docx.shared", Pt=lambda size: size)
+    _stub("docx.enum")
+    _stub("docx.enum.text", WD_PARAGRAPH_ALIGNMENT=types.SimpleNamespace(CENTER=1, LEFT=0, RIGHT=2, JUSTIFY=3))
+
+if not _installed("qdrant_client"):
+    _stub("qdrant_client", QdrantClient=lambda *args, **kwargs: None)
+    _stub("qdrant_client.http")
+    _stub("qdrant_client.http.models")
@@ -0,0 +1,72 @@
+import pytest
+
+from utils import llm_helper
+
+
+class RecordingCache:
+    def __init__(self):
+        self.added = []
+
+    def add(self, *args):
+        self.added.append(args)
+
+
+def _chunk(content: str, done: bool = False) -> dict:
+    return {"message": {"role": "assistant", "content": content}, "done": done}
+
+
+def _stream_of(*chunks):
+    def chat_stream(client, **kwargs):
+        yield from chunks
+    return chat_stream
+
+
+@pytest.fixture
+def semantic_cache(monkeypatch):
+    cache = RecordingCache()
+    monkeypatch.setattr(llm_helper, "semantic_cache", cache)
+    monkeypatch.setattr(llm_helper, "ollama_available", lambda: True)
+    monkeypatch.setattr(llm_helper, "_fit_chatbot_request", lambda query, context, history=None: ([], {}))
+    return cache
+
+
+def _answer_and_remember() -> str:
+    """Streams an answer the way the chatbot page does and offers it to the semantic cache."""
+    outcome = {}
+    answer = "".join(llm_helper.call_chatbot_stream(object(), "คำถาม", "ข้อมูลอ้างอิง", outcome=outcome))
+    llm_helper.remember_chatbot_answer("คำถาม", [0.1, 0.2], "ข้อมูลอ้างอิง", answer, outcome.get("completed", False))
+    return answer
+
+
+def test_completed_stream_is_cached(semantic_cache, monkeypatch):
+    monkeypatch.setattr(llm_helper.llm_gateway, "chat_stream", _stream_of(_chunk("คำตอบ"), _chunk("ครบ", done=True)))
+
+    assert _answer_and_remember() == "คำตอบครบ"
+    assert len(semantic_cache.added) == 1
+
+
+def test_stream_failing_mid_answer_is_not_cached(semantic_cache, monkeypatch):
+    def failing_stream(client, **kwargs):
+        yield _chunk("คำตอบครึ่ง")
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(llm_helper.llm_gateway, "chat_stream", failing_stream)
+
+    answer = _answer_and_remember()
+    # ข้อความที่รวมแล้วขึ้นต้นด้วยคำตอบบางส่วน ไม่ใช่ "เกิดข้อผิดพลาด" จึงต้องไม่ตัดสินจากข้อความ
+    assert answer.startswith("คำตอบครึ่ง")
+    assert "connection reset" in answer
+    assert semantic_cache.added == []
+
+
+def test_stopped_stream_is_not_cached(semantic_cache, monkeypatch):
+    monkeypatch.setattr(llm_helper.llm_gateway, "chat_stream", _stream_of(_chunk("คำตอบ"), _chunk("ต่อ"), _chunk("", done=True)))
+
+    outcome = {}
+    stream = llm_helper.call_chatbot_stream(object(), "คำถาม", "ข้อมูลอ้างอิง", outcome=outcome)
+    partial = next(stream)
+    stream.close()
+    llm_helper.remember_chatbot_answer("คำถาม", [0.1, 0.2], "ข้อมูลอ้างอิง", partial, outcome.get("completed", False))
+
+    assert outcome["completed"] is False
+    assert semantic_cache.added == []
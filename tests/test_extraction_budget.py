@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from utils import llm_helper
+from utils import token_budget
+
+DOCUMENT_TYPES = ["บันทึกข้อความ", "กระดาษข่าวร่วม (ทท.)"]
+LONG_TEXT = "ขอให้ส่งรายชื่อกำลังพลเข้ารับการฝึกอบรมหลักสูตรการรักษาความปลอดภัยไซเบอร์ ภายใน ๑๕ ก.พ. ๖๘ "
+
+
+def _longest_response(document_type: str) -> str:
+    """Extraction JSON with every field at its schema limit, i.e. the longest response Ollama may produce."""
+    def fill(length):
+        return (LONG_TEXT * (length // len(LONG_TEXT) + 1))[:length]
+
+    _, _, field_keys = llm_helper.get_extraction(document_type)
+    response = {}
+    for key in field_keys:
+        if key in llm_helper.EXTRACTION_LIST_FIELDS:
+            max_items, max_length = llm_helper.EXTRACTION_LIST_FIELDS[key]
+            response[key] = [fill(max_length)] * max_items
+        else:
+            response[key] = fill(llm_helper.EXTRACTION_FIELD_MAX_LENGTHS.get(key, llm_helper.EXTRACTION_DEFAULT_MAX_LENGTH))
+    return json.dumps(response, ensure_ascii=False, indent=2)
+
+
+class TruncatingClient:
+    """Returns `content` cut at the request's `num_predict`, as Ollama does when generation hits the limit."""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.num_predict = None
+
+    def chat(self, **kwargs):
+        self.num_predict = kwargs["options"]["num_predict"]
+        content = self.content
+        while token_budget.count_tokens(content) > self.num_predict:
+            content = content[:-1]
+        return {"message": {"role": "assistant", "content": content}, "done": True}
+
+
+@pytest.mark.parametrize("document_type", DOCUMENT_TYPES)
+def test_longest_valid_response_fits_num_predict(document_type):
+    content = _longest_response(document_type)
+
+    assert llm_helper.get_extraction_model(document_type).model_validate_json(content)
+    assert token_budget.count_tokens(content) <= llm_helper.extraction_num_predict(document_type)
+
+
+@pytest.mark.parametrize("document_type", DOCUMENT_TYPES)
+def test_maximum_length_document_is_extracted_whole(document_type, monkeypatch):
+    monkeypatch.setattr(llm_helper, "ollama_available", lambda: True)
+    monkeypatch.setattr(llm_helper.llm_gateway.llm_cache, "get_cached_response", lambda *args: None)
+    system_prompt, user_prompt_template, _ = llm_helper.get_extraction(document_type)
+    client = TruncatingClient(_longest_response(document_type))
+
+    extracted = llm_helper.extract_structured_data(client, "เนื้อหาหนังสือ", document_type, system_prompt, user_prompt_template)
+
+    assert client.num_predict == llm_helper.extraction_num_predict(document_type)
+    assert extracted["body_main"] == json.loads(client.content)["body_main"]
@@ -0,0 +1,86 @@
+import importlib
+
+import pytest
+
+from utils import fake_services
+from utils import llm_helper
+from utils.ollama_pool import OllamaPool
+
+# ทดสอบการเรียกใช้งานจริงผ่าน HTTP กับเซิร์ฟเวอร์จำลอง: ร่างหนังสือ, สกัดข้อมูล และแชตบอต (RAG + stream)
+# ตั้ง latency เป็นศูนย์เพื่อให้ชุดทดสอบเร็ว ค่าเวลาจำลองทดสอบแยกด้วยการรัน utils.fake_services เอง
+NO_DELAY = {"distribution": "constant", "seconds": 0.0}
+
+
+@pytest.fixture(scope="module")
+def servers():
+    config = fake_services.load_config()
+    for service in ("ollama", "ocr", "qdrant"):
+        config[service]["latency"] = NO_DELAY
+    config["ollama"]["prompt_tokens_per_second"] = 1e9
+    config["ollama"]["eval_tokens_per_second"] = 1e9
+    servers = fake_services.start_fake_services(config)
+    yield servers
+    fake_services.stop_fake_services(servers)
+
+
+@pytest.fixture
+def client(servers, monkeypatch):
+    pool = OllamaPool([servers["ollama"].url])
+    monkeypatch.setattr(llm_helper, "ollama_available", lambda: True)
+    monkeypatch.setattr(llm_helper, "get_ollama_client", lambda: pool)
+    # cache ของคำตอบจะทำให้ request ซ้ำไม่ไปถึงเซิร์ฟเวอร์จำลอง
+    monkeypatch.setattr(llm_helper.llm_gateway.llm_cache, "get_cached_response", lambda *args: None)
+    return pool
+
+
+@pytest.fixture
+def real_qdrant_client(servers, monkeypatch):
+    """The installed qdrant_client (not the conftest stand-in), with the QDRANT_* variables pointing at the fake."""
+    qdrant_client = pytest.importorskip("qdrant_client")
+    if getattr(qdrant_client, "__file__", None) is None:
+        pytest.skip("qdrant_client is not installed.")
+    for key, value in fake_services.service_env(servers).items():
+        monkeypatch.setenv(key, value)
+    return qdrant_client
+
+
+def test_draft_round_trip(servers, client):
+    doc_type = sorted(llm_helper.PROMPT_TEMPLATES)[0]
+
+    draft = llm_helper.draft_generation(client, "ขออนุมัติจัดซื้อวัสดุสำนักงาน", doc_type, "เป็นทางการ")
+
+    assert draft == servers["ollama"].config["default_response"]
+
+
+def test_extraction_round_trip(servers, client):
+    system_prompt, user_prompt_template, field_keys = llm_helper.get_extraction("บันทึกข้อความ")
+
+    extracted = llm_helper.extract_structured_data(client, "เรื่อง ขอรับการสนับสนุน", "บันทึกข้อความ", system_prompt, user_prompt_template)
+
+    assert set(extracted) == set(field_keys)
+    assert extracted["subject"] == servers["ollama"].config["schema_string_value"]
+
+
+def test_chatbot_round_trip(servers, client, real_qdrant_client, monkeypatch):
+    # ล้าง st.cache_resource (ถ้ามี) เพื่อให้สร้าง client ใหม่จากตัวแปร QDRANT_* ที่ตั้งไว้
+    getattr(llm_helper.init_qdrant_client, "clear", lambda: None)()
+    monkeypatch.setattr(llm_helper, "qdrant_cli", llm_helper.init_qdrant_client())
+    query = "หนังสือราชการมีกี่ชนิด"
+
+    context = llm_helper.retrieve_chatbot_context(query)
+    outcome = {}
+    answer = "".join(llm_helper.call_chatbot_stream(client, query, context, outcome=outcome))
+
+    assert "หนังสือราชการ มี ๖ ชนิด" in context
+    assert answer == servers["ollama"].config["default_response"]
+    assert outcome["completed"] is True
+
+
+def test_knowledge_base_ingest_reads_qdrant_address_from_env(servers, real_qdrant_client, monkeypatch):
+    pytest.importorskip("tqdm")
+    ingest = importlib.reload(importlib.import_module("utils.ingest_knowledge_base"))
+    host, port = servers["qdrant"].server_address[:2]
+
+    assert (ingest.QDRANT_HOST, ingest.QDRANT_PORT) == (host, port)
+    qdrant = real_qdrant_client.QdrantClient(host=ingest.QDRANT_HOST, port=ingest.QDRANT_PORT, timeout=20)
+    assert [c.name for c in qdrant.get_collections().collections] == servers["qdrant"].config["collections"]
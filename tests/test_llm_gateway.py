@@ -0,0 +1,75 @@
+import pytest
+
+from utils import llm_gateway
+from utils import resilience
+
+
+class RecordingClient:
+    """Non-pool client that streams a short answer and counts the calls that reached it."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def chat(self, stream=False, **kwargs):
+        self.calls += 1
+        return self._stream()
+
+    def _stream(self):
+        yield {"message": {"role": "assistant", "content": "คำตอบ"}, "done": False}
+        yield {"message": {"role": "assistant", "content": ""}, "done": True}
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    """A breaker that has just opened after one backend failure."""
+    breaker = resilience.CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    monkeypatch.setattr(resilience, "ollama_breaker", breaker)
+    return breaker
+
+
+@pytest.fixture
+def telemetry(monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm_gateway.llm_telemetry, "record_call", lambda *args, **kwargs: calls.append(kwargs))
+    return calls
+
+
+def _stream(client):
+    return list(llm_gateway.chat_stream(client, task="call_chatbot", messages=[{"role": "user", "content": "คำถาม"}]))
+
+
+def test_open_breaker_rejects_stream_before_calling_ollama(breaker, telemetry):
+    client = RecordingClient()
+
+    with pytest.raises(resilience.CircuitOpenError):
+        _stream(client)
+
+    assert client.calls == 0
+    assert telemetry == []
+    assert breaker.stats() == {"state": "open", "consecutive_failures": 1, "rejected": 1}
+
+
+def test_rejected_stream_leaves_the_half_open_trial_in_flight(breaker, telemetry):
+    breaker._opened_at -= breaker.reset_seconds
+    breaker.allow()  # request อื่นได้ trial ของช่วง half-open ไปแล้ว
+
+    client = RecordingClient()
+    with pytest.raises(resilience.CircuitOpenError):
+        _stream(client)
+
+    # trial เดิมยังค้างอยู่ จึงยังไม่มี request ที่สองผ่านไปถึง Ollama
+    assert client.calls == 0
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.allow()
+    assert breaker.stats()["consecutive_failures"] == 1
+
+    breaker.record_success()
+    assert len(_stream(client)) == 2
+    assert client.calls == 1
+    assert telemetry[-1]["status"] == "ok"
+
+
+def test_circuit_open_error_is_not_a_backend_failure():
+    assert not resilience.is_backend_failure(resilience.CircuitOpenError("open"))
+    assert resilience.is_backend_failure(ConnectionError("connection refused"))
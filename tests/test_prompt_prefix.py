@@ -0,0 +1,107 @@
+import re
+
+import pytest
+
+from utils import llm_helper
+
+# Ollama นำ KV-cache กลับมาใช้ได้เฉพาะส่วนต้นของ prompt ที่เหมือนกันทุกไบต์
+# ข้อมูลของแต่ละ request (คำถาม, context, ฟิลด์ที่สกัด) จึงต้องอยู่หลังส่วนที่คงที่เสมอ
+
+
+def _leading_bytes(messages: list) -> list:
+    """Every message but the last (per-request) one, as the exact bytes sent to the model."""
+    return [(m['role'], m['content'].encode("utf-8")) for m in messages[:-1]]
+
+
+def _assert_no_placeholders(system_prompt: str):
+    # placeholder ที่ไม่ได้ format จะถูกส่งถึงโมเดลตรงตัว เช่น "{our_department_name}"
+    assert re.search(r"\{[a-z_]+\}", system_prompt) is None
+
+
+def _sent_messages(monkeypatch, content: str, call) -> list:
+    """Runs `call()` against a gateway that answers `content` and returns the messages it was sent."""
+    sent = []
+
+    def chat(client, **kwargs):
+        sent.append(kwargs["messages"])
+        return {"message": {"role": "assistant", "content": content}, "done": True}
+
+    monkeypatch.setattr(llm_helper.llm_gateway, "chat", chat)
+    monkeypatch.setattr(llm_helper, "ollama_available", lambda: True)
+    call()
+    return sent[-1]
+
+
+def test_chatbot_prefix_is_identical_across_questions():
+    history = [
+        {'role': 'system', 'content': "สรุปบทสนทนาก่อนหน้า:\nผู้ใช้ถามเรื่องหนังสือภายใน"},
+        {'role': 'user', 'content': "หนังสือภายในคืออะไร"},
+        {'role': 'assistant', 'content': "หนังสือภายในคือหนังสือติดต่อราชการภายในกระทรวงเดียวกัน"},
+    ]
+    first = llm_helper._build_chatbot_messages("ใช้คำว่าเรียนกับเสนอต่างกันอย่างไร", "ระเบียบสารบรรณ ข้อ ๑๑", history)
+    second = llm_helper._build_chatbot_messages("บันทึกข้อความคืออะไร", "ระเบียบสารบรรณ ข้อ ๑๓", history)
+
+    assert first[0] == {'role': 'system', 'content': llm_helper.CHATBOT_SYSTEM_PROMPT}
+    assert _leading_bytes(first) == _leading_bytes(second)
+    assert first[-1] != second[-1]
+    _assert_no_placeholders(first[0]['content'])
+    _assert_no_placeholders(llm_helper.CHATBOT_SYSTEM_PROMPT)
+
+
+@pytest.mark.parametrize("reply_intent", sorted(llm_helper.REPLY_INTENT_ADDENDUMS))
+def test_reply_system_prompt_is_identical_across_letters(reply_intent):
+    first_system, first_user = llm_helper._build_prompts_for_intent(
+        reply_intent,
+        {"subject": "ขอเชิญประชุม", "user_provided_opening_paragraph": "๑. ตามที่ ..."},
+        {"our_department_name": "กวก.ศซบ.ทหาร"},
+    )
+    second_system, second_user = llm_helper._build_prompts_for_intent(
+        reply_intent,
+        {"subject": "ขอรับการสนับสนุนบุคลากร", "user_provided_opening_paragraph": "๑. อ้างถึง ..."},
+        {"our_department_name": "กธก.ศซบ.ทหาร"},
+    )
+
+    expected = llm_helper.REPLY_SYSTEM_PROMPT_BASE + llm_helper.REPLY_INTENT_ADDENDUMS[reply_intent]
+    assert first_system.encode("utf-8") == second_system.encode("utf-8") == expected.encode("utf-8")
+    assert first_user != second_user
+    _assert_no_placeholders(first_system)
+
+
+@pytest.mark.parametrize("doc_type", sorted(llm_helper.PROMPT_TEMPLATES))
+def test_draft_prefix_is_identical_across_inputs(doc_type):
+    first = llm_helper._build_draft_messages("ขออนุมัติจัดซื้อวัสดุสำนักงาน", doc_type, "เป็นทางการ")
+    second = llm_helper._build_draft_messages("ขอเชิญร่วมประชุมประจำเดือน", doc_type, "กึ่งทางการ")
+
+    assert _leading_bytes(first) == _leading_bytes(second)
+    assert first[-1] != second[-1]
+    _assert_no_placeholders(first[0]['content'])
+
+
+@pytest.mark.parametrize("document_type", ["บันทึกข้อความ", "กระดาษข่าวร่วม (ทท.)"])
+def test_extraction_prefix_is_identical_across_documents(document_type, monkeypatch):
+    system_prompt, user_prompt_template, _ = llm_helper.get_extraction(document_type)
+
+    def extract(ocr_text):
+        return _sent_messages(monkeypatch, "{}", lambda: llm_helper.extract_structured_data(
+            object(), ocr_text, document_type, system_prompt, user_prompt_template))
+
+    first = extract("เรื่อง ขอเชิญประชุมประจำเดือน\nเรียน ผอ.กวก.ศซบ.ทหาร")
+    second = extract("เรื่อง ขอรับการสนับสนุนบุคลากร\nเรียน ผอ.กธก.ศซบ.ทหาร")
+
+    assert _leading_bytes(first) == _leading_bytes(second)
+    assert first[-1] != second[-1]
+    _assert_no_placeholders(first[0]['content'])
+
+
+def test_reply_sec1_prefix_is_identical_across_letters(monkeypatch):
+    answer = '{"style_1": "๑. ตามที่ ...", "style_2": "๑. ด้วย ...", "style_3": "๑. อ้างถึง ..."}'
+
+    def draft_sec1(extracted_info, ocr_text):
+        return _sent_messages(monkeypatch, answer, lambda: llm_helper.replySec1_generation(object(), extracted_info, ocr_text))
+
+    first = draft_sec1({"department": "กวก.ศซบ.ทหาร", "subject": "ขอเชิญประชุม"}, "เรื่อง ขอเชิญประชุมประจำเดือน")
+    second = draft_sec1({"department": "กธก.ศซบ.ทหาร", "subject": "ขอรับการสนับสนุนบุคลากร"}, "เรื่อง ขอรับการสนับสนุน")
+
+    assert _leading_bytes(first) == _leading_bytes(second)
+    assert first[-1] != second[-1]
+    _assert_no_placeholders(first[0]['content'])
@@ -0,0 +1,160 @@
+import os
+import csv
+import json
+import time
+import argparse
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.llm_gateway import acting_as, LLM_MAX_CONCURRENCY
+from utils.prefetch_helper import input_fingerprint
+from utils.llm_clients import get_ollama_client, ollama_available
+from utils.llm_helper import draft_generation
+
+BULK_DRAFT_WORKERS = int(os.getenv("BULK_DRAFT_WORKERS", str(LLM_MAX_CONCURRENCY)))
+DEFAULT_DOC_TYPE = "กระดาษข่าวร่วม (ทท.)"
+DEFAULT_FORMALITY_LEVEL = "เป็นทางการ"
+JOB_FIELDS = ["user_prompt", "doc_type", "formality_level", "doc_salutation"]
+RESULT_FIELDS = ["job_id", "index"] + JOB_FIELDS + ["status", "draft", "seconds"]
+# draft_generation คืนข้อความแจ้งข้อผิดพลาดแทนการ raise จึงใช้คำขึ้นต้นเหล่านี้แยกผลที่ล้มเหลว
+DRAFT_ERROR_PREFIXES = ("เกิดข้อผิดพลาด", "ระบบ AI ไม่พร้อมใช้งาน")
+
+
+def normalize_job(job) -> dict:
+    """Accepts a dict or a `(user_prompt, doc_type, formality_level, doc_salutation)` tuple."""
+    if not isinstance(job, dict):
+        job = dict(zip(JOB_FIELDS, job))
+    return {
+        "user_prompt": (job.get("user_prompt") or "").strip(),
+        "doc_type": (job.get("doc_type") or "").strip() or DEFAULT_DOC_TYPE,
+        "formality_level": (job.get("formality_level") or "").strip() or DEFAULT_FORMALITY_LEVEL,
+        "doc_salutation": (job.get("doc_salutation") or "").strip(),
+    }
+
+
+def load_jobs_csv(file) -> list:
+    """Reads jobs from a CSV path or text file object with a header row naming `JOB_FIELDS`."""
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, newline="", encoding="utf-8-sig") as f:
+            return load_jobs_csv(f)
+    return [normalize_job(row) for row in csv.DictReader(file) if (row.get("user_prompt") or "").strip()]
+
+
+def job_id(index: int, job: dict) -> str:
+    return f"{index}-{input_fingerprint(*(job[field] for field in JOB_FIELDS))[:12]}"
+
+
+def completed_job_ids(output_path: str) -> set:
+    """Ids of jobs already drafted successfully in `output_path`, so a rerun can resume."""
+    if not os.path.exists(output_path):
+        return set()
+    done = set()
+    with open(output_path, newline="", encoding="utf-8") as f:
+        if output_path.endswith(".jsonl"):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            if row.get("status") == "ok":
+                done.add(row["job_id"])
+    return done
+
+
+class _ResultWriter:
+    """Appends one result per line and flushes it, so finished drafts survive a crash."""
+
+    def __init__(self, output_path: str):
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        self.is_jsonl = output_path.endswith(".jsonl")
+        is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self._file = open(output_path, "a", newline="", encoding="utf-8")
+        if not self.is_jsonl:
+            self._csv = csv.DictWriter(self._file, fieldnames=RESULT_FIELDS)
+            if is_new:
+                self._csv.writeheader()
+
+    def write(self, result: dict):
+        if self.is_jsonl:
+            self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        else:
+            self._csv.writerow(result)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _draft_one(client, batch_user_id: str, index: int, job: dict) -> dict:
+    started_at = time.perf_counter()
+    # งานทั้ง batch เข้าคิว gateway ในนามผู้ใช้เดียว ผู้ใช้ที่ร่างผ่านหน้าเว็บจึงยังได้คิวสลับกับ batch ตามปกติ
+    with acting_as(batch_user_id):
+        draft = draft_generation(client, job["user_prompt"], job["doc_type"], job["formality_level"], job["doc_salutation"])
+    status = "error" if draft.startswith(DRAFT_ERROR_PREFIXES) else "ok"
+    return dict(
+        job,
+        job_id=job_id(index, job),
+        index=index,
+        status=status,
+        draft=draft,
+        seconds=round(time.perf_counter() - started_at, 2),
+    )
+
+
+def run_bulk_drafts(client, jobs, output_path: str, max_workers: int = BULK_DRAFT_WORKERS, batch_user_id: str = None):
+    """Drafts every job with at most `max_workers` in flight, appending each result to `output_path` (.csv or .jsonl).
+
+    Yields `(result, finished, total)` as each job finishes. Jobs already drafted
+    successfully in `output_path` are skipped, so rerunning after a crash resumes.
+    """
+    jobs = [normalize_job(job) for job in jobs]
+    done_ids = completed_job_ids(output_path)
+    pending = [(index, job) for index, job in enumerate(jobs) if job_id(index, job) not in done_ids]
+    total = len(jobs)
+    finished = total - len(pending)
+    if not pending:
+        return
+
+    batch_user_id = batch_user_id or f"bulk-{os.path.basename(output_path)}"
+    writer = _ResultWriter(output_path)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="bulk-draft") as executor:
+            futures = [executor.submit(_draft_one, client, batch_user_id, index, job) for index, job in pending]
+            try:
+                for future in as_completed(futures):
+                    result = future.result()
+                    writer.write(result)
+                    finished += 1
+                    yield result, finished, total
+            finally:
+                # ถ้าผู้เรียกหยุดกลางทาง ให้ยกเลิกงานที่ยังไม่เริ่ม งานที่เสร็จแล้วถูกเขียนลงไฟล์ไปแล้ว
+                for future in futures:
+                    future.cancel()
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Draft many documents from a CSV of short notes.")
+    parser.add_argument("input_csv", help="CSV with columns: " + ", ".join(JOB_FIELDS))
+    parser.add_argument("output", help="Results file (.csv or .jsonl); rerunning with the same file resumes.")
+    parser.add_argument("--workers", type=int, default=BULK_DRAFT_WORKERS)
+    args = parser.parse_args()
+
+    client = get_ollama_client()
+    # CLI ไม่มีเวลารอรอบ health check ใน background จึงตรวจทุกเครื่องหนึ่งครั้งก่อนเริ่ม
+    client.check_health()
+    if not ollama_available():
+        raise SystemExit("❌ Ollama is not available.")
+
+    jobs = load_jobs_csv(args.input_csv)
+    print(f"📄 {len(jobs)} job(s) from '{args.input_csv}' -> '{args.output}' ({args.workers} worker(s))")
+    failed = 0
+    for result, finished, total in run_bulk_drafts(client, jobs, args.output, max_workers=args.workers):
+        if result["status"] != "ok":
+            failed += 1
+        print(f"[{finished}/{total}] #{result['index']} {result['status']} ({result['seconds']}s)")
+    print(f"--- ✅ Bulk drafting finished, {failed} failed. ---")
+
+
+if __name__ == "__main__":
+    main()
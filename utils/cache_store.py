@@ -0,0 +1,137 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+CACHE_DIR = os.getenv("APP_CACHE_DIR", "cache")
+
+
+class TieredCache:
+    """Two-tier key/value cache: an in-memory LRU in front of a SQLite file.
+
+    Values must be JSON-serialisable. Every entry carries a `version` string; a
+    lookup with a different version is treated as a miss and the stale entry is
+    dropped, so bumping a version can never serve old results.
+    """
+
+    def __init__(self, db_path: str, max_memory_items: int = 256, max_disk_bytes: int = 200 * 1024 * 1024,
+                 ttl_seconds: float = 7 * 24 * 3600):
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+        self._conn = None
+        try:
+            db_dir = os.path.dirname(db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, version TEXT, value TEXT,"
+                " size INTEGER, created_at REAL, last_access REAL)"
+            )
+            self._conn.commit()
+        except Exception as e:
+            print(f"⚠️ Cache database '{db_path}' unavailable, using memory only: {e}")
+            self._conn = None
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, key: str, version: str = ""):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, entry_version, created_at = entry
+                if entry_version == version and not self._is_expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT version, value, created_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry_version, raw_value, created_at = row
+                    if entry_version == version and not self._is_expired(created_at, now):
+                        self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                        value = json.loads(raw_value)
+                        self._remember(key, value, version, created_at)
+                        self._stats["disk_hits"] += 1
+                        return value
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self._stats["stale"] += 1
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value, version: str = ""):
+        now = time.time()
+        raw_value = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, value, version, now)
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, version, value, size, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, version, raw_value, len(raw_value.encode("utf-8")), now, now)
+            )
+            self._evict_disk(now)
+            self._conn.commit()
+
+    def discard(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM entries")
+                self._conn.commit()
+
+    def _remember(self, key, value, version, created_at):
+        self._memory[key] = (value, version, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now: float):
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl_seconds,))
+        total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total_size <= self.max_disk_bytes:
+            return
+        # ลบรายการที่ไม่ได้ใช้นานที่สุดจนเหลือประมาณ 90% ของขนาดที่กำหนด
+        target_size = int(self.max_disk_bytes * 0.9)
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC").fetchall():
+            if total_size <= target_size:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._memory.pop(key, None)
+            total_size -= size
+            self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,112 @@
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from utils import llm_gateway
+from utils import token_budget
+
+CHAT_MEMORY_RECENT_TURNS = int(os.getenv("CHAT_MEMORY_RECENT_TURNS", "3"))
+CHAT_MEMORY_SUMMARY_TOKENS = int(os.getenv("CHAT_MEMORY_SUMMARY_TOKENS", "400"))
+SUMMARY_WORKERS = int(os.getenv("CHAT_MEMORY_SUMMARY_WORKERS", "2"))
+
+SUMMARY_SYSTEM_PROMPT = """คุณคือผู้ช่วยสรุปบทสนทนา ภารกิจของคุณคือรวม "สรุปเดิม" กับ "บทสนทนาช่วงใหม่" ให้เป็นสรุปเดียวที่กระชับ
+- เก็บเฉพาะข้อเท็จจริง หัวข้อที่ผู้ใช้ถาม และข้อสรุปสำคัญที่ AI ตอบไป เพื่อใช้ตอบคำถามต่อเนื่องในภายหลัง
+- เขียนเป็นภาษาไทยแบบย่อหน้าเดียวหรือ bullet สั้นๆ ห้ามเกินความยาวที่กำหนด
+- ตอบกลับเฉพาะสรุปเท่านั้น ไม่ต้องมีคำอธิบายอื่น"""
+
+_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="chat-memory")
+
+
+class ConversationMemory:
+    """Rolling summary of the turns that fell out of the verbatim window.
+
+    `summarized_upto` is the number of leading messages already folded into `summary`.
+    """
+
+    def __init__(self):
+        self.summary = ""
+        self.summarized_upto = 0
+        self._lock = threading.Lock()
+        self._refreshing = None
+
+
+def _recent_start(messages: list, recent_turns: int) -> int:
+    """Index of the first message kept verbatim: the last `recent_turns` turns before the current question."""
+    # ข้อความสุดท้ายคือคำถามปัจจุบัน ซึ่ง _build_chatbot_messages ใส่ให้เองพร้อม context
+    return max(0, len(messages) - 1 - 2 * recent_turns)
+
+
+def memory_messages(memory: ConversationMemory, messages: list, recent_turns: int = CHAT_MEMORY_RECENT_TURNS) -> list:
+    """Chat messages to place between the system prompt and the current question:
+    the rolling summary (if any) followed by the most recent turns verbatim."""
+    history = []
+    if memory is not None:
+        with memory._lock:
+            summary = memory.summary
+        if summary:
+            history.append({'role': 'system', 'content': f"สรุปบทสนทนาก่อนหน้า:\n{summary}"})
+    for message in messages[_recent_start(messages, recent_turns):-1]:
+        if message['role'] in ('user', 'assistant') and message['content']:
+            history.append({'role': message['role'], 'content': message['content']})
+    return history
+
+
+def _format_turns(messages: list) -> str:
+    speakers = {'user': "ผู้ใช้", 'assistant': "AI"}
+    return "\n".join(f"{speakers[m['role']]}: {m['content']}" for m in messages if m['role'] in speakers)
+
+
+def _summarize(client, previous_summary: str, messages: list) -> str:
+    user_prompt = f"""สรุปเดิม:
+{previous_summary or "(ยังไม่มี)"}
+
+บทสนทนาช่วงใหม่:
+{_format_turns(messages)}
+
+จงเขียนสรุปรวมใหม่ ความยาวไม่เกินประมาณ {CHAT_MEMORY_SUMMARY_TOKENS} token"""
+    response = llm_gateway.chat(
+        client,
+        task="summarize_chat_memory",
+        messages=[
+            {'role': 'system', 'content': SUMMARY_SYSTEM_PROMPT},
+            {'role': 'user', 'content': user_prompt}
+        ],
+        options={'temperature': 0.1, 'num_predict': CHAT_MEMORY_SUMMARY_TOKENS}
+    )
+    # num_predict จำกัดความยาวอยู่แล้ว แต่ตัดซ้ำด้วย tokenizer เพื่อรับประกันว่าสรุปไม่เกิน budget
+    return token_budget.trim_tail(response['message']['content'].strip(), CHAT_MEMORY_SUMMARY_TOKENS)
+
+
+def _refresh(client, memory: ConversationMemory, previous_summary: str, new_messages: list, upto: int):
+    try:
+        summary = _summarize(client, previous_summary, new_messages)
+        with memory._lock:
+            memory.summary = summary
+            memory.summarized_upto = upto
+    except Exception as e:
+        # สรุปไม่สำเร็จก็ไม่กระทบการตอบ รอบถัดไปจะนำข้อความชุดเดิมมาสรุปใหม่
+        print(f"WARN [chat_memory]: summary refresh failed: {e}")
+    finally:
+        with memory._lock:
+            memory._refreshing = None
+
+
+def refresh_summary_async(client, memory: ConversationMemory, messages: list, recent_turns: int = CHAT_MEMORY_RECENT_TURNS):
+    """Folds turns that have left the verbatim window into the summary in the background.
+
+    Call after an answer has been appended; at most one refresh runs per conversation.
+    """
+    # หลังคำตอบถูกเพิ่มแล้ว ข้อความที่จะยังส่งแบบเต็มในคำถามถัดไปคือ recent_turns รอบล่าสุด
+    window_start = max(0, len(messages) - 2 * recent_turns)
+    with memory._lock:
+        if memory._refreshing is not None or window_start <= memory.summarized_upto:
+            return
+        previous_summary = memory.summary
+        new_messages = messages[memory.summarized_upto:window_start]
+        user_id = llm_gateway.current_user_id()
+        memory._refreshing = _executor.submit(_run_as, user_id, _refresh, client, memory, previous_summary, new_messages, window_start)
+
+
+def _run_as(user_id, fn, *args):
+    with llm_gateway.acting_as(user_id):
+        return fn(*args)
@@ -0,0 +1,468 @@
+# เซิร์ฟเวอร์จำลอง Ollama, typhoon-ocr และ Qdrant สำหรับวัดประสิทธิภาพ/ทดสอบโหลดบนเครื่องที่ไม่มี GPU
+# รองรับเฉพาะส่วนของ API ที่แอปใช้จริง:
+#   Ollama: /api/chat, /api/generate (ทั้ง stream และไม่ stream), /api/tags
+#   typhoon-ocr: /process
+#   Qdrant: คำสั่ง collection ตอนเริ่มแอป และ /collections/{name}/points/search
+# วิธีใช้: python -m utils.fake_services --config fake_services.json แล้ว export ตัวแปรที่พิมพ์ออกมาก่อนรัน streamlit
+# หรือเรียก start_fake_services() ในโปรเซสเดียวกัน แล้วตั้งค่า service_env() ก่อน import โมดูลของแอป
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+
+from copy import deepcopy
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ประมาณจำนวน token จากความยาวข้อความ (อัตราเดียวกับที่ token_budget ใช้เมื่อโหลด tokenizer ไม่ได้)
+CHARS_PER_TOKEN = 2
+
+# latency แต่ละแบบ: {"distribution": "constant" | "uniform" | "normal" | "lognormal", ...}
+# constant: seconds / uniform: low, high / normal: mean, stddev / lognormal: median, sigma
+DEFAULT_CONFIG = {
+    "ollama": {
+        "models": [
+            "scb10x/llama3.1-typhoon2-8b-instruct:latest",
+            "scb10x/llama3.2-typhoon2-3b-instruct:latest",
+        ],
+        "num_parallel": 2,
+        # เวลาคงที่ต่อ request ก่อนเริ่มประมวลผล prompt (เช่น scheduling ใน Ollama)
+        "latency": {"distribution": "lognormal", "median": 0.05, "sigma": 0.3},
+        "prompt_tokens_per_second": 1500,
+        "eval_tokens_per_second": 25,
+        # เวลาโหลดโมเดลครั้งแรกของแต่ละโมเดล (จำลอง cold start)
+        "load_seconds": 0.0,
+        # คำตอบสำเร็จรูป: ใช้ content ของรายการแรกที่ match (regex) กับข้อความใน messages/prompt
+        "responses": [
+            {"match": "คุณคือ AI คัดแยกคำถาม", "content": "ระเบียบสารบรรณ"},
+            {"match": "style_1", "content": json.dumps({
+                "style_1": "๑. ด้วย หน่วยทดสอบ มีความประสงค์ขอรับการสนับสนุนตามที่อ้างถึง รายละเอียดตามสิ่งที่ส่งมาด้วย",
+                "style_2": "๑. ตามที่อ้างถึง หน่วยทดสอบ ได้ขอรับการสนับสนุน รายละเอียดปรากฏตามหนังสือที่อ้างถึงนั้น",
+                "style_3": "๑. ตามหนังสือที่อ้างถึง แจ้งความประสงค์ขอรับการสนับสนุนจากหน่วย ความละเอียดแจ้งแล้ว นั้น",
+            }, ensure_ascii=False)},
+        ],
+        "default_response": (
+            "เรียน ผู้บังคับบัญชา ตามที่ได้รับมอบหมายให้ดำเนินการในเรื่องดังกล่าว บัดนี้ได้ดำเนินการเสร็จเรียบร้อยแล้ว "
+            "รายละเอียดตามสิ่งที่ส่งมาด้วย จึงเรียนมาเพื่อกรุณาทราบ"
+        ),
+        # ค่าของ field ประเภท string เมื่อ request ระบุ format เป็น JSON schema
+        "schema_string_value": "ข้อมูลทดสอบ",
+    },
+    "ocr": {
+        # typhoon-ocr ประมวลผลทีละภาพ
+        "num_parallel": 1,
+        "latency": {"distribution": "lognormal", "median": 4.0, "sigma": 0.3},
+        "error_rate": 0.0,
+        # ข้อความของแต่ละหน้า: ภาพเดียวกันได้ข้อความเดิมเสมอ
+        "pages": [
+            "บันทึกข้อความ\nส่วนราชการ หน่วยทดสอบ โทร. ๐ ๒๐๐๐ ๐๐๐๐\nที่ กห ๐๐๐๐/๑๒๓ วันที่ ๑ มกราคม ๒๕๖๘\n"
+            "เรื่อง ขอรับการสนับสนุน\nเรียน ผู้บังคับบัญชา\n๑. ด้วย หน่วยทดสอบ มีความประสงค์ขอรับการสนับสนุนการดำเนินงาน",
+            "๒. พิจารณาแล้ว เห็นควรอนุมัติตามที่เสนอ\nจึงเรียนมาเพื่อกรุณาพิจารณา\nพ.อ. ทดสอบ ระบบ\n(ทดสอบ ระบบ)",
+        ],
+    },
+    "qdrant": {
+        "version": "1.14.0",
+        "latency": {"distribution": "lognormal", "median": 0.01, "sigma": 0.3},
+        "collections": ["rtarf_knowledge_base"],
+        # ผลค้นหาสำเร็จรูป (payload) กรองด้วย filter ของ source_file แบบเดียวกับ Qdrant จริง
+        "hits": [
+            {"text": "## การใช้งานระบบ เลือกเมนูร่างหนังสือราชการ แล้วพิมพ์ข้อความที่ต้องการ", "source_file": "system_manual", "page_number": 1},
+            {"text": "หนังสือราชการ มี ๖ ชนิด คือ หนังสือภายนอก หนังสือภายใน หนังสือประทับตรา หนังสือสั่งการ หนังสือประชาสัมพันธ์ และหนังสือที่เจ้าหน้าที่ทำขึ้น", "source_file": "ระเบียบสารบรรณ.pdf", "page_number": 3},
+            {"text": "การลงชื่อในหนังสือราชการ ให้ลงลายมือชื่อ พร้อมพิมพ์ชื่อเต็มไว้ใต้ลายมือชื่อ", "source_file": "ระเบียบสารบรรณ.pdf", "page_number": 12},
+        ],
+    },
+}
+
+
+def load_config(path: str = None) -> dict:
+    """`DEFAULT_CONFIG` with each service's keys overridden by the JSON file at `path`."""
+    config = deepcopy(DEFAULT_CONFIG)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for service, overrides in json.load(f).items():
+                config.setdefault(service, {}).update(overrides)
+    return config
+
+
+def sample_seconds(spec: dict) -> float:
+    distribution = spec.get("distribution", "constant")
+    if distribution == "constant":
+        seconds = spec.get("seconds", 0.0)
+    elif distribution == "uniform":
+        seconds = random.uniform(spec["low"], spec["high"])
+    elif distribution == "normal":
+        seconds = random.gauss(spec["mean"], spec["stddev"])
+    elif distribution == "lognormal":
+        seconds = spec["median"] * random.lognormvariate(0, spec["sigma"])
+    else:
+        raise ValueError(f"Unknown latency distribution '{distribution}'.")
+    return max(0.0, seconds)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 เพื่อให้ connection pool ของ client ใช้ connection ซ้ำได้เหมือนของจริง
+    protocol_version = "HTTP/1.1"
+    routes = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method: str):
+        path = self.path.split("?", 1)[0]
+        for (route_method, pattern), handler_name in self.routes.items():
+            match = re.fullmatch(pattern, path) if route_method == method else None
+            if match:
+                return getattr(self, handler_name)(*match.groups())
+        self.send_json({"error": f"no fake route for {method} {path}"}, status=404)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def read_json(self) -> dict:
+        body = self.read_body()
+        return json.loads(body) if body else {}
+
+    def send_json(self, payload, status: int = 200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_chunked(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class _FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler_class, config: dict):
+        super().__init__(address, handler_class)
+        self.config = config
+        # จำนวน request ที่ประมวลผลพร้อมกันได้ ที่เหลือรอคิวเหมือน OLLAMA_NUM_PARALLEL
+        self.slots = threading.Semaphore(config.get("num_parallel", 1_000_000))
+        self.lock = threading.Lock()
+        self.loaded_models = set()
+        self.requests_served = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class FakeOllamaHandler(_Handler):
+    routes = {
+        ("GET", r"/"): "handle_root",
+        ("GET", r"/api/tags"): "handle_tags",
+        ("POST", r"/api/chat"): "handle_chat",
+        ("POST", r"/api/generate"): "handle_generate",
+    }
+
+    def handle_root(self):
+        body = b"Ollama is running"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_tags(self):
+        models = [
+            {"name": name, "model": name, "modified_at": _now(), "size": 0, "digest": hashlib.sha256(name.encode()).hexdigest(), "details": {}}
+            for name in self.server.config["models"]
+        ]
+        self.send_json({"models": models})
+
+    def handle_chat(self):
+        request = self.read_json()
+        prompt = "\n".join(m.get("content") or "" for m in request.get("messages", []))
+        self._respond(request, prompt, lambda text: {"message": {"role": "assistant", "content": text}})
+
+    def handle_generate(self):
+        request = self.read_json()
+        self._respond(request, request.get("prompt") or "", lambda text: {"response": text})
+
+    def _canned_content(self, request: dict, prompt: str) -> str:
+        config = self.server.config
+        if isinstance(request.get("format"), dict):
+            return json.dumps(_sample_from_schema(request["format"], config["schema_string_value"]), ensure_ascii=False)
+        for response in config["responses"]:
+            if re.search(response["match"], prompt):
+                return response["content"]
+        return config["default_response"]
+
+    def _respond(self, request: dict, prompt: str, wrap):
+        config = self.server.config
+        model = request.get("model", "")
+        if model not in config["models"]:
+            self.send_json({"error": f"model '{model}' not found"}, status=404)
+            return
+
+        content = self._canned_content(request, prompt)
+        num_predict = (request.get("options") or {}).get("num_predict")
+        pieces = [content[i:i + CHARS_PER_TOKEN] for i in range(0, len(content), CHARS_PER_TOKEN)]
+        if num_predict is not None and num_predict >= 0:
+            pieces = pieces[:num_predict]
+        stream = request.get("stream", True)
+
+        with self.server.slots:
+            started = time.perf_counter()
+            time.sleep(sample_seconds(config["latency"]))
+            with self.server.lock:
+                cold = model not in self.server.loaded_models
+                self.server.loaded_models.add(model)
+                self.server.requests_served += 1
+            load_seconds = config["load_seconds"] if cold else 0.0
+            prompt_tokens = estimate_tokens(prompt)
+            prompt_seconds = prompt_tokens / config["prompt_tokens_per_second"]
+            time.sleep(load_seconds + prompt_seconds)
+
+            token_seconds = 1 / config["eval_tokens_per_second"]
+            eval_started = time.perf_counter()
+            if stream:
+                self.start_chunked("application/x-ndjson")
+            try:
+                for piece in pieces:
+                    time.sleep(token_seconds)
+                    if stream:
+                        chunk = dict(wrap(piece), model=model, created_at=_now(), done=False)
+                        self.write_chunk(json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # client ปิด stream กลางทาง (ผู้ใช้กดหยุด) Ollama จริงก็หยุดสร้างคำตอบเช่นกัน
+                self.close_connection = True
+                return
+            finished = time.perf_counter()
+
+        final = dict(
+            wrap("" if stream else "".join(pieces)),
+            model=model,
+            created_at=_now(),
+            done=True,
+            done_reason="length" if num_predict is not None and len(pieces) == num_predict else "stop",
+            total_duration=int((finished - started) * 1e9),
+            load_duration=int(load_seconds * 1e9),
+            prompt_eval_count=prompt_tokens,
+            prompt_eval_duration=int(prompt_seconds * 1e9),
+            eval_count=len(pieces),
+            eval_duration=int((finished - eval_started) * 1e9),
+        )
+        try:
+            if stream:
+                self.write_chunk(json.dumps(final, ensure_ascii=False).encode("utf-8") + b"\n")
+                self.end_chunked()
+            else:
+                self.send_json(final)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def _sample_from_schema(schema: dict, string_value: str, defs: dict = None):
+    """A minimal instance of a pydantic-generated JSON schema, for `format=` requests."""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return _sample_from_schema(defs[schema["$ref"].rsplit("/", 1)[-1]], string_value, defs)
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            options = [option for option in schema[key] if option.get("type") != "null"] or schema[key]
+            return _sample_from_schema(options[0], string_value, defs)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: _sample_from_schema(prop, string_value, defs) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_sample_from_schema(schema.get("items", {}), string_value, defs)] if schema.get("minItems") else []
+    if kind == "string":
+        return string_value[:schema.get("maxLength", len(string_value))]
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return None
+
+
+class FakeTyphoonOCRHandler(_Handler):
+    routes = {
+        ("GET", r"/docs"): "handle_docs",
+        ("POST", r"/process"): "handle_process",
+    }
+
+    def handle_docs(self):
+        self.send_json({"fake": "typhoon-ocr"})
+
+    def handle_process(self):
+        config = self.server.config
+        body = self.read_body()
+        with self.server.slots:
+            time.sleep(sample_seconds(config["latency"]))
+            with self.server.lock:
+                self.server.requests_served += 1
+            if random.random() < config["error_rate"]:
+                self.send_json({"detail": "fake OCR failure"}, status=500)
+                return
+        pages = config["pages"]
+        page = pages[int(hashlib.sha256(body).hexdigest(), 16) % len(pages)]
+        self.send_json({"result": page})
+
+
+class FakeQdrantHandler(_Handler):
+    routes = {
+        ("GET", r"/"): "handle_root",
+        ("GET", r"/collections"): "handle_collections",
+        ("GET", r"/collections/([^/]+)"): "handle_get_collection",
+        ("PUT", r"/collections/([^/]+)"): "handle_ok",
+        ("DELETE", r"/collections/([^/]+)"): "handle_ok",
+        ("PUT", r"/collections/([^/]+)/points"): "handle_upsert",
+        ("POST", r"/collections/([^/]+)/points/search"): "handle_search",
+    }
+
+    def _result(self, result, status: int = 200):
+        self.send_json({"result": result, "status": "ok", "time": 0.0}, status=status)
+
+    def handle_root(self):
+        self.send_json({"title": "qdrant - vector search engine", "version": self.server.config["version"]})
+
+    def handle_collections(self):
+        self._result({"collections": [{"name": name} for name in self.server.config["collections"]]})
+
+    def handle_get_collection(self, name):
+        # CollectionInfo เต็มรูปแบบไม่จำเป็นต่อการทดสอบโหลด ตอบ 404 ให้แอปถือว่ายังไม่มี collection
+        self.send_json({"status": {"error": f"Not found: Collection `{name}` doesn't exist!"}, "time": 0.0}, status=404)
+
+    def handle_ok(self, name):
+        self.read_body()
+        self._result(True)
+
+    def handle_upsert(self, name):
+        self.read_body()
+        self._result({"operation_id": 0, "status": "completed"})
+
+    def handle_search(self, name):
+        config = self.server.config
+        request = self.read_json()
+        with self.server.slots:
+            time.sleep(sample_seconds(config["latency"]))
+            with self.server.lock:
+                self.server.requests_served += 1
+        hits = [payload for payload in config["hits"] if _matches_filter(payload, request.get("filter"))]
+        limit = request.get("limit", 10)
+        self._result([
+            {"id": i, "version": 0, "score": round(0.9 - 0.05 * i, 4), "payload": payload, "vector": None}
+            for i, payload in enumerate(hits[:limit])
+        ])
+
+
+def _matches_filter(payload: dict, query_filter: dict) -> bool:
+    """Evaluates the `match.value` conditions of a Qdrant filter; other condition types are ignored."""
+    if not query_filter:
+        return True
+
+    def holds(condition):
+        return payload.get(condition.get("key")) == (condition.get("match") or {}).get("value")
+
+    must = query_filter.get("must") or []
+    must_not = query_filter.get("must_not") or []
+    return all(holds(c) for c in must) and not any(holds(c) for c in must_not)
+
+
+HANDLERS = {
+    "ollama": FakeOllamaHandler,
+    "ocr": FakeTyphoonOCRHandler,
+    "qdrant": FakeQdrantHandler,
+}
+
+
+def start_fake_services(config: dict = None, host: str = "127.0.0.1", ports: dict = None) -> dict:
+    """Starts each fake in a background thread; returns {service name: server}.
+
+    A port of 0 (the default) picks a free one; read it back from `server.url`.
+    """
+    config = config or load_config()
+    ports = ports or {}
+    servers = {}
+    for name, handler_class in HANDLERS.items():
+        server = _FakeServer((host, ports.get(name, 0)), handler_class, config[name])
+        threading.Thread(target=server.serve_forever, name=f"fake-{name}", daemon=True).start()
+        servers[name] = server
+    return servers
+
+
+def stop_fake_services(servers: dict):
+    for server in servers.values():
+        server.shutdown()
+        server.server_close()
+
+
+def service_env(servers: dict) -> dict:
+    """Environment variables that point the app at the fakes; set them before importing `utils`."""
+    qdrant_host, qdrant_port = servers["qdrant"].server_address[:2]
+    return {
+        "OLLAMA_HOSTS": servers["ollama"].url,
+        "TYPHOON_OCR_ENDPOINT": f"{servers['ocr'].url}/process",
+        "QDRANT_HOST": qdrant_host,
+        "QDRANT_PORT": str(qdrant_port),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama, typhoon-ocr and Qdrant servers for offline load testing.")
+    parser.add_argument("--config", help="JSON file overriding DEFAULT_CONFIG per service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ollama-port", type=int, default=11434)
+    parser.add_argument("--ocr-port", type=int, default=8000)
+    parser.add_argument("--qdrant-port", type=int, default=6333)
+    args = parser.parse_args()
+
+    servers = start_fake_services(
+        load_config(args.config),
+        host=args.host,
+        ports={"ollama": args.ollama_port, "ocr": args.ocr_port, "qdrant": args.qdrant_port},
+    )
+    print("🧪 Fake services are running. Point the app at them with:")
+    for key, value in service_env(servers).items():
+        print(f"export {key}={value}")
+    try:
+        while True:
+            time.sleep(60)
+            print("INFO [fake_services]: requests served " + ", ".join(f"{name}={server.requests_served}" for name, server in servers.items()))
+    except KeyboardInterrupt:
+        stop_fake_services(servers)
+
+
+if __name__ == "__main__":
+    main()
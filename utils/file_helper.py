@@ -1,8 +1,13 @@
 import streamlit as st # <<<--- เพิ่มบรรทัดนี้
+import os
+import re
 import base64
+import unicodedata
+import fitz
 import pandas as pd
 import datetime
 from pathlib import Path
+from PIL import Image
 
 # --- HELPER & CORE FUNCTIONS ---
 @st.cache_data
@@ -13,18 +18,6 @@ def image_to_base64(image_path: Path):
     except FileNotFoundError:
         return None
 
-# OLLAMA CONNECTION
-OLLAMA_HOST = 'http://ollama:11434'
-LLM_MODEL = 'scb10x/llama3.1-typhoon2-8b-instruct:latest'
-try:
-    client = ollama.Client(host=OLLAMA_HOST)
-    client.list()
-    OLLAMA_AVAILABLE = True
-except Exception as e:
-    OLLAMA_AVAILABLE = False
-    print(f"Ollama connection error: {e}")
-
-
 def save_feedback(original_text, edited_text, user_prompt):
     feedback_file = Path("feedback_log.csv")
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -68,4 +61,108 @@ def image_to_base64(image_path: Path):
             return base64.b64encode(f.read()).decode("utf-8")
     except FileNotFoundError:
         # คุณสามารถใส่โลโก้สำรองแบบ Base64 ที่นี่ได้ หรือแค่คืนค่า None
-        return None
\ No newline at end of file
+        return None
+
+
+# --- PDF TEXT LAYER (PyMuPDF) ---
+# หน้าที่มีชั้นข้อความดี (PDF จากระบบสารบรรณอิเล็กทรอนิกส์) อ่านด้วย PyMuPDF ได้ทันที ไม่ต้องส่ง OCR
+# หน้าสแกน (ภาพเต็มหน้า, ชั้นข้อความที่มองไม่เห็นจากเครื่องสแกน หรือ font ที่ถอดรหัสไม่ได้) ยังส่ง typhoon-ocr
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "100"))
+TEXT_LAYER_MIN_COVERAGE = float(os.getenv("TEXT_LAYER_MIN_COVERAGE", "0.02"))
+TEXT_LAYER_MAX_IMAGE_COVERAGE = float(os.getenv("TEXT_LAYER_MAX_IMAGE_COVERAGE", "0.5"))
+TEXT_LAYER_MIN_GLYPH_QUALITY = float(os.getenv("TEXT_LAYER_MIN_GLYPH_QUALITY", "0.995"))
+TEXT_LAYER_MIN_THAI_RATIO = float(os.getenv("TEXT_LAYER_MIN_THAI_RATIO", "0.3"))
+PAGE_SOURCE_TEXT_LAYER = "text_layer"
+PAGE_SOURCE_OCR = "ocr"
+
+# สระหลังและวรรณยุกต์ที่ขึ้นต้นคำไม่ได้ ถ้าพบตามหลังช่องว่างแสดงว่า font ของ PDF แมป glyph ผิด (เช่น "ส าเนา", "จ ำนวน")
+THAI_NON_INITIAL_MARKS = "\u0E30-\u0E3A\u0E45\u0E47-\u0E4E"
+_ORPHAN_MARK_PATTERN = re.compile(f"(?:^|\\s)[{THAI_NON_INITIAL_MARKS}]", re.MULTILINE)
+
+
+def glyph_quality(text: str) -> float:
+    """Share of non-space characters that are real, well-placed glyphs: not U+FFFD, private-use,
+    unassigned or control characters, and not Thai vowels/marks that have lost their base consonant."""
+    chars = [c for c in text if not c.isspace()]
+    if not chars:
+        return 0.0
+    bad = sum(1 for c in chars if c == "\ufffd" or unicodedata.category(c) in ("Co", "Cn", "Cc", "Cs"))
+    bad += len(_ORPHAN_MARK_PATTERN.findall(text))
+    return max(0.0, 1 - bad / len(chars))
+
+
+def classify_pdf_page(page) -> dict:
+    """Decides whether a PDF page's text layer can replace OCR, with the measurements behind the decision."""
+    page_area = abs(page.rect) or 1.0
+    visible_chars = invisible_chars = 0
+    for span in page.get_texttrace():
+        # type 3 = ข้อความที่มองไม่เห็น (ชั้น OCR ที่เครื่องสแกนฝังไว้ใต้ภาพ)
+        if span["type"] == 3 or span.get("opacity", 1) == 0:
+            invisible_chars += len(span["chars"])
+        else:
+            visible_chars += len(span["chars"])
+    image_coverage = max((abs(fitz.Rect(info["bbox"]) & page.rect) / page_area for info in page.get_image_info()), default=0.0)
+    text_blocks = [block for block in page.get_text("blocks") if block[6] == 0]
+    text_coverage = min(1.0, sum(abs(fitz.Rect(block[:4]) & page.rect) for block in text_blocks) / page_area)
+
+    text = page.get_text("text", sort=True) if visible_chars else ""
+    non_space = [c for c in text if not c.isspace()]
+    thai_ratio = sum(1 for c in non_space if "\u0E00" <= c <= "\u0E7F") / len(non_space) if non_space else 0.0
+    quality = glyph_quality(text)
+
+    uses_text_layer = (
+        visible_chars >= TEXT_LAYER_MIN_CHARS
+        and invisible_chars == 0
+        and text_coverage >= TEXT_LAYER_MIN_COVERAGE
+        and image_coverage <= TEXT_LAYER_MAX_IMAGE_COVERAGE
+        and quality >= TEXT_LAYER_MIN_GLYPH_QUALITY
+        and thai_ratio >= TEXT_LAYER_MIN_THAI_RATIO
+    )
+    return {
+        "page": page.number + 1,
+        "source": PAGE_SOURCE_TEXT_LAYER if uses_text_layer else PAGE_SOURCE_OCR,
+        "text": text.strip() if uses_text_layer else None,
+        "visible_chars": visible_chars,
+        "invisible_chars": invisible_chars,
+        "text_coverage": round(text_coverage, 3),
+        "image_coverage": round(image_coverage, 3),
+        "glyph_quality": round(quality, 4),
+        "thai_ratio": round(thai_ratio, 3),
+    }
+
+
+def classify_pdf_pages(pdf_bytes: bytes) -> list:
+    """`classify_pdf_page` for every page of a PDF, in page order."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        return [classify_pdf_page(page) for page in pdf_document]
+
+
+# --- PDF RENDERING (PyMuPDF) ---
+# เรนเดอร์หน้า PDF ใน process เดียวกันตรงลง pixel buffer แทน pdf2image ที่ต้องเรียก pdftoppm
+# ผ่านไฟล์ชั่วคราวและ encode/decode PNG ทุกหน้า; "gray" ได้ภาพเล็กกว่า RGB 3 เท่าสำหรับเอกสารขาวดำ
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "300"))
+PDF_RENDER_COLORSPACE = os.getenv("PDF_RENDER_COLORSPACE", "rgb")
+RENDER_COLORSPACES = {
+    "rgb": (fitz.csRGB, "RGB"),
+    "gray": (fitz.csGRAY, "L"),
+}
+
+
+def render_pdf_page(page, dpi: int = PDF_RENDER_DPI, colorspace: str = PDF_RENDER_COLORSPACE) -> Image.Image:
+    """Renders one PyMuPDF page to a PIL image ("RGB" or "L") without an intermediate file or PNG round-trip."""
+    if colorspace not in RENDER_COLORSPACES:
+        raise ValueError(f"Unknown colorspace '{colorspace}', expected one of {sorted(RENDER_COLORSPACES)}.")
+    fitz_colorspace, mode = RENDER_COLORSPACES[colorspace]
+    pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz_colorspace, alpha=False)
+    # frombytes คัดลอกข้อมูลออกจาก pixmap ครั้งเดียว ภาพที่ได้จึงใช้ต่อได้หลังปิดเอกสาร
+    return Image.frombytes(mode, (pixmap.width, pixmap.height), pixmap.samples_mv, "raw", mode, pixmap.stride)
+
+
+def render_pdf_pages(pdf_bytes: bytes, page_numbers: list = None, dpi: int = PDF_RENDER_DPI,
+                     colorspace: str = PDF_RENDER_COLORSPACE):
+    """Yields `(page_number, image)` for the given 1-based pages (all pages by default), one page at a time."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        if page_numbers is None:
+            page_numbers = range(1, pdf_document.page_count + 1)
+        for page_number in page_numbers:
+            yield page_number, render_pdf_page(pdf_document[page_number - 1], dpi=dpi, colorspace=colorspace)
@@ -7,10 +7,11 @@ import qdrant_client
 from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 from utils.llm_helper import SYSTEM_USAGE_KNOWLEDGE
+from utils.semantic_cache import mark_knowledge_base_updated
 
 KNOWLEDGE_BASE_DIR = "k_base"
-QDRANT_HOST = "qdrant"
-QDRANT_PORT = 6333
+QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
+QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
 EMBEDDING_MODEL_NAME = 'intfloat/multilingual-e5-large'
 COLLECTION_NAME = "rtarf_knowledge_base"  
 CHUNK_SIZE_LINES = 15
@@ -138,6 +139,8 @@ def initialize_knowledge_base(force_recreate: bool = False):
                 ),
                 wait=True
             )
+            # ฐานความรู้เปลี่ยน คำตอบที่ cache ไว้ของ chatbot จึงใช้ไม่ได้อีกต่อไป
+            mark_knowledge_base_updated()
             print("--- ✅ Knowledge Base Ingestion Process Completed! ---")
 
         except Exception as e:
@@ -0,0 +1,46 @@
+import os
+import json
+import hashlib
+
+from utils.cache_store import TieredCache, CACHE_DIR
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_DISK_MB = float(os.getenv("LLM_CACHE_MAX_DISK_MB", "200"))
+LLM_CACHE_MAX_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MAX_MEMORY_ITEMS", "256"))
+
+response_cache = TieredCache(
+    os.path.join(CACHE_DIR, "llm_responses.sqlite3"),
+    max_memory_items=LLM_CACHE_MAX_MEMORY_ITEMS,
+    max_disk_bytes=int(LLM_CACHE_MAX_DISK_MB * 1024 * 1024),
+    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+)
+
+
+def make_cache_key(chat_kwargs: dict) -> str:
+    """Content address of a chat request: model, messages, options and output format."""
+    payload = {
+        "model": chat_kwargs.get("model"),
+        "messages": chat_kwargs.get("messages"),
+        "options": chat_kwargs.get("options"),
+        "format": chat_kwargs.get("format"),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(key: str, template_version: str):
+    if not LLM_CACHE_ENABLED:
+        return None
+    return response_cache.get(key, version=template_version)
+
+
+def store_response(key: str, template_version: str, model: str, content: str):
+    if not LLM_CACHE_ENABLED:
+        return
+    response_cache.set(key, {
+        "model": model,
+        "message": {"role": "assistant", "content": content},
+        "done": True,
+        "cached": True,
+    }, version=template_version)
@@ -0,0 +1,39 @@
+import threading
+
+from utils import token_budget
+from utils.llm_warmup import start_keepalive_manager
+from utils.ollama_pool import ollama_pool
+from utils.task_models import tiered_models
+
+# registry ของ client ระดับ process: ทุกหน้าและ helper ใช้ pool เดียวกัน (connection แบบ keep-alive ชุดเดียว)
+# การเรียกครั้งแรกเริ่ม health check และ keep-alive ใน background โดยไม่รอ network
+_start_lock = threading.Lock()
+_started = False
+
+
+def get_ollama_client():
+    """The process-wide Ollama pool, usable wherever an `ollama.Client` is expected.
+
+    The first call starts the background health probe, model keep-alive and
+    tokenizer load; no call here waits on the network.
+    """
+    global _started
+    with _start_lock:
+        if not _started:
+            ollama_pool.start_health_checks()
+            # health check ไม่ได้โหลดโมเดล จึงสั่ง warm-up และ keep-alive แยกใน background
+            start_keepalive_manager(ollama_pool, tiered_models())
+            # โหลด tokenizer ไว้ก่อน request แรก (ใช้นับ token ตอนตัด prompt)
+            token_budget.preload_tokenizer()
+            print(f"✅ Ollama client registry started ({len(ollama_pool.endpoints)} endpoint(s)).")
+            _started = True
+    return ollama_pool
+
+
+def ollama_available() -> bool:
+    """Whether any endpoint passed its latest background health probe; reads cached state only.
+
+    Endpoints count as healthy until their first probe finishes, so a fresh
+    process does not show the AI as offline while it is still starting.
+    """
+    return any(endpoint["healthy"] for endpoint in ollama_pool.stats())
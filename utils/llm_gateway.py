@@ -0,0 +1,344 @@
+import os
+import threading
+import time
+
+import httpx
+
+from collections import deque
+from contextlib import contextmanager
+from utils import llm_cache
+from utils import llm_telemetry
+from utils import task_models
+from utils import resilience
+from utils.llm_warmup import LLM_KEEP_ALIVE
+from utils.ollama_pool import OLLAMA_HOSTS, OllamaPool
+
+# จำนวน request ที่ยอมให้เข้า Ollama พร้อมกัน: OLLAMA_NUM_PARALLEL ของแต่ละเครื่อง x จำนวนเครื่องใน pool
+LLM_PARALLEL_PER_HOST = int(os.getenv("LLM_PARALLEL_PER_HOST", "2"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", str(LLM_PARALLEL_PER_HOST * len(OLLAMA_HOSTS))))
+QUEUE_POLL_INTERVAL = 0.5
+
+_local = threading.local()
+
+
+def current_user_id() -> str:
+    """Identifies the caller: the Streamlit session when running in a page, otherwise the thread."""
+    user_id = getattr(_local, "user_id", None)
+    if user_id:
+        return user_id
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+        if ctx is not None:
+            return ctx.session_id
+    except Exception:
+        pass
+    return f"thread-{threading.get_ident()}"
+
+
+@contextmanager
+def acting_as(user_id: str):
+    """Attributes LLM calls made by this thread (e.g. a background prefetch) to `user_id`."""
+    previous = getattr(_local, "user_id", None)
+    _local.user_id = user_id
+    try:
+        yield
+    finally:
+        _local.user_id = previous
+
+
+@contextmanager
+def queue_listener(callback):
+    """Registers `callback(position)` for LLM calls made by this thread while waiting for a slot."""
+    stack = getattr(_local, "listeners", None)
+    if stack is None:
+        stack = _local.listeners = []
+    stack.append(callback)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def _current_listener():
+    stack = getattr(_local, "listeners", None)
+    return stack[-1] if stack else None
+
+
+class LLMGateway:
+    """Caps concurrent Ollama calls and hands out free slots fairly between users.
+
+    Each user has a FIFO queue; slots are granted round-robin across users so a
+    user with many pending calls cannot starve everyone else.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = {}
+        self._rotation = deque()
+
+    def _enqueue(self, user_id, ticket):
+        if user_id not in self._waiting:
+            self._waiting[user_id] = deque()
+            self._rotation.append(user_id)
+        self._waiting[user_id].append(ticket)
+
+    def _remove(self, user_id, ticket):
+        queue = self._waiting.get(user_id)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del self._waiting[user_id]
+            self._rotation.remove(user_id)
+
+    def _next_ticket(self):
+        if not self._rotation:
+            return None
+        return self._waiting[self._rotation[0]][0]
+
+    def _position(self, user_id, ticket) -> int:
+        """1-based position of `ticket` in the round-robin order of waiting calls."""
+        queue = self._waiting[user_id]
+        depth = queue.index(ticket)
+        position = 0
+        for other in self._rotation:
+            if other == user_id:
+                position += depth + 1
+                break
+            position += min(len(self._waiting[other]), depth + 1)
+        rotation = list(self._rotation)
+        for other in rotation[rotation.index(user_id) + 1:]:
+            position += min(len(self._waiting[other]), depth)
+        return position
+
+    def acquire(self, user_id: str = None, on_position=None):
+        user_id = user_id or current_user_id()
+        on_position = on_position or _current_listener()
+        ticket = object()
+        last_reported = None
+
+        with self._cond:
+            self._enqueue(user_id, ticket)
+        try:
+            while True:
+                with self._cond:
+                    if self._active < self.max_concurrency and self._next_ticket() is ticket:
+                        self._remove(user_id, ticket)
+                        # ย้ายผู้ใช้ไปท้ายรอบ เพื่อให้ผู้ใช้คนอื่นได้คิวถัดไป
+                        if user_id in self._waiting:
+                            self._rotation.remove(user_id)
+                            self._rotation.append(user_id)
+                        self._active += 1
+                        self._cond.notify_all()
+                        return
+                    position = self._position(user_id, ticket)
+                if on_position is not None and position != last_reported:
+                    on_position(position)
+                    last_reported = position
+                with self._cond:
+                    self._cond.wait(QUEUE_POLL_INTERVAL)
+        except BaseException:
+            with self._cond:
+                self._remove(user_id, ticket)
+                self._cond.notify_all()
+            raise
+
+    def release(self):
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, user_id: str = None, on_position=None):
+        self.acquire(user_id, on_position)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": sum(len(q) for q in self._waiting.values()),
+                "max_concurrency": self.max_concurrency,
+            }
+
+
+llm_gateway = LLMGateway()
+
+
+def _prepare(task: str, chat_kwargs: dict):
+    # ส่ง keep_alive ทุกครั้ง ไม่เช่นนั้น Ollama จะใช้ค่า default (5 นาที) และ unload โมเดลเร็วกว่าที่ตั้งไว้
+    chat_kwargs.setdefault("keep_alive", LLM_KEEP_ALIVE)
+    chat_kwargs.setdefault("model", task_models.model_for(task))
+    options = task_models.options_for(task, chat_kwargs.get("options"))
+    # gateway เป็นที่เดียวที่กำหนด num_ctx: ต้องเท่ากันทุก request ของโมเดลเดียวกัน ไม่เช่นนั้น Ollama จะ reload runner
+    # ผู้เรียกจึงไม่ส่ง num_ctx มาเอง แต่ตัด prompt ให้พอดีกับค่านี้ด้วย token_budget แทน
+    chat_kwargs["options"] = dict(options or {}, num_ctx=task_models.num_ctx_for(chat_kwargs["model"]))
+
+
+def _deadline_error(task: str, policy: dict, error: Exception) -> Exception:
+    if isinstance(error, httpx.TimeoutException):
+        return resilience.DeadlineExceeded(f"AI ไม่ตอบกลับภายใน {policy['deadline']} วินาที ('{task}')")
+    return error
+
+
+def _resilient_chat(client, task: str, chat_kwargs: dict):
+    """One logical chat call under the task's policy: a deadline over all attempts,
+    backoff retries on backend failures, optional hedging, and the circuit breaker."""
+    policy = resilience.policy_for(task)
+    deadline_at = time.monotonic() + policy["deadline"]
+    attempt = 0
+    while True:
+        resilience.ollama_breaker.allow()
+        remaining = deadline_at - time.monotonic()
+        try:
+            if not isinstance(client, OllamaPool):
+                response = client.chat(**chat_kwargs)
+            elif resilience.LLM_HEDGING_ENABLED and policy["hedge_after"] is not None:
+                response = client.hedged_chat(policy["hedge_after"], timeout=remaining, **chat_kwargs)
+            else:
+                response = client.chat(timeout=remaining, **chat_kwargs)
+        except Exception as e:
+            if not resilience.is_backend_failure(e):
+                resilience.ollama_breaker.record_neutral()
+                raise
+            resilience.ollama_breaker.record_failure()
+            delay = resilience.backoff_delay(attempt)
+            if attempt >= policy["retries"] or deadline_at - time.monotonic() - delay < resilience.MIN_ATTEMPT_SECONDS:
+                raise _deadline_error(task, policy, e) from e
+            print(f"INFO [llm_gateway]: '{task}' failed ({e}); retry {attempt + 1}/{policy['retries']} in {delay:.1f}s.")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        resilience.ollama_breaker.record_success()
+        return response
+
+
+def chat(client, task: str, user_id: str = None, cache_version: str = None, cache_if=None, **chat_kwargs):
+    """Runs `client.chat(**chat_kwargs)` once a gateway slot is free.
+
+    The model and any option overrides come from the task's entry in `task_models`
+    unless the caller passes `model` explicitly; deadlines, retries and hedging
+    follow the task's policy in `resilience`.
+
+    Deterministic callers pass `cache_version` (their prompt template version) to
+    serve repeated requests from the response cache without queueing; `cache_if`
+    can veto storing a response, e.g. one that failed to parse.
+    """
+    _prepare(task, chat_kwargs)
+    user_id = user_id or current_user_id()
+    cache_key = None
+    if cache_version is not None:
+        cache_key = llm_cache.make_cache_key(chat_kwargs)
+        cached = llm_cache.get_cached_response(cache_key, cache_version)
+        if cached is not None:
+            print(f"INFO [llm_gateway]: '{task}' served from cache.")
+            llm_telemetry.record_call(task, chat_kwargs["model"], user_id=user_id, cached=True)
+            return cached
+
+    started_at = time.perf_counter()
+    waited = 0.0
+    try:
+        with llm_gateway.slot(user_id):
+            waited = time.perf_counter() - started_at
+            if waited > 1:
+                print(f"INFO [llm_gateway]: '{task}' waited {waited:.1f}s in queue.")
+            called_at = time.perf_counter()
+            response = _resilient_chat(client, task, chat_kwargs)
+            task_models.record_latency(task, chat_kwargs["model"], time.perf_counter() - called_at)
+    except Exception as e:
+        llm_telemetry.record_call(
+            task, chat_kwargs["model"], queue_wait=waited, wall_time=time.perf_counter() - started_at,
+            user_id=user_id, status="error", error=str(e),
+        )
+        raise
+    llm_telemetry.record_call(
+        task, chat_kwargs["model"], response, queue_wait=waited,
+        wall_time=time.perf_counter() - started_at, user_id=user_id,
+    )
+
+    if cache_key is not None:
+        content = response['message']['content']
+        if cache_if is None or cache_if(content):
+            llm_cache.store_response(cache_key, cache_version, chat_kwargs.get("model"), content)
+    return response
+
+
+def chat_stream(client, task: str, user_id: str = None, cache_version: str = None, **chat_kwargs):
+    """Streaming counterpart of `chat`; the slot is held until the stream ends or is closed.
+
+    A cache hit is replayed as a single chunk; a miss is stored only when the
+    stream ran to completion, never for an answer the user stopped halfway.
+    """
+    _prepare(task, chat_kwargs)
+    user_id = user_id or current_user_id()
+    cache_key = None
+    if cache_version is not None:
+        cache_key = llm_cache.make_cache_key(chat_kwargs)
+        cached = llm_cache.get_cached_response(cache_key, cache_version)
+        if cached is not None:
+            print(f"INFO [llm_gateway]: '{task}' served from cache.")
+            llm_telemetry.record_call(task, chat_kwargs["model"], user_id=user_id, cached=True, streamed=True)
+            yield cached
+            return
+
+    started_at = time.perf_counter()
+    with llm_gateway.slot(user_id):
+        waited = time.perf_counter() - started_at
+        if waited > 1:
+            print(f"INFO [llm_gateway]: '{task}' waited {waited:.1f}s in queue.")
+        policy = resilience.policy_for(task)
+        stream = None
+        parts = []
+        completed = False
+        outcome_recorded = False
+        # chunk สุดท้าย (done) ของ stream มีตัวนับ token และเวลาแบบเดียวกับคำตอบที่ไม่ใช่ stream
+        final_chunk = None
+        status, error = "stopped", None
+        # เรียกก่อน try เหมือน _resilient_chat: request ที่ breaker ปฏิเสธไม่ใช่ความล้มเหลวของ Ollama
+        # และต้องไม่ไปปิด trial ของ request อื่นที่กำลังทดสอบ backend อยู่
+        resilience.ollama_breaker.allow()
+        try:
+            called_at = time.perf_counter()
+            # สำหรับ stream, deadline ของงานใช้เป็น timeout ระหว่าง chunk (ตรวจจับ Ollama ที่ค้าง) ไม่ใช่เวลารวม
+            # เรียกภายใน try เพื่อให้การเชื่อมต่อที่ล้มเหลวถูกนับใน circuit breaker และ telemetry เหมือน chat
+            if isinstance(client, OllamaPool):
+                stream = client.chat(stream=True, timeout=policy["deadline"], **chat_kwargs)
+            else:
+                stream = client.chat(stream=True, **chat_kwargs)
+            for chunk in stream:
+                if not outcome_recorded:
+                    resilience.ollama_breaker.record_success()
+                    outcome_recorded = True
+                parts.append(chunk['message']['content'])
+                if chunk.get('done'):
+                    completed = True
+                    final_chunk = chunk
+                    status = "ok"
+                    task_models.record_latency(task, chat_kwargs["model"], time.perf_counter() - called_at)
+                yield chunk
+        except Exception as e:
+            status, error = "error", str(e)
+            if resilience.is_backend_failure(e):
+                resilience.ollama_breaker.record_failure()
+                outcome_recorded = True
+                raise _deadline_error(task, policy, e) from e
+            raise
+        finally:
+            if not outcome_recorded:
+                resilience.ollama_breaker.record_neutral()
+            if stream is not None:
+                stream.close()
+            llm_telemetry.record_call(
+                task, chat_kwargs["model"], final_chunk, queue_wait=waited,
+                wall_time=time.perf_counter() - started_at, user_id=user_id,
+                streamed=True, status=status, error=error,
+            )
+
+    if cache_key is not None and completed:
+        llm_cache.store_response(cache_key, cache_version, chat_kwargs.get("model"), "".join(parts))
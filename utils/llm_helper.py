@@ -5,6 +5,7 @@ import re
 import ast 
 import csv
 import os
+import hashlib
 import fitz
 import qdrant_client
 import numpy as np
@@ -12,9 +13,19 @@ import numpy as np
 from sentence_transformers import SentenceTransformer
 from numpy.linalg import norm
 from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from pydantic import ValidationError, conlist, constr, create_model
 from docx import Document
 from docx.shared import Pt
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from utils import llm_gateway
+from utils import token_budget
+from utils.semantic_cache import semantic_cache
+from utils.chat_memory import memory_messages
+from utils.llm_clients import get_ollama_client, ollama_available
+from utils.task_models import LLM_MODEL
 
 try:
     from thefuzz import process, fuzz
@@ -24,21 +35,15 @@ except ImportError:
     THEFUZZ_AVAILABLE = False
     print("⚠️ 'thefuzz' library not found. Fuzzy matching is disabled.")
     
-OLLAMA_HOST = 'http://ollama:11434' 
-LLM_MODEL = 'scb10x/llama3.1-typhoon2-8b-instruct:latest'
-
-@st.cache_resource
-def init_ollama_client():
-    try:
-        client = ollama.Client(host=OLLAMA_HOST, timeout=300)
-        client.list()
-        print("✅ Ollama connection successful.")
-        return client, True
-    except Exception as e:
-        print(f"❌ Ollama connection failed: {e}")
-        return None, False
-
-ollama_client, OLLAMA_AVAILABLE = init_ollama_client()
+# โมเดลของแต่ละงานกำหนดใน utils/task_models (TASK_MODELS)
+# client ของ Ollama มาจาก registry ใน utils/llm_clients ซึ่งทุกหน้าใช้ร่วมกัน
+
+# เวอร์ชันของ prompt ที่ใช้กับ response cache: เปลี่ยนค่าทุกครั้งที่แก้ prompt หรือการ post-process ผลลัพธ์
+# เพื่อไม่ให้ระบบนำคำตอบเก่าที่สร้างจาก prompt เดิมกลับมาใช้
+PROMPT_TEMPLATE_VERSIONS = {
+    "draft_generation": "2025.07-1",
+    "extract_structured_data": "2025.07-2",
+}
 
 # Page 1 : Draft Generation
 
@@ -123,16 +128,11 @@ PROMPT_TEMPLATES = {
     """
 }
     
-def draft_generation(client, user_prompt: str, doc_type: str, formality_level: str, doc_salutation: str = ""):
-
-    if not OLLAMA_AVAILABLE:
-        return "ระบบ AI ไม่พร้อมใช้งาน"
-
+def _build_draft_messages(user_prompt: str, doc_type: str, formality_level: str):
     system_prompt = PROMPT_TEMPLATES.get(doc_type)
-
     if not system_prompt:
-        return f"เกิดข้อผิดพลาด: ไม่พบ Prompt Template สำหรับประเภทเอกสาร '{doc_type}'"
-    
+        return None
+
     full_user_content = f"""
     [ข้อความต้นฉบับจากผู้ใช้]
     ---
@@ -140,47 +140,140 @@ def draft_generation(client, user_prompt: str, doc_type: str, formality_level: s
     ---
     ระดับความเป็นทางการที่ต้องการ: {formality_level}
     """
+    return [
+        {'role': 'system', 'content': system_prompt}, 
+        {'role': 'user', 'content': full_user_content}  
+    ]
+
+DRAFT_OPTIONS = {
+    'temperature': 0.05,       
+    'num_predict': 2048,       
+    'top_p': 0.5,              
+    'repetition_penalty': 1.15 
+}
+
+def _draft_options(messages: list) -> dict:
+    token_budget.record_prompt("draft_generation", messages, DRAFT_OPTIONS['num_predict'])
+    return dict(DRAFT_OPTIONS)
+
+def draft_generation(client, user_prompt: str, doc_type: str, formality_level: str, doc_salutation: str = ""):
+
+    if not ollama_available():
+        return "ระบบ AI ไม่พร้อมใช้งาน"
+
+    messages = _build_draft_messages(user_prompt, doc_type, formality_level)
+
+    if not messages:
+        return f"เกิดข้อผิดพลาด: ไม่พบ Prompt Template สำหรับประเภทเอกสาร '{doc_type}'"
 
     try:
-        response = client.chat(
-            model=LLM_MODEL,
-            messages=[
-                {'role': 'system', 'content': system_prompt}, 
-                {'role': 'user', 'content': full_user_content}  
-            ],
-            options = {
-                'temperature': 0.05,       
-                'num_predict': 2048,       
-                'top_p': 0.5,              
-                'repetition_penalty': 1.15 
-            }
+        response = llm_gateway.chat(
+            client,
+            task="draft_generation",
+            cache_version=PROMPT_TEMPLATE_VERSIONS["draft_generation"],
+            messages=messages,
+            options=_draft_options(messages)
         )
         cleaned_response = response['message']['content'].replace("```", "").strip()
         return cleaned_response
     except Exception as e:
         return f"เกิดข้อผิดพลาดในการเรียกใช้ AI: {e}"
 
+
+def clean_streamed_text(chunks):
+    """Applies the `.replace("```", "").strip()` cleanup to a stream of text chunks.
+
+    Trailing backticks and whitespace are held back until the next chunk arrives,
+    so a fence split across two chunks is still removed and the concatenated output
+    equals the cleaned full response.
+    """
+    pending = ""
+    started = False
+    for piece in chunks:
+        if not piece:
+            continue
+        pending = (pending + piece).replace("```", "")
+        if not started:
+            pending = pending.lstrip()
+        ready = pending.rstrip(" \t\r\n`")
+        if ready:
+            started = True
+            yield ready
+            pending = pending[len(ready):]
+
+    tail = pending.rstrip()
+    if tail:
+        yield tail
+
+
+def draft_generation_stream(client, user_prompt: str, doc_type: str, formality_level: str, doc_salutation: str = ""):
+    """Streaming variant of `draft_generation` that yields cleaned text as Ollama generates it."""
+    if not ollama_available():
+        yield "ระบบ AI ไม่พร้อมใช้งาน"
+        return
+
+    messages = _build_draft_messages(user_prompt, doc_type, formality_level)
+
+    if not messages:
+        yield f"เกิดข้อผิดพลาด: ไม่พบ Prompt Template สำหรับประเภทเอกสาร '{doc_type}'"
+        return
+
+    stream = None
+    try:
+        stream = llm_gateway.chat_stream(
+            client,
+            task="draft_generation",
+            cache_version=PROMPT_TEMPLATE_VERSIONS["draft_generation"],
+            messages=messages,
+            options=_draft_options(messages)
+        )
+        yield from clean_streamed_text(chunk['message']['content'] for chunk in stream)
+    except Exception as e:
+        yield f"เกิดข้อผิดพลาดในการเรียกใช้ AI: {e}"
+    finally:
+        # ปิด stream เพื่อให้ Ollama หยุด generate เมื่อผู้ใช้ออกจากหน้าหรือกดหยุดกลางทาง
+        if stream is not None:
+            stream.close()
+
     
 # Page 2 : Outgoing Letter Creation
 
+def _validate_extraction(model, content: str):
+    try:
+        return model.model_validate_json(content)
+    except ValidationError as e:
+        print(f"WARN [extract_structured_data]: response does not match the schema: {e}")
+        return None
+
 def extract_structured_data(client, ocr_text_content: str, document_type: str, system_prompt: str, user_prompt_template: str):
     """Calls LLM to extract structured data from OCR text using the pre-configured client."""
-    if not OLLAMA_AVAILABLE or client is None:
+    if not ollama_available() or client is None:
         raise ConnectionError("Ollama client is not available for data extraction.")
     
     if not ocr_text_content or ocr_text_content.isspace():
         raise ValueError("No OCR text provided for data extraction.")
     
-    user_prompt = user_prompt_template.format(ocr_text=ocr_text_content)
+    extraction_model = get_extraction_model(document_type)
+    num_predict = extraction_num_predict(document_type)
+    messages = token_budget.fit_variable_section(
+        "extract_structured_data",
+        lambda ocr_text: [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_prompt_template.format(ocr_text=ocr_text)}
+        ],
+        ocr_text_content,
+        num_predict,
+    )
     try:
-        response = client.chat(
-            model=LLM_MODEL,
-            messages=[
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
-            ],
-            format="json",
-            options={'temperature': 0.05, 'num_predict': 3500}
+        response = llm_gateway.chat(
+            client,
+            task="extract_structured_data",
+            cache_version=PROMPT_TEMPLATE_VERSIONS["extract_structured_data"],
+            cache_if=lambda content: _validate_extraction(extraction_model, content) is not None,
+            messages=messages,
+            # Ollama structured outputs: บังคับ key และความยาวของแต่ละฟิลด์ตั้งแต่ตอน generate
+            format=extraction_model.model_json_schema(),
+            options={'temperature': 0.05, 'num_predict': num_predict}
         )
         content_str = response['message']['content']
         
@@ -189,14 +282,10 @@ def extract_structured_data(client, ocr_text_content: str, document_type: str, s
         print(content_str)
         print("="*50)
 
-        try:
-            return json.loads(content_str)
-        except json.JSONDecodeError:
-            json_match = re.search(r'\{.*\}', content_str, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group(0))
-            else:
-                raise ValueError("LLM did not return a valid JSON object.")
+        extracted = _validate_extraction(extraction_model, content_str)
+        if extracted is None:
+            raise ValueError("LLM did not return a JSON object matching the extraction schema.")
+        return extracted.model_dump()
 
     except Exception as e:
         print(f"Error during Ollama chat for data extraction: {e}")
@@ -306,6 +395,13 @@ def post_process_ocr_text(ocr_text: str, fuzzy_enabled: bool = False) -> str:
 
     return processed_text
 
+
+def post_process_profile(fuzzy_enabled: bool = False) -> str:
+    """Identifies what `post_process_ocr_text` would produce: the mode plus a hash of the correction tables."""
+    mode = "fuzzy" if fuzzy_enabled and THEFUZZ_AVAILABLE else "exact"
+    tables = json.dumps([OCR_CORRECTION_MAP, CORRECT_UNIT_ABBREVIATIONS], ensure_ascii=False, sort_keys=True)
+    return f"{mode}:{hashlib.sha256(tables.encode('utf-8')).hexdigest()[:16]}"
+
 # --- FIELD DEFINITIONS ---
 FIELDS_MEMORANDUM = {
     "department": "ส่วนราชการ",
@@ -489,6 +585,177 @@ def get_extraction(document_type: str):
     โปรดตอบกลับเป็น JSON object ที่มีโครงสร้างตามที่ระบุใน system prompt เท่านั้น
     """
     return system_prompt_extraction, user_prompt_template, list(fields_to_extract_map_with_new.keys())
+
+
+# ความยาวสูงสุด (ตัวอักษร) ของแต่ละฟิลด์ที่สกัด ฟิลด์ที่ไม่ได้ระบุใช้ EXTRACTION_DEFAULT_MAX_LENGTH
+EXTRACTION_DEFAULT_MAX_LENGTH = 150
+EXTRACTION_FIELD_MAX_LENGTHS = {
+    "body_main": 2500,
+    "to_recipient": 600,
+    "info_recipient": 600,
+    "coordinator_info": 300,
+    "requested_action_details": 300,
+    "approver_rank_name_position": 250,
+    "reporter_rank_name_position": 250,
+}
+# ฟิลด์ที่ตอบเป็น list ของ string: (จำนวนรายการสูงสุด, ความยาวสูงสุดต่อรายการ)
+EXTRACTION_LIST_FIELDS = {
+    "reference": (3, 200),
+    "attachments": (6, 200),
+}
+# ข้อความตัวอย่างลักษณะเดียวกับเนื้อหาหนังสือราชการ ใช้เติมทุกฟิลด์ให้ยาวเต็มเพดานเพื่อนับ token ของ JSON ที่ยาวที่สุด
+EXTRACTION_SAMPLE_TEXT = (
+    "๑. ด้วย ศูนย์ซอฟต์แวร์ กรมเทคโนโลยีสารสนเทศและการสื่อสารทหาร มีความประสงค์ขอรับการสนับสนุนบุคลากร "
+    "จำนวน ๒ นาย เพื่อปฏิบัติงานระหว่างวันที่ ๑ - ๓๑ ม.ค. ๖๘ (รายละเอียดตามสิ่งที่ส่งมาด้วย ๑)\n"
+)
+# เผื่อให้ข้อความจริงที่ tokenizer แบ่งได้ละเอียดกว่าข้อความตัวอย่าง ไม่ให้ JSON ถูกตัดก่อนปิดวงเล็บ
+EXTRACTION_NUM_PREDICT_HEADROOM = 1.2
+
+@lru_cache(maxsize=None)
+def get_extraction_model(document_type: str):
+    """Pydantic model of the extraction output for `document_type`, built from the same keys as `get_extraction`."""
+    _, _, field_keys = get_extraction(document_type)
+    fields = {}
+    for key in field_keys:
+        if key in EXTRACTION_LIST_FIELDS:
+            max_items, max_length = EXTRACTION_LIST_FIELDS[key]
+            field_type = Optional[conlist(constr(max_length=max_length), max_length=max_items)]
+        else:
+            field_type = Optional[constr(max_length=EXTRACTION_FIELD_MAX_LENGTHS.get(key, EXTRACTION_DEFAULT_MAX_LENGTH))]
+        fields[key] = (field_type, None)
+    model_name = "MemorandumExtraction" if document_type == "บันทึกข้อความ" else "JointNewsPaperExtraction"
+    return create_model(model_name, **fields)
+
+
+def _extraction_sample(length: int) -> str:
+    return (EXTRACTION_SAMPLE_TEXT * (length // len(EXTRACTION_SAMPLE_TEXT) + 1))[:length]
+
+
+def extraction_num_predict(document_type: str) -> int:
+    """Generated-token budget for the extraction JSON: every field filled to its schema limit,
+    so a response that passes validation is never cut off before its closing brace."""
+    _, _, field_keys = get_extraction(document_type)
+    largest = {}
+    for key in field_keys:
+        if key in EXTRACTION_LIST_FIELDS:
+            max_items, max_length = EXTRACTION_LIST_FIELDS[key]
+            largest[key] = [_extraction_sample(max_length)] * max_items
+        else:
+            largest[key] = _extraction_sample(EXTRACTION_FIELD_MAX_LENGTHS.get(key, EXTRACTION_DEFAULT_MAX_LENGTH))
+    tokens = token_budget.count_tokens(json.dumps(largest, ensure_ascii=False))
+    return int(tokens * EXTRACTION_NUM_PREDICT_HEADROOM)
+
+# การสกัดแบบแยกหน้า (map-reduce): เรียก LLM หน้าละครั้งพร้อมกัน แล้วรวมผลตามกฎด้านล่าง
+# auto = ใช้เมื่อเอกสารมีหลายหน้าและยาวเกิน EXTRACTION_PAGED_MIN_TOKENS, always / never = บังคับ
+EXTRACTION_PAGED_MODE = os.getenv("EXTRACTION_PAGED_MODE", "auto")
+EXTRACTION_PAGED_MIN_TOKENS = int(os.getenv("EXTRACTION_PAGED_MIN_TOKENS", "3000"))
+EXTRACTION_PAGE_WORKERS = int(os.getenv("EXTRACTION_PAGE_WORKERS", "4"))
+PAGED_EXTRACTION_NOTE = "(ข้อความนี้เป็นหน้าที่ {page} จากทั้งหมด {total} หน้าของหนังสือ ฟิลด์ที่ไม่ปรากฏในหน้านี้ให้เป็น null)\n\n"
+
+# วิธีรวมค่าของแต่ละฟิลด์จากหลายหน้า (ตามลำดับหน้า) ฟิลด์ที่ไม่ได้ระบุใช้ "first":
+# first = ค่าแรกที่ไม่ว่าง (ส่วนหัวและเจตนาหลักอยู่หน้าแรก), last = ค่าสุดท้ายที่ไม่ว่าง (ผู้ลงนาม/ส่วนท้ายอยู่หน้าสุดท้าย)
+# concat = ต่อเนื้อความของทุกหน้า, union = รวมรายการโดยไม่ซ้ำ
+EXTRACTION_MERGE_RULES = {
+    "body_main": "concat",
+    "reference": "union",
+    "attachments": "union",
+    "proposer_rank_name": "last",
+    "proposer_position": "last",
+    "proposer_title_suffix": "last",
+    "approver_rank_name": "last",
+    "approver_position": "last",
+    "approver_command": "last",
+    "coordinator_info": "last",
+    "qr_email": "last",
+    "responsible_unit": "last",
+    "phone": "last",
+    "reporter_rank_name_position": "last",
+    "approver_rank_name_position": "last",
+}
+
+
+def _is_empty(value) -> bool:
+    return value is None or (isinstance(value, (str, list)) and not value)
+
+
+def merge_page_extractions(document_type: str, page_results: list) -> dict:
+    """Combines per-page extraction results (in page order) into one, field by field,
+    according to `EXTRACTION_MERGE_RULES`; the same inputs always give the same result."""
+    _, _, field_keys = get_extraction(document_type)
+    merged = {}
+    for key in field_keys:
+        values = [result.get(key) for result in page_results if not _is_empty(result.get(key))]
+        rule = EXTRACTION_MERGE_RULES.get(key, "first")
+        if not values:
+            merged[key] = None
+        elif rule == "last":
+            merged[key] = values[-1]
+        elif rule == "concat":
+            parts = []
+            for value in values:
+                if value.strip() and value.strip() not in parts:
+                    parts.append(value.strip())
+            merged[key] = "\n".join(parts)
+        elif rule == "union":
+            items = []
+            for value in values:
+                for item in value:
+                    if item not in items:
+                        items.append(item)
+            merged[key] = items
+        else:
+            merged[key] = values[0]
+    return merged
+
+
+def should_extract_paged(page_texts: list) -> bool:
+    if EXTRACTION_PAGED_MODE == "never" or not page_texts or len(page_texts) < 2:
+        return False
+    if EXTRACTION_PAGED_MODE == "always":
+        return True
+    return sum(token_budget.count_tokens(text) for text in page_texts) > EXTRACTION_PAGED_MIN_TOKENS
+
+
+def _extract_page_as(user_id, client, page_text: str, document_type: str, system_prompt: str, user_prompt_template: str):
+    with llm_gateway.acting_as(user_id):
+        return extract_structured_data(client, page_text, document_type, system_prompt, user_prompt_template)
+
+
+def extract_structured_data_paged(client, page_texts: list, document_type: str, system_prompt: str, user_prompt_template: str,
+                                  max_workers: int = EXTRACTION_PAGE_WORKERS):
+    """Map-reduce variant of `extract_structured_data` for long, multi-page letters.
+
+    Each page is extracted in its own call, concurrently, so prompt cost grows linearly
+    with the page count and no call has to fit the whole document in its context.
+    Pages that fail are left out of the merge; only if every page fails is the error raised.
+    """
+    pages = [text for text in page_texts if text and not text.isspace()]
+    if len(pages) < 2:
+        return extract_structured_data(client, "".join(pages), document_type, system_prompt, user_prompt_template)
+
+    user_id = llm_gateway.current_user_id()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pages))), thread_name_prefix="extract-page") as executor:
+        futures = [
+            executor.submit(
+                _extract_page_as, user_id, client,
+                PAGED_EXTRACTION_NOTE.format(page=i + 1, total=len(pages)) + text,
+                document_type, system_prompt, user_prompt_template,
+            )
+            for i, text in enumerate(pages)
+        ]
+
+    page_results = []
+    first_error = None
+    for i, future in enumerate(futures):
+        try:
+            page_results.append(future.result())
+        except Exception as e:
+            print(f"WARN [extract_structured_data_paged]: page {i + 1}/{len(pages)} failed: {e}")
+            first_error = first_error or e
+    if not page_results:
+        raise first_error
+    print(f"INFO [extract_structured_data_paged]: merged {len(page_results)}/{len(pages)} page(s).")
+    return merge_page_extractions(document_type, page_results)
     
 
 def create_docx_from_text(text_content: str, font_name='TH SarabunPSK', font_size=16) -> bytes:
@@ -621,7 +888,8 @@ def replySec1_generation(client, extracted_info: dict, ocr_text_content: str, nu
         </rules>
         """    
 
-    user_prompt = f"""
+    def build_messages(ocr_text: str) -> list:
+        user_prompt = f"""
     <input_data>
         <reference_document>
             <sender_department>{sender_department}</sender_department>
@@ -632,7 +900,7 @@ def replySec1_generation(client, extracted_info: dict, ocr_text_content: str, nu
             <requested_details>{requested_details}</requested_details>
         </reference_document>
         <full_ocr_content>
-            {ocr_text_content}
+            {ocr_text}
         </full_ocr_content>
     </input_data>
 
@@ -640,18 +908,23 @@ def replySec1_generation(client, extracted_info: dict, ocr_text_content: str, nu
         โปรดวิเคราะห์ข้อมูลทั้งหมดใน <input_data> จับคู่กับกรณีศึกษาที่เหมาะสมที่สุด แล้วยกร่าง "ข้อ ๑" ของบันทึกข้อความตอบกลับมา **{num_options} รูปแบบ** ตามกฎและรูปแบบที่กำหนดใน system prompt อย่างเคร่งครัด
     </instruction>
     """
+        return [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_prompt}
+        ]
+
+    num_predict = 2048
+    messages = token_budget.fit_variable_section("replySec1_generation", build_messages, ocr_text_content, num_predict)
 
     try:
-        response = client.chat(
-            model=LLM_MODEL,
-            messages=[
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
-            ],
+        response = llm_gateway.chat(
+            client,
+            task="replySec1_generation",
+            messages=messages,
             format="json",
             options={
                 'temperature': 0.6,
-                'num_predict': 2048,
+                'num_predict': num_predict,
                 'top_p': 0.9,
                 'repetition_penalty': 1.1
             }
@@ -701,13 +974,9 @@ def replySec1_generation(client, extracted_info: dict, ocr_text_content: str, nu
         
 
 
-def _build_prompts_for_intent(reply_intent: str, extracted_info: dict, relevant_internal_data: dict) -> tuple[str, str]:
-    
-    our_department_name = (relevant_internal_data or {}).get("our_department_name", "[ชื่อหน่วยงานของท่าน]")
-    user_provided_opening = extracted_info.pop("user_provided_opening_paragraph", "")
-
-    # --- System Prompt ---
-    system_prompt_base = f"""คุณคือ "เสมียนเอกอัจฉริยะ" ผู้เชี่ยวชาญการร่างหนังสือราชการตอบกลับของไทย ภารกิจของคุณคือวิเคราะห์ข้อมูลทั้งหมดที่ได้รับ แล้วยกร่างเนื้อความ (ข้อ ๒, ๓, ...) ต่อจาก "ข้อ ๑" ที่ผู้ใช้กำหนดมาให้สมบูรณ์
+# ส่วน prompt ที่ไม่เปลี่ยนตาม request แยกไว้เป็นค่าคงที่ เพื่อให้ทุก request ที่มีเจตนาเดียวกันมี prefix ตรงกันทุกไบต์
+# และ Ollama นำ KV-cache ของ prompt ส่วนนี้กลับมาใช้ได้ ข้อมูลเฉพาะของแต่ละ request ให้อยู่ท้าย user prompt เท่านั้น
+REPLY_SYSTEM_PROMPT_BASE = """คุณคือ "เสมียนเอกอัจฉริยะ" ผู้เชี่ยวชาญการร่างหนังสือราชการตอบกลับของไทย ภารกิจของคุณคือวิเคราะห์ข้อมูลทั้งหมดที่ได้รับ แล้วยกร่างเนื้อความ (ข้อ ๒, ๓, ...) ต่อจาก "ข้อ ๑" ที่ผู้ใช้กำหนดมาให้สมบูรณ์
 
 <หลักการร่างและการใช้ข้อมูล>
 1.  **วิเคราะห์ข้อมูลทั้งหมด:** จงทำความเข้าใจข้อมูลจาก "หนังสือต้นเรื่อง" และ "ข้อมูลสำหรับการตอบกลับ" อย่างละเอียด
@@ -724,38 +993,40 @@ def _build_prompts_for_intent(reply_intent: str, extracted_info: dict, relevant_
 - ต้องมีคำลงท้ายที่เหมาะสมกับเจตนา (เช่น จึงเรียนมาเพื่อโปรดพิจารณา, จึงเรียนมาเพื่อโปรดทราบ)
 """
 
-    user_prompt_parts = []
-    system_prompt_addendum = "" 
-
-    if reply_intent == "อนุมัติ/เห็นชอบ":
-        system_prompt_addendum = """
+REPLY_INTENT_ADDENDUMS = {
+    "อนุมัติ/เห็นชอบ": """
 <หลักการร่างสำหรับเจตนา "อนุมัติ/เห็นชอบ">
-- **๒.** ให้อธิบายว่าหน่วยงานของเรา ({our_department_name}) ได้พิจารณาเรื่องที่เสนอมาแล้ว และเห็นว่าสอดคล้องกับภารกิจ หรือเป็นประโยชน์ หรือไม่มีข้อขัดข้อง
+- **๒.** ให้อธิบายว่าหน่วยงานของเรา (ตาม "หน่วยงานของเรา (ผู้ตอบ)" ในข้อมูลที่ได้รับ) ได้พิจารณาเรื่องที่เสนอมาแล้ว และเห็นว่าสอดคล้องกับภารกิจ หรือเป็นประโยชน์ หรือไม่มีข้อขัดข้อง
 - **๓.** ให้ระบุ "ข้อเสนอ" โดยเสนอเพื่อ "อนุมัติ/เห็นชอบ" ในสิ่งที่ร้องขอ และอาจตามด้วยการเสนอให้ "มีหนังสือแจ้ง..." หรือ "ประสานงาน..." ต่อไป
 </หลักการร่างสำหรับเจตนา>
-"""
-    elif reply_intent == "ปฏิเสธ/ไม่เห็นชอบ":
-        system_prompt_addendum = """
+""",
+    "ปฏิเสธ/ไม่เห็นชอบ": """
 <หลักการร่างสำหรับเจตนา "ปฏิเสธ/ไม่เห็นชอบ">
 - **๒.** ให้อธิบายเหตุผลในการปฏิเสธอย่างสุภาพ (เช่น ติดภารกิจเร่งด่วน, บุคลากรไม่เพียงพอ) และอาจเสริมว่าได้ประสานงานแจ้งเบื้องต้นแล้ว
 - **๓.** ให้ระบุ "ข้อเสนอ" โดยเสนอเพื่อ "มีหนังสือแจ้งผลการพิจารณาให้หน่วยงานต้นเรื่องทราบ"
 </หลักการร่างสำหรับเจตนา>
-"""
-    elif reply_intent == "ตอบรับทราบ":
-        system_prompt_addendum = """
+""",
+    "ตอบรับทราบ": """
 <หลักการร่างสำหรับเจตนา "ตอบรับทราบ">
-- **๒.** ให้แจ้งว่าหน่วยงานของเรา ({our_department_name}) ได้รับเรื่องไว้เรียบร้อยแล้ว
+- **๒.** ให้แจ้งว่าหน่วยงานของเรา (ตาม "หน่วยงานของเรา (ผู้ตอบ)" ในข้อมูลที่ได้รับ) ได้รับเรื่องไว้เรียบร้อยแล้ว
 - **๓.** ให้ระบุขั้นตอนที่จะดำเนินการต่อไป เช่น "จะนำเรียนผู้บังคับบัญชาเพื่อพิจารณาสั่งการต่อไป" หรือ "จะแจ้งผลให้ทราบอีกครั้ง" และลงท้ายด้วย "จึงเรียนมาเพื่อโปรดทราบ"
 </หลักการร่างสำหรับเจตนา>
-"""
-    elif reply_intent == "ส่งต่อเรื่อง/ประสานงาน":
-        system_prompt_addendum = """
+""",
+    "ส่งต่อเรื่อง/ประสานงาน": """
 <หลักการร่างสำหรับเจตนา "ส่งต่อเรื่อง/ประสานงาน">
-- **๒.** ให้อธิบายว่าหน่วยงานของเรา ({our_department_name}) ได้พิจารณาแล้ว และเห็นควรส่งเรื่องต่อให้หน่วยงานที่มีอำนาจหน้าที่โดยตรง
+- **๒.** ให้อธิบายว่าหน่วยงานของเรา (ตาม "หน่วยงานของเรา (ผู้ตอบ)" ในข้อมูลที่ได้รับ) ได้พิจารณาแล้ว และเห็นควรส่งเรื่องต่อให้หน่วยงานที่มีอำนาจหน้าที่โดยตรง
 - **๓.** ให้ระบุ "ข้อเสนอ" โดยเสนอเพื่อ "ส่งเรื่องให้ [ระบุชื่อหน่วยงานที่เกี่ยวข้อง] พิจารณาดำเนินการในส่วนที่เกี่ยวข้องต่อไป" และอาจเสนอให้มีหนังสือแจ้งหน่วยงานต้นเรื่องทราบด้วย
 </หลักการร่างสำหรับเจตนา>
-"""
-    else: 
+""",
+}
+
+def _build_prompts_for_intent(reply_intent: str, extracted_info: dict, relevant_internal_data: dict) -> tuple[str, str]:
+    
+    our_department_name = (relevant_internal_data or {}).get("our_department_name", "[ชื่อหน่วยงานของท่าน]")
+    user_provided_opening = extracted_info.pop("user_provided_opening_paragraph", "")
+
+    system_prompt_addendum = REPLY_INTENT_ADDENDUMS.get(reply_intent)
+    if system_prompt_addendum is None:
         return (None, "เกิดข้อผิดพลาด: ไม่พบ Template สำหรับเจตนานี้")
 
     # User Prompt 
@@ -779,13 +1050,13 @@ def _build_prompts_for_intent(reply_intent: str, extracted_info: dict, relevant_
 จงทำหน้าที่เสมียนเอกอัจฉริยะ ร่างเนื้อหาส่วนที่เหลือ (เริ่มต้นจาก ๒.) ต่อจาก "ข้อ ๑" ที่ให้มาให้สมบูรณ์และเป็นทางการที่สุด โดยใช้ข้อมูลทั้งหมดที่ให้มาประกอบการพิจารณา และปฏิบัติตาม <หลักการร่างสำหรับเจตนา> และ <กฎการแสดงผล> อย่างเคร่งครัด
 """
 
-    final_system_prompt = system_prompt_base + system_prompt_addendum
+    final_system_prompt = REPLY_SYSTEM_PROMPT_BASE + system_prompt_addendum
     return final_system_prompt, user_prompt
 
 
 
 def replySec234_generation(client, extracted_info: dict, original_doc_type: str, reply_intent: str, relevant_internal_data: dict = None):
-    if not OLLAMA_AVAILABLE:
+    if not ollama_available():
         return "ระบบ AI (Ollama) ไม่พร้อมใช้งาน กรุณาตรวจสอบการเชื่อมต่อ"
 
     if not extracted_info:
@@ -799,16 +1070,21 @@ def replySec234_generation(client, extracted_info: dict, original_doc_type: str,
     if not system_prompt:
         return user_prompt
 
+    messages = [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': user_prompt}
+    ]
+    num_predict = 2048
+    token_budget.record_prompt("replySec234_generation", messages, num_predict)
+
     try:
-        response = client.chat(
-            model= LLM_MODEL,
-            messages=[
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
-            ],
+        response = llm_gateway.chat(
+            client,
+            task="replySec234_generation",
+            messages=messages,
             options={
                 'temperature': 0.1,
-                'num_predict': 2048,
+                'num_predict': num_predict,
                 'top_p': 0.7,
                 'repetition_penalty': 1.1
             }
@@ -834,6 +1110,7 @@ def replySec234_generation(client, extracted_info: dict, original_doc_type: str,
 # Page 3 : Chat bot  
 
 import qdrant_client
+from qdrant_client.http import models as qdrant_models
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from numpy.linalg import norm
@@ -885,18 +1162,31 @@ def init_qdrant_client():
     
     print("Initializing Qdrant client...")
 
-    return qdrant_client.QdrantClient(host="qdrant", port=6333)
+    return qdrant_client.QdrantClient(host=os.getenv("QDRANT_HOST", "qdrant"), port=int(os.getenv("QDRANT_PORT", "6333")))
 
 qdrant_cli = init_qdrant_client()
 embedding_model = load_embedding_model()
 
-def search_in_qdrant(query: str, collection_name: str, n_results: int = 5) -> str: # << เพิ่ม n_results เป็น 5
+def embed_query(query: str):
+    return embedding_model.encode(query)
+
+def _source_filter(only_source: str = None, exclude_source: str = None):
+    if only_source:
+        return qdrant_models.Filter(must=[qdrant_models.FieldCondition(key="source_file", match=qdrant_models.MatchValue(value=only_source))])
+    if exclude_source:
+        return qdrant_models.Filter(must_not=[qdrant_models.FieldCondition(key="source_file", match=qdrant_models.MatchValue(value=exclude_source))])
+    return None
+
+def search_in_qdrant(query: str, collection_name: str, n_results: int = 5, query_embedding=None,
+                     only_source: str = None, exclude_source: str = None) -> str: # << เพิ่ม n_results เป็น 5
     
     try:
-        query_embedding = embedding_model.encode(query)
+        if query_embedding is None:
+            query_embedding = embed_query(query)
         search_result = qdrant_cli.search(
             collection_name=collection_name,
             query_vector=query_embedding,
+            query_filter=_source_filter(only_source, exclude_source),
             limit=n_results,
             with_payload=True 
         )
@@ -940,10 +1230,13 @@ def query_router(client, query: str) -> str:
 
 คำถามของผู้ใช้: "{query}"
 ประเภทของคำถามคือ:"""
+    messages = [{'role': 'user', 'content': router_prompt}]
+    token_budget.record_prompt("query_router", messages, 50)
     try:
-        response = client.chat(
-            model=LLM_MODEL,
-            messages=[{'role': 'user', 'content': router_prompt}],
+        response = llm_gateway.chat(
+            client,
+            task="query_router",
+            messages=messages,
             options={'temperature': 0, 'num_predict': 50}
         )
         route_result = response['message']['content'].strip()
@@ -962,47 +1255,134 @@ def query_router(client, query: str) -> str:
         return "การใช้งานระบบ"
 
     
-def call_chatbot(history: list):
-    if not OLLAMA_AVAILABLE:
-        return "ขออภัยครับ ระบบ AI ไม่พร้อมใช้งานในขณะนี้"
+# ตัวอย่างสำหรับ embedding router: ใช้คู่มือการใช้งานระบบเป็นตัวอย่างของหมวด "การใช้งานระบบ"
+# และคำถามตัวอย่างสำหรับหมวดอื่น ค่าเฉลี่ย (centroid) ของแต่ละหมวดใช้แทน LLM router ในกรณีทั่วไป
+ROUTE_EXAMPLES = {
+    "การใช้งานระบบ": [f"##{chunk}".strip() for chunk in SYSTEM_USAGE_KNOWLEDGE.split('##')[1:] if chunk.strip()] + [
+        "จะทำหนังสือตอบกลับในระบบนี้ต้องทำยังไงบ้าง?",
+        "ถ้าจะแก้ข้อความที่ AI สร้างให้ในเมนูร่างหนังสือราชการ ต้องกดปุ่มไหน?",
+        "อัปโหลดไฟล์ PDF แล้วระบบไม่สกัดข้อมูลให้ ต้องทำอย่างไร",
+        "ดาวน์โหลดร่างหนังสือเป็นไฟล์ docx ได้ที่ไหน",
+        "ปุ่มสร้างตัวเลือกข้อ ๑ ใช้ทำอะไร",
+    ],
+    "ระเบียบสารบรรณ": [
+        "อ้างถึงงานระเบียบสารบรรณ การใช้คำขึ้นต้น 'เรียน' กับ 'เสนอ' ต่างกันอย่างไร?",
+        "อ้างถึงงานระเบียบสารบรรณ แบบหนังสือภายในใช้กระดาษบันทึกข้อความ คืออะไร?",
+        "ตามระเบียบงานสารบรรณ หนังสือราชการมีกี่ชนิด",
+        "ชั้นความลับของหนังสือราชการมีอะไรบ้าง",
+        "ระเบียบกำหนดให้เก็บรักษาหนังสือราชการไว้กี่ปี",
+        "หนังสือด่วนที่สุด ด่วนมาก ด่วน ต่างกันอย่างไรตามระเบียบ",
+        "การลงทะเบียนหนังสือรับต้องทำอย่างไรตามข้อบังคับ",
+        "คำลงท้ายของหนังสือภายนอกที่ถูกต้องตามระเบียบคืออะไร",
+    ],
+    "ทั่วไป": [
+        "สวัสดีครับ",
+        "ขอบคุณมากครับ",
+        "คุณเป็นใคร",
+        "วันนี้อากาศเป็นอย่างไร",
+        "ช่วยแนะนำตัวหน่อย",
+        "โอเค เข้าใจแล้ว",
+    ],
+}
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.02"))
 
-    user_query = ""
+@st.cache_resource
+def build_route_centroids():
+    print("Building query router centroids...")
+    labels = list(ROUTE_EXAMPLES.keys())
+    centroids = []
+    for label in labels:
+        vectors = embedding_model.encode(ROUTE_EXAMPLES[label], normalize_embeddings=True)
+        centroid = vectors.mean(axis=0)
+        centroids.append(centroid / norm(centroid))
+    return labels, np.vstack(centroids)
+
+def embedding_query_router(client, query: str, query_embedding=None) -> str:
+    """Routes by cosine similarity to the labelled centroids; only a low-margin decision goes to the LLM router."""
+    labels, centroids = build_route_centroids()
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    scores = centroids @ (query_vector / norm(query_vector))
+    ranked = np.argsort(scores)[::-1]
+    margin = float(scores[ranked[0]] - scores[ranked[1]])
+    route = labels[ranked[0]]
+
+    if margin < ROUTER_MIN_MARGIN and client is not None:
+        print(f"INFO [embedding_query_router]: low margin ({margin:.3f}) for '{route}', asking LLM router.")
+        return query_router(client, query)
+    return route
+
+
+def get_latest_user_query(history: list) -> str:
     for msg in reversed(history):
         if msg['role'] == 'user':
-            user_query = msg['content']
-            break
-            
-    if not user_query:
-        return "ขออภัยครับ ผมไม่เข้าใจคำถาม กรุณาลองอีกครั้ง"
+            return msg['content']
+    return ""
 
-#     with st.spinner("กำลังวิเคราะห์คำถาม..."):
-#         route = query_router(ollama_client, user_query)
-#         st.write(f"ประเภทคำถาม: {route}")
+
+def contextual_query(history: list) -> str:
+    """The latest question, prefixed with the previous one when it is a follow-up.
+
+    Used for retrieval and the semantic cache, so "แล้วถ้าเป็นหนังสือภายนอกล่ะ" is
+    looked up together with the question it follows, and an answer that depends on
+    earlier turns is never served for the bare follow-up text.
+    """
+    user_queries = [msg['content'] for msg in history if msg['role'] == 'user']
+    if len(user_queries) >= 2:
+        return f"{user_queries[-2]}\n{user_queries[-1]}"
+    return user_queries[-1] if user_queries else ""
+
+
+def retrieve_chatbot_context(user_query: str, query_embedding=None) -> str:
+    """Looks up the knowledge base for the chatbot; shown to the user before the answer streams.
+
+    The system manual and the regulation PDFs share one collection, so the route
+    picks a `source_file` filter instead of a separate collection.
+    """
+    if query_embedding is None:
+        query_embedding = embed_query(user_query)
+    route = embedding_query_router(get_ollama_client(), user_query, query_embedding)
+    print(f"INFO [retrieve_chatbot_context]: route = {route}")
 
     relevant_context = ""
-#     if "การใช้งานระบบ" in route:
-#         with st.spinner("กำลังค้นหาข้อมูลการใช้งานระบบ..."):
-#             relevant_context = search_in_qdrant(user_query, collection_name="system_usage")
-#     elif "ระเบียบสารบรรณ" in route:
-#         with st.spinner("กำลังค้นหาข้อมูลในระเบียบสารบรรณ..."):
-#             relevant_context = search_in_qdrant(user_query, collection_name="rtarf_knowledge_base")
-
-#     # ถ้า router จัดเป็น "ทั่วไป" หรือค้นหาไม่เจอในหมวดอื่น ให้ลองค้นหาใน "การใช้งานระบบ" เป็นทางเลือกสุดท้าย
-#     if not relevant_context or "ทั่วไป" in route:
-#         print("Router classified as 'General' or no context found, attempting fallback search in 'system_usage'.")
-#         with st.spinner("กำลังค้นหาข้อมูลเพิ่มเติม..."):
-#             fallback_context = search_in_qdrant(user_query, collection_name="system_usage")
-#             # ใช้ผลลัพธ์จาก fallback หากดีกว่าอันเดิม
-#             if fallback_context and "ไม่พบข้อมูล" not in fallback_context:
-#                 relevant_context = fallback_context
-    with st.spinner("กำลังค้นหาข้อมูลในฐานความรู้..."):
-        relevant_context = search_in_qdrant(user_query, collection_name="rtarf_knowledge_base")
-    
-    system_prompt = f"""คุณคือ "ที่ปรึกษาอัจฉริยะด้านงานสารบรรณ" ผู้มีทักษะการวิเคราะห์และสังเคราะห์ข้อมูลขั้นสูง ภารกิจของคุณคือการให้คำตอบที่ **ละเอียด ชัดเจน และนำไปใช้งานได้จริง** โดยอ้างอิงจากข้อมูลที่ให้มาอย่างเคร่งครัด
+    if route == "การใช้งานระบบ":
+        relevant_context = search_in_qdrant(user_query, collection_name="rtarf_knowledge_base", query_embedding=query_embedding, only_source="system_manual")
+    elif route == "ระเบียบสารบรรณ":
+        relevant_context = search_in_qdrant(user_query, collection_name="rtarf_knowledge_base", query_embedding=query_embedding, exclude_source="system_manual")
+
+    # ถ้า router จัดเป็น "ทั่วไป" หรือค้นหาไม่เจอในหมวดที่เลือก ให้ค้นหาทั้งฐานความรู้เป็นทางเลือกสุดท้าย
+    if not relevant_context or route == "ทั่วไป" or relevant_context.startswith(("ไม่พบข้อมูล", "เกิดข้อผิดพลาด")):
+        relevant_context = search_in_qdrant(user_query, collection_name="rtarf_knowledge_base", query_embedding=query_embedding)
+    return relevant_context
+
+
+def lookup_cached_answer(user_query: str):
+    """Returns (cached entry or None, query embedding); the embedding is reused for retrieval on a miss."""
+    query_embedding = embed_query(user_query)
+    cached = semantic_cache.lookup(query_embedding)
+    if cached:
+        print(f"INFO [semantic_cache]: '{user_query}' matched '{cached['query']}' (score {cached['score']:.3f}).")
+    return cached, query_embedding
+
+
+def remember_chatbot_answer(user_query: str, query_embedding, relevant_context: str, answer: str, completed: bool):
+    """Adds an answer to the semantic cache, but only one the model finished (`completed`);
+    a failed or stopped answer can end in partial text that looks like a normal reply."""
+    if not completed or not answer:
+        return
+    if relevant_context.startswith("เกิดข้อผิดพลาด"):
+        return
+    semantic_cache.add(user_query, query_embedding, answer, relevant_context)
+
+
+# system prompt ต้องไม่มีข้อมูลของแต่ละคำถามปนอยู่ (คำถามและ context อยู่ใน user message)
+# เพื่อให้ทุกคำถามมี prefix เดียวกันและ Ollama นำ KV-cache กลับมาใช้ได้
+CHATBOT_SYSTEM_PROMPT = """คุณคือ "ที่ปรึกษาอัจฉริยะด้านงานสารบรรณ" ผู้มีทักษะการวิเคราะห์และสังเคราะห์ข้อมูลขั้นสูง ภารกิจของคุณคือการให้คำตอบที่ **ละเอียด ชัดเจน และนำไปใช้งานได้จริง** โดยอ้างอิงจากข้อมูลที่ให้มาอย่างเคร่งครัด
 
     **กระบวนการคิดและตอบ (Chain-of-Thought):**
 
-    1.  **วิเคราะห์คำถาม (Analyze the Query):** อ่านคำถามของผู้ใช้ (`{user_query}`) อย่างละเอียด แล้วทำความเข้าใจเจตนาที่แท้จริง ว่าผู้ใช้ต้องการทราบอะไรกันแน่?
+    1.  **วิเคราะห์คำถาม (Analyze the Query):** อ่าน "คำถามของผู้ใช้" ที่ให้มาอย่างละเอียด แล้วทำความเข้าใจเจตนาที่แท้จริง ว่าผู้ใช้ต้องการทราบอะไรกันแน่?
     2.  **สแกนและเชื่อมโยงข้อมูล (Scan & Connect Context):** อ่าน "ข้อมูลที่เกี่ยวข้อง" ทั้งหมดที่ให้มา แล้วมองหา "ทุกส่วน" ที่เกี่ยวข้องกับคำถามของผู้ใช้ แม้จะอยู่คนละส่วนกันก็ตาม จากนั้นพยายามเชื่อมโยงข้อมูลเหล่านั้นเข้าด้วยกัน
     3.  **สังเคราะห์คำตอบ (Synthesize the Answer):**
         -   **สร้างคำตอบใหม่:** ห้ามคัดลอกข้อมูลที่ให้มาแบบคำต่อคำ แต่จงใช้ภาษาของตัวเองเพื่อ "สังเคราะห์" และ "เรียบเรียง" คำตอบขึ้นมาใหม่ให้เข้าใจง่าย
@@ -1012,9 +1392,10 @@ def call_chatbot(history: list):
 
     **กฎสำคัญ:**
     -   **ยึดตามข้อมูลเท่านั้น:** คำตอบทั้งหมดต้องมาจาก "ข้อมูลที่เกี่ยวข้อง" ที่ให้มา ห้ามเพิ่มเติมข้อมูลหรือความคิดเห็นส่วนตัวที่ไม่มีในแหล่งอ้างอิง
-    -   **ยอมรับเมื่อไม่รู้:** หากวิเคราะห์แล้วพบว่า "ข้อมูลที่เกี่ยวข้อง" ไม่มีข้อมูลที่ตอบคำถามได้เลย ให้ตอบอย่างสุภาพว่า "ขออภัยครับ ผมไม่พบข้อมูลที่ชัดเจนเกี่ยวกับเรื่อง '{user_query}' ในฐานข้อมูลที่มีอยู่ครับ"
+    -   **ยอมรับเมื่อไม่รู้:** หากวิเคราะห์แล้วพบว่า "ข้อมูลที่เกี่ยวข้อง" ไม่มีข้อมูลที่ตอบคำถามได้เลย ให้ตอบอย่างสุภาพว่า "ขออภัยครับ ผมไม่พบข้อมูลที่ชัดเจนเกี่ยวกับเรื่องที่ท่านสอบถามในฐานข้อมูลที่มีอยู่ครับ"
     """
-    
+
+def _build_chatbot_messages(user_query: str, relevant_context: str, history: list = None) -> list:
     user_prompt_with_context = f"""
     --- ข้อมูลที่เกี่ยวข้อง ---
     {relevant_context}
@@ -1023,21 +1404,101 @@ def call_chatbot(history: list):
     ---
     คำสั่ง: โปรดปฏิบัติตาม **กระบวนการคิดและตอบ (Chain-of-Thought)** ที่ระบุไว้ในบทบาทของคุณ เพื่อสร้างคำตอบที่ดีที่สุดสำหรับคำถามของผู้ใช้
     """
+    # ประวัติการสนทนา (สรุป + รอบล่าสุด) อยู่หลัง system prompt เพื่อให้ prefix ยังคงเหมือนเดิมทุก request
+    return [
+        {'role': 'system', 'content': CHATBOT_SYSTEM_PROMPT},
+        *(history or []),
+        {'role': 'user', 'content': user_prompt_with_context}
+    ]
+
+CHATBOT_OPTIONS = {
+    'temperature': 0.3, 
+    'top_p': 0.9,   
+    'num_predict': 4096
+}
+
+def _fit_chatbot_request(user_query: str, relevant_context: str, history: list = None):
+    """Returns `(messages, options)` with the RAG context trimmed to the chatbot's token budget."""
+    messages = token_budget.fit_variable_section(
+        "call_chatbot",
+        lambda context: _build_chatbot_messages(user_query, context, history),
+        relevant_context,
+        CHATBOT_OPTIONS['num_predict'],
+        trim=token_budget.trim_tail,
+    )
+    return messages, dict(CHATBOT_OPTIONS)
+
+def call_chatbot(history: list):
+    if not ollama_available():
+        return "ขออภัยครับ ระบบ AI ไม่พร้อมใช้งานในขณะนี้"
+
+    user_query = get_latest_user_query(history)
+            
+    if not user_query:
+        return "ขออภัยครับ ผมไม่เข้าใจคำถาม กรุณาลองอีกครั้ง"
+
+    lookup_query = contextual_query(history)
+    cached, query_embedding = lookup_cached_answer(lookup_query)
+    if cached:
+        return cached["answer"]
+
+    with st.spinner("กำลังค้นหาข้อมูลในฐานความรู้..."):
+        relevant_context = retrieve_chatbot_context(lookup_query, query_embedding)
     
+    messages, options = _fit_chatbot_request(user_query, relevant_context, memory_messages(None, history))
     try:
-        response = ollama_client.chat(
-            model=LLM_MODEL,
-            messages=[
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt_with_context}
-            ],
-            options = {
-                'temperature': 0.3, 
-                'top_p': 0.9,   
-                'num_predict': 4096
-            }
+        response = llm_gateway.chat(
+            get_ollama_client(),
+            task="call_chatbot",
+            messages=messages,
+            options=options
         )
-        return response['message']['content']
+        answer = response['message']['content']
+        remember_chatbot_answer(lookup_query, query_embedding, relevant_context, answer, completed=True)
+        return answer
     except Exception as e:
         print(f"Error during chatbot call: {e}")
         return f"เกิดข้อผิดพลาดในการเชื่อมต่อกับ AI: {e}"
+
+
+def call_chatbot_stream(client, user_query: str, relevant_context: str, history: list = None, outcome: dict = None):
+    """Streams the chatbot answer chunk by chunk.
+
+    `history` is the conversation memory from `chat_memory.memory_messages`.
+    `outcome["completed"]` is set to True only once the Ollama stream has ended
+    normally; it stays False for error messages, failures and stopped answers.
+
+    To stop generation, close the generator; closing the Ollama stream drops the
+    HTTP connection so the server stops spending compute on an abandoned answer.
+    """
+    if outcome is None:
+        outcome = {}
+    outcome["completed"] = False
+    if not ollama_available() or client is None:
+        yield "ขออภัยครับ ระบบ AI ไม่พร้อมใช้งานในขณะนี้"
+        return
+
+    if not user_query:
+        yield "ขออภัยครับ ผมไม่เข้าใจคำถาม กรุณาลองอีกครั้ง"
+        return
+
+    stream = None
+    try:
+        messages, options = _fit_chatbot_request(user_query, relevant_context, history)
+        stream = llm_gateway.chat_stream(
+            client,
+            task="call_chatbot",
+            messages=messages,
+            options=options
+        )
+        for chunk in stream:
+            content = chunk['message']['content']
+            if content:
+                yield content
+        outcome["completed"] = True
+    except Exception as e:
+        print(f"Error during chatbot streaming call: {e}")
+        yield f"เกิดข้อผิดพลาดในการเชื่อมต่อกับ AI: {e}"
+    finally:
+        if stream is not None:
+            stream.close()
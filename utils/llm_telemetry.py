@@ -0,0 +1,132 @@
+import os
+import json
+import threading
+
+from collections import deque
+from datetime import datetime
+from utils.cache_store import CACHE_DIR
+
+TELEMETRY_RING_SIZE = int(os.getenv("LLM_TELEMETRY_RING_SIZE", "1000"))
+TELEMETRY_LOG_PATH = os.getenv("LLM_TELEMETRY_LOG_PATH", os.path.join(CACHE_DIR, "llm_telemetry.jsonl"))
+TELEMETRY_ENABLED = os.getenv("LLM_TELEMETRY_ENABLED", "1") == "1"
+
+_ring = deque(maxlen=TELEMETRY_RING_SIZE)
+_ring_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+def _counter(response, name: str):
+    if response is None:
+        return None
+    value = response.get(name)
+    return int(value) if value is not None else None
+
+
+def _ms(nanoseconds):
+    return round(nanoseconds / 1e6, 1) if nanoseconds is not None else None
+
+
+def _per_second(count, nanoseconds):
+    if not count or not nanoseconds:
+        return None
+    return round(count / (nanoseconds / 1e9), 2)
+
+
+def record_call(task: str, model: str, response=None, queue_wait: float = 0.0, wall_time: float = 0.0,
+                user_id: str = None, cached: bool = False, streamed: bool = False, status: str = "ok", error: str = None) -> dict:
+    """Builds one telemetry record from Ollama's final response (or last stream chunk) and stores it.
+
+    Durations from Ollama are nanoseconds and are recorded in milliseconds; `queue_wait`
+    and `wall_time` are seconds measured by the caller (wall time includes the queue).
+    """
+    prompt_eval_count = _counter(response, "prompt_eval_count")
+    prompt_eval_duration = _counter(response, "prompt_eval_duration")
+    eval_count = _counter(response, "eval_count")
+    eval_duration = _counter(response, "eval_duration")
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="milliseconds"),
+        "task": task,
+        "model": model,
+        "user_id": user_id,
+        "status": status,
+        "cached": cached,
+        "streamed": streamed,
+        "queue_wait_s": round(queue_wait, 3),
+        "wall_s": round(wall_time, 3),
+        "load_duration_ms": _ms(_counter(response, "load_duration")),
+        "prompt_eval_count": prompt_eval_count,
+        "prompt_eval_duration_ms": _ms(prompt_eval_duration),
+        "prompt_tokens_per_s": _per_second(prompt_eval_count, prompt_eval_duration),
+        "eval_count": eval_count,
+        "eval_duration_ms": _ms(eval_duration),
+        "eval_tokens_per_s": _per_second(eval_count, eval_duration),
+        "total_duration_ms": _ms(_counter(response, "total_duration")),
+        "error": error,
+    }
+    if TELEMETRY_ENABLED:
+        with _ring_lock:
+            _ring.append(record)
+        _append_to_log(record)
+    return record
+
+
+def _append_to_log(record: dict):
+    try:
+        with _log_lock:
+            os.makedirs(os.path.dirname(TELEMETRY_LOG_PATH) or ".", exist_ok=True)
+            with open(TELEMETRY_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"WARN [llm_telemetry]: could not append to '{TELEMETRY_LOG_PATH}': {e}")
+
+
+def recent_records(limit: int = None) -> list:
+    with _ring_lock:
+        records = list(_ring)
+    return records[-limit:] if limit else records
+
+
+def summarize_by_task(records: list = None) -> list:
+    """Per task and model: call count, cache hits, and mean queue wait, load, prompt-eval and eval times."""
+    records = recent_records() if records is None else records
+    groups = {}
+    for record in records:
+        groups.setdefault((record["task"], record["model"]), []).append(record)
+
+    def mean(values):
+        values = [v for v in values if v is not None]
+        return round(sum(values) / len(values), 2) if values else None
+
+    summary = []
+    for (task, model), group in sorted(groups.items()):
+        generated = [r for r in group if not r["cached"]]
+        summary.append({
+            "task": task,
+            "model": model,
+            "calls": len(group),
+            "cache_hits": len(group) - len(generated),
+            "errors": sum(1 for r in group if r["status"] == "error"),
+            "mean_queue_wait_s": mean(r["queue_wait_s"] for r in generated),
+            "mean_wall_s": mean(r["wall_s"] for r in generated),
+            "mean_load_ms": mean(r["load_duration_ms"] for r in generated),
+            "mean_prompt_eval_ms": mean(r["prompt_eval_duration_ms"] for r in generated),
+            "mean_eval_ms": mean(r["eval_duration_ms"] for r in generated),
+            "mean_eval_tokens_per_s": mean(r["eval_tokens_per_s"] for r in generated),
+        })
+    return summary
+
+
+def load_records(path: str = TELEMETRY_LOG_PATH, since: float = None) -> list:
+    """Reads the append-only store, optionally only records newer than the `since` epoch seconds."""
+    if not os.path.exists(path):
+        return []
+    cutoff = datetime.fromtimestamp(since).isoformat() if since else None
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if cutoff is None or record["timestamp"] >= cutoff:
+                records.append(record)
+    return records
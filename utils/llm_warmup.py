@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+from collections import deque
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from utils import llm_telemetry
+from utils.task_models import num_ctx_for
+
+# keep_alive ที่ส่งไปกับทุก request เพื่อให้ Ollama ไม่ unload โมเดลระหว่างวัน (รูปแบบเดียวกับ OLLAMA_KEEP_ALIVE เช่น "30m", "-1")
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+KEEPALIVE_INTERVAL_SECONDS = float(os.getenv("LLM_KEEPALIVE_INTERVAL_SECONDS", "240"))
+WORKING_HOURS = os.getenv("LLM_WORKING_HOURS", "07:00-18:00")
+WORKING_DAYS = os.getenv("LLM_WORKING_DAYS", "0,1,2,3,4")  # 0 = Monday
+WORKING_TIMEZONE = ZoneInfo(os.getenv("LLM_WORKING_TIMEZONE", "Asia/Bangkok"))
+COLD_LOAD_ALERT_SECONDS = float(os.getenv("LLM_COLD_LOAD_ALERT_SECONDS", "10"))
+COLD_LOAD_MIN_SECONDS = 1.0
+
+cold_load_history = deque(maxlen=100)
+_manager_lock = threading.Lock()
+_manager_thread = None
+
+
+def is_within_working_hours(now: datetime = None) -> bool:
+    now = now or datetime.now(WORKING_TIMEZONE)
+    working_days = {int(day) for day in WORKING_DAYS.split(",") if day.strip()}
+    if now.weekday() not in working_days:
+        return False
+    start_text, end_text = WORKING_HOURS.split("-")
+    start = datetime.strptime(start_text.strip(), "%H:%M").time()
+    end = datetime.strptime(end_text.strip(), "%H:%M").time()
+    return start <= now.time() < end
+
+
+def warm_up_model(client, model: str, keep_alive: str = LLM_KEEP_ALIVE) -> float:
+    """Loads `model` with a one-token generation and pins it for `keep_alive`; returns the load time in seconds."""
+    started_at = time.perf_counter()
+    # โหลดด้วย num_ctx เดียวกับ request จริงของโมเดลนี้ ไม่เช่นนั้น request ถัดไปจะทำให้ Ollama reload โมเดลอีกรอบ
+    options = {'num_predict': 1, 'num_ctx': num_ctx_for(model)}
+    response = client.generate(model=model, prompt="สวัสดี", options=options, keep_alive=keep_alive)
+    wall_seconds = time.perf_counter() - started_at
+    load_seconds = (response.get('load_duration') or 0) / 1e9
+    llm_telemetry.record_call("keepalive_warmup", model, response, wall_time=wall_seconds, user_id="keepalive")
+
+    if load_seconds >= COLD_LOAD_MIN_SECONDS:
+        cold_load_history.append({
+            "timestamp": datetime.now(WORKING_TIMEZONE).strftime("%Y-%m-%d %H:%M:%S"),
+            "model": model,
+            "load_seconds": round(load_seconds, 3),
+            "wall_seconds": round(wall_seconds, 3),
+        })
+        print(f"🧊 Cold-loaded '{model}' in {load_seconds:.1f}s (keep_alive={keep_alive}).")
+        if load_seconds >= COLD_LOAD_ALERT_SECONDS:
+            print(f"🚨 ALERT [llm_warmup]: model load took {load_seconds:.1f}s (threshold {COLD_LOAD_ALERT_SECONDS:.0f}s).")
+    return load_seconds
+
+
+def _keepalive_loop(client, models: list):
+    # pool ของหลายเครื่องต้อง warm-up ทุกเครื่อง ไม่ใช่เฉพาะเครื่องที่ว่างที่สุด
+    clients = client.endpoint_clients() if hasattr(client, "endpoint_clients") else [client]
+    # รอบแรกเป็นการ warm-up ตอนเริ่มระบบ ทำทันทีไม่ว่าจะอยู่ในเวลาทำงานหรือไม่
+    first_run = True
+    while True:
+        if first_run or is_within_working_hours():
+            for endpoint_client in clients:
+                for model in models:
+                    try:
+                        warm_up_model(endpoint_client, model)
+                    except Exception as e:
+                        print(f"⚠️ LLM warm-up/keep-alive ping for '{model}' failed: {e}")
+        first_run = False
+        time.sleep(KEEPALIVE_INTERVAL_SECONDS)
+
+
+def start_keepalive_manager(client, models: list):
+    """Starts the warm-up + keep-alive background thread once per process."""
+    global _manager_thread
+    with _manager_lock:
+        if _manager_thread is not None and _manager_thread.is_alive():
+            return _manager_thread
+        _manager_thread = threading.Thread(
+            target=_keepalive_loop, args=(client, models), name="llm-keepalive", daemon=True
+        )
+        _manager_thread.start()
+        print(f"🔥 LLM keep-alive manager started for {', '.join(models)} (working hours {WORKING_HOURS}).")
+        return _manager_thread
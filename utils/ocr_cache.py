@@ -0,0 +1,45 @@
+import os
+import hashlib
+
+from utils.cache_store import TieredCache, CACHE_DIR
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+OCR_CACHE_TTL_SECONDS = float(os.getenv("OCR_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+OCR_CACHE_MAX_DISK_MB = float(os.getenv("OCR_CACHE_MAX_DISK_MB", "100"))
+OCR_CACHE_MAX_MEMORY_ITEMS = int(os.getenv("OCR_CACHE_MAX_MEMORY_ITEMS", "128"))
+# เพิ่มค่านี้เมื่อเปลี่ยนโมเดลหรือเวอร์ชันของ typhoon-ocr เพื่อไม่ให้ใช้ผล OCR เดิม
+OCR_CACHE_VERSION = os.getenv("OCR_CACHE_VERSION", "1")
+
+page_cache = TieredCache(
+    os.path.join(CACHE_DIR, "ocr_pages.sqlite3"),
+    max_memory_items=OCR_CACHE_MAX_MEMORY_ITEMS,
+    max_disk_bytes=int(OCR_CACHE_MAX_DISK_MB * 1024 * 1024),
+    ttl_seconds=OCR_CACHE_TTL_SECONDS,
+)
+
+
+def page_cache_key(image, dpi: int, preprocess_profile: str) -> str:
+    """Content address of a rendered page: SHA-256 of its pixels, plus the DPI and preprocessing it will get."""
+    digest = hashlib.sha256(f"{dpi}|{preprocess_profile}|{image.mode}|{image.size}|".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def get_cached_page(key: str):
+    """`{"raw_text": ..., "processed": {post_process_profile: text}}` for a page OCR'd before, else None."""
+    if not OCR_CACHE_ENABLED:
+        return None
+    return page_cache.get(key, version=OCR_CACHE_VERSION)
+
+
+def store_page(key: str, raw_text: str, post_process_profile: str, processed_text: str, entry: dict = None):
+    """Saves typhoon-ocr's text and its post-processed form; pass the cached `entry` to add another profile to it."""
+    if not OCR_CACHE_ENABLED:
+        return
+    processed = dict((entry or {}).get("processed") or {})
+    processed[post_process_profile] = processed_text
+    page_cache.set(key, {"raw_text": raw_text, "processed": processed}, version=OCR_CACHE_VERSION)
+
+
+def ocr_cache_stats() -> dict:
+    return page_cache.stats()
@@ -0,0 +1,60 @@
+import os
+
+import httpx
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+TYPHOON_OCR_IMAGE_ENDPOINT = os.getenv("TYPHOON_OCR_ENDPOINT", "http://typhoon-ocr:8000/process")
+# จำนวนหน้าที่ส่งให้ typhoon-ocr พร้อมกัน (1 = ทีละหน้าแบบเดิม)
+OCR_MAX_IN_FLIGHT = int(os.getenv("OCR_MAX_IN_FLIGHT", "4"))
+OCR_REQUEST_TIMEOUT = float(os.getenv("OCR_REQUEST_TIMEOUT", "180"))
+
+# client เดียวทั้ง process (thread-safe) เพื่อใช้ connection แบบ keep-alive ซ้ำระหว่างหน้าและระหว่างผู้ใช้
+_http_client = httpx.Client(
+    timeout=OCR_REQUEST_TIMEOUT,
+    limits=httpx.Limits(max_connections=max(OCR_MAX_IN_FLIGHT * 4, 10), max_keepalive_connections=max(OCR_MAX_IN_FLIGHT, 4)),
+)
+
+
+def ocr_image(image_bytes: bytes, filename: str = "page.png"):
+    """OCRs one PNG with typhoon-ocr; returns its text, or None when the response has no result."""
+    files = {'file': (filename, image_bytes, 'image/png')}
+    response = _http_client.post(TYPHOON_OCR_IMAGE_ENDPOINT, files=files)
+    response.raise_for_status()
+    result = response.json()
+    if isinstance(result, dict) and "result" in result:
+        return result["result"].strip()
+    return None
+
+
+def ocr_images_concurrently(images, max_in_flight: int = OCR_MAX_IN_FLIGHT):
+    """OCRs `(page_number, image_bytes)` pairs with up to `max_in_flight` requests at once.
+
+    `images` is consumed lazily, one item per free slot, so a generator that renders
+    pages on demand never has more than `max_in_flight` pages alive. Yields
+    `(index, page_number, text, error)` in completion order; `index` is the item's
+    position in `images` and `error` the exception for a failed page.
+    """
+    max_in_flight = max(1, max_in_flight)
+    items = enumerate(images)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="ocr") as executor:
+
+        def submit_next() -> bool:
+            # ดึงหน้าถัดไปจาก generator (render หน้านั้น) เฉพาะตอนที่มีช่องว่างเท่านั้น
+            item = next(items, None)
+            if item is None:
+                return False
+            index, (page_number, image_bytes) = item
+            pending[executor.submit(ocr_image, image_bytes, f"page_{page_number}.png")] = (index, page_number)
+            return True
+
+        while len(pending) < max_in_flight and submit_next():
+            pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, page_number = pending.pop(future)
+                error = future.exception()
+                yield index, page_number, None if error else future.result(), error
+                submit_next()
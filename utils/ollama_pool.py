@@ -0,0 +1,258 @@
+import os
+import math
+import threading
+import time
+
+import httpx
+import ollama
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# รายชื่อเครื่อง Ollama คั่นด้วย comma เช่น "http://ollama-1:11434,http://ollama-2:11434"
+OLLAMA_HOSTS = [
+    host.strip()
+    for host in os.getenv("OLLAMA_HOSTS", os.getenv("OLLAMA_HOST", "http://ollama:11434")).split(",")
+    if host.strip()
+]
+OLLAMA_REQUEST_TIMEOUT = float(os.getenv("OLLAMA_REQUEST_TIMEOUT", "300"))
+HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv("OLLAMA_HEALTH_CHECK_INTERVAL_SECONDS", "10"))
+HEALTH_CHECK_TIMEOUT_SECONDS = float(os.getenv("OLLAMA_HEALTH_CHECK_TIMEOUT_SECONDS", "5"))
+# timeout ต่อ request ถูกปัดขึ้นเป็นช่วงละเท่านี้ เพื่อไม่ให้เกิด client ใหม่ทุกค่า timeout
+TIMEOUT_GRANULARITY_SECONDS = 1
+# connection pool ต่อเครื่อง: เก็บ connection ที่ว่างไว้ใช้ซ้ำนานกว่าค่าเริ่มต้นของ httpx (5 วินาที)
+# เพื่อไม่ให้ต้องเปิด TCP ใหม่ระหว่างข้อความแต่ละครั้งของผู้ใช้
+HTTP_MAX_CONNECTIONS = int(os.getenv("OLLAMA_HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OLLAMA_HTTP_MAX_KEEPALIVE_CONNECTIONS", "16"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OLLAMA_HTTP_KEEPALIVE_EXPIRY_SECONDS", "120"))
+HEDGE_WORKERS = int(os.getenv("OLLAMA_HEDGE_WORKERS", "8"))
+
+# error ที่เกิดก่อนเครื่องปลายทางเริ่มประมวลผล request จึงส่งซ้ำไปเครื่องอื่นได้อย่างปลอดภัย
+RETRYABLE_ERRORS = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code >= 500
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class OllamaEndpoint:
+    def __init__(self, host: str):
+        self.host = host
+        # client ทุกตัวของเครื่องนี้ใช้ transport (connection pool) ร่วมกัน ต่างกันแค่ timeout
+        self.transport = httpx.HTTPTransport(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            )
+        )
+        self.client = ollama.Client(host=host, timeout=OLLAMA_REQUEST_TIMEOUT, transport=self.transport)
+        self.health_client = ollama.Client(host=host, timeout=HEALTH_CHECK_TIMEOUT_SECONDS, transport=self.transport)
+        self._timeout_clients = {}
+        self.outstanding = 0
+        self.healthy = True
+        self.last_error = None
+        self.last_checked = None
+
+    def client_for(self, timeout: float = None):
+        if timeout is None:
+            return self.client
+        seconds = min(OLLAMA_REQUEST_TIMEOUT, math.ceil(timeout / TIMEOUT_GRANULARITY_SECONDS) * TIMEOUT_GRANULARITY_SECONDS)
+        client = self._timeout_clients.get(seconds)
+        if client is None:
+            client = self._timeout_clients.setdefault(
+                seconds, ollama.Client(host=self.host, timeout=seconds, transport=self.transport)
+            )
+        return client
+
+
+class OllamaPool:
+    """Drop-in stand-in for `ollama.Client` that spreads requests over several Ollama hosts.
+
+    Each request goes to the healthy endpoint with the fewest outstanding requests;
+    a request that fails before the endpoint starts working on it is retried on
+    another endpoint. A background thread re-checks every endpoint's health.
+    """
+
+    def __init__(self, hosts: list):
+        if not hosts:
+            raise ValueError("OllamaPool needs at least one host.")
+        self.endpoints = [OllamaEndpoint(host) for host in hosts]
+        self._lock = threading.Lock()
+        self._next_index = 0
+        self._health_thread = None
+        self._hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="ollama-hedge")
+
+    def _pick(self, exclude) -> OllamaEndpoint:
+        with self._lock:
+            candidates = [ep for ep in self.endpoints if ep not in exclude and ep.healthy]
+            if not candidates:
+                # ผลตรวจสุขภาพอาจล้าสมัย ถ้าไม่เหลือเครื่องที่ healthy ให้ลองเครื่องที่เหลือแทนการล้มเหลวทันที
+                candidates = [ep for ep in self.endpoints if ep not in exclude]
+            if not candidates:
+                return None
+            # เรียงตามจำนวน request ค้าง ถ้าเท่ากันให้วนเริ่มจากเครื่องถัดไป เพื่อกระจายโหลดตอนระบบว่าง
+            count = len(self.endpoints)
+            endpoint = min(
+                candidates,
+                key=lambda ep: (ep.outstanding, (self.endpoints.index(ep) - self._next_index) % count),
+            )
+            self._next_index = (self.endpoints.index(endpoint) + 1) % count
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _done(self, endpoint: OllamaEndpoint):
+        with self._lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+
+    def _mark_unhealthy(self, endpoint: OllamaEndpoint, error: Exception):
+        with self._lock:
+            endpoint.healthy = False
+            endpoint.last_error = str(error)
+        print(f"⚠️ Ollama endpoint {endpoint.host} failed, trying another: {error}")
+
+    def _call(self, method: str, *args, timeout: float = None, first: OllamaEndpoint = None, exclude=(), **kwargs):
+        # first: เครื่องที่ _pick ไว้แล้ว (ใช้กับ hedged request), exclude: เครื่องที่ห้ามใช้
+        tried = list(exclude)
+        last_error = None
+        endpoint = first
+        while True:
+            if endpoint is None:
+                endpoint = self._pick(tried)
+            if endpoint is None:
+                raise last_error or ConnectionError("No Ollama endpoint is available.")
+            tried.append(endpoint)
+            try:
+                return getattr(endpoint.client_for(timeout), method)(*args, **kwargs)
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+                self._mark_unhealthy(endpoint, e)
+                last_error = e
+            finally:
+                self._done(endpoint)
+            endpoint = None
+
+    def _stream(self, method: str, *args, timeout: float = None, **kwargs):
+        tried = []
+        last_error = None
+        while True:
+            endpoint = self._pick(tried)
+            if endpoint is None:
+                raise last_error or ConnectionError("No Ollama endpoint is available.")
+            tried.append(endpoint)
+            stream = None
+            started = False
+            try:
+                stream = getattr(endpoint.client_for(timeout), method)(*args, stream=True, **kwargs)
+                for chunk in stream:
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                # ส่งซ้ำได้เฉพาะเมื่อยังไม่ได้ส่ง chunk ใดให้ผู้เรียก ไม่เช่นนั้นคำตอบจะซ้ำซ้อน
+                if started or not _is_retryable(e):
+                    raise
+                self._mark_unhealthy(endpoint, e)
+                last_error = e
+            finally:
+                if stream is not None:
+                    stream.close()
+                self._done(endpoint)
+
+    def chat(self, *args, stream: bool = False, timeout: float = None, **kwargs):
+        """`ollama.Client.chat`; `timeout` (seconds) bounds this request instead of the client-wide default."""
+        if stream:
+            return self._stream("chat", *args, timeout=timeout, **kwargs)
+        return self._call("chat", *args, timeout=timeout, **kwargs)
+
+    def generate(self, *args, stream: bool = False, timeout: float = None, **kwargs):
+        if stream:
+            return self._stream("generate", *args, timeout=timeout, **kwargs)
+        return self._call("generate", *args, timeout=timeout, **kwargs)
+
+    def hedged_chat(self, hedge_after: float, timeout: float = None, **kwargs):
+        """Non-streaming chat that sends a second copy to another endpoint if the first
+        has not answered within `hedge_after` seconds, returning whichever succeeds first.
+
+        Only for deterministic requests, where both copies would give the same answer.
+        The slower copy is not cancelled; its result is discarded.
+        """
+        primary_endpoint = self._pick([])
+        if primary_endpoint is None:
+            raise ConnectionError("No Ollama endpoint is available.")
+        started_at = time.monotonic()
+        primary = self._hedge_executor.submit(self._call, "chat", timeout=timeout, first=primary_endpoint, **kwargs)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        with self._lock:
+            healthy_others = [ep for ep in self.endpoints if ep is not primary_endpoint and ep.healthy]
+        backup_endpoint = self._pick([primary_endpoint]) if healthy_others else None
+        if backup_endpoint is None:
+            return primary.result()
+        print(f"INFO [ollama_pool]: no answer from {primary_endpoint.host} after {hedge_after:.0f}s, hedging to {backup_endpoint.host}.")
+        remaining = None if timeout is None else max(1.0, timeout - (time.monotonic() - started_at))
+        backup = self._hedge_executor.submit(
+            self._call, "chat", timeout=remaining, first=backup_endpoint, exclude=[primary_endpoint], **kwargs
+        )
+
+        pending = {primary, backup}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                first_error = first_error or future.exception()
+        raise first_error
+
+    def list(self):
+        return self._call("list")
+
+    def endpoint_clients(self) -> list:
+        """The per-host clients, for work that must reach every host (e.g. warming the model on each)."""
+        return [endpoint.client for endpoint in self.endpoints]
+
+    def check_health(self):
+        for endpoint in self.endpoints:
+            try:
+                endpoint.health_client.list()
+                healthy, error = True, None
+            except Exception as e:
+                healthy, error = False, str(e)
+            with self._lock:
+                if healthy and not endpoint.healthy:
+                    print(f"✅ Ollama endpoint {endpoint.host} is healthy again.")
+                endpoint.healthy = healthy
+                endpoint.last_error = error
+                endpoint.last_checked = time.time()
+
+    def _health_loop(self):
+        while True:
+            self.check_health()
+            time.sleep(HEALTH_CHECK_INTERVAL_SECONDS)
+
+    def start_health_checks(self):
+        with self._lock:
+            if self._health_thread is not None and self._health_thread.is_alive():
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+            self._health_thread.start()
+
+    def stats(self) -> list:
+        with self._lock:
+            return [
+                {
+                    "host": endpoint.host,
+                    "healthy": endpoint.healthy,
+                    "outstanding": endpoint.outstanding,
+                    "last_error": endpoint.last_error,
+                }
+                for endpoint in self.endpoints
+            ]
+
+
+ollama_pool = OllamaPool(OLLAMA_HOSTS)
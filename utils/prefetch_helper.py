@@ -0,0 +1,61 @@
+import os
+import json
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+from utils.llm_gateway import acting_as, current_user_id
+
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+
+def input_fingerprint(*parts) -> str:
+    """Stable hash of the inputs a prefetched result was computed from."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _run_as(user_id, fn, args, kwargs):
+    with acting_as(user_id):
+        return fn(*args, **kwargs)
+
+
+def start_prefetch(session_state, key: str, fingerprint: str, fn, *args, **kwargs):
+    """Runs `fn(*args, **kwargs)` in the background and parks the future in `session_state[key]`.
+
+    The LLM calls it makes are queued under the current session, so a prefetch
+    never gets more than its user's fair share of the gateway.
+    """
+    entry = session_state.get(key)
+    if entry and entry["fingerprint"] == fingerprint:
+        return
+    discard_prefetch(session_state, key)
+    future = _executor.submit(_run_as, current_user_id(), fn, args, kwargs)
+    session_state[key] = {"fingerprint": fingerprint, "future": future}
+    print(f"INFO [prefetch]: started '{key}'.")
+
+
+def take_prefetched(session_state, key: str, fingerprint: str):
+    """Returns the prefetched result (waiting for it if still running), or None when
+    nothing usable was prefetched for exactly these inputs."""
+    entry = session_state.get(key)
+    if not entry:
+        return None
+    if entry["fingerprint"] != fingerprint:
+        discard_prefetch(session_state, key)
+        return None
+    session_state.pop(key, None)
+    try:
+        return entry["future"].result()
+    except Exception as e:
+        print(f"WARN [prefetch]: '{key}' failed in background: {e}")
+        return None
+
+
+def discard_prefetch(session_state, key: str):
+    entry = session_state.pop(key, None)
+    if entry:
+        # ถ้ายังไม่เริ่มทำงานจะถูกยกเลิก ถ้าเริ่มแล้วผลลัพธ์จะถูกทิ้งไป
+        entry["future"].cancel()
+        print(f"INFO [prefetch]: discarded '{key}'.")
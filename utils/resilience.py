@@ -0,0 +1,121 @@
+import os
+import json
+import random
+import threading
+import time
+
+import httpx
+import ollama
+
+from utils.ollama_pool import RETRYABLE_ERRORS
+
+# นโยบายต่องาน: deadline รวมทุกครั้งที่ลอง (วินาที), จำนวนครั้งที่ลองใหม่, และการส่ง hedged request
+# retries ใช้เฉพาะงานที่เรียกซ้ำได้โดยไม่มีผลข้างเคียง ส่วน hedge ใช้เฉพาะงานที่ผลลัพธ์ deterministic
+DEFAULT_TASK_POLICY = {"deadline": 120, "retries": 0, "hedge_after": None}
+TASK_POLICIES = {
+    "query_router": {"deadline": 15, "retries": 2, "hedge_after": 3},
+    "extract_structured_data": {"deadline": 120, "retries": 1, "hedge_after": 30},
+    "draft_generation": {"deadline": 90, "retries": 1, "hedge_after": 30},
+    "replySec1_generation": {"deadline": 120, "retries": 0, "hedge_after": None},
+    "replySec234_generation": {"deadline": 120, "retries": 1, "hedge_after": None},
+    "call_chatbot": {"deadline": 120, "retries": 0, "hedge_after": None},
+}
+# override ผ่าน env เป็น JSON เช่น LLM_TASK_POLICIES='{"draft_generation": {"deadline": 60}}'
+for _task, _overrides in json.loads(os.getenv("LLM_TASK_POLICIES", "{}")).items():
+    TASK_POLICIES[_task] = dict(TASK_POLICIES.get(_task, DEFAULT_TASK_POLICY), **_overrides)
+
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "0") == "1"
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", "8"))
+MIN_ATTEMPT_SECONDS = 2.0
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+def policy_for(task: str) -> dict:
+    return TASK_POLICIES.get(task, DEFAULT_TASK_POLICY)
+
+
+def is_backend_failure(error: Exception) -> bool:
+    """True for errors that say the backend is unhealthy (timeouts, unreachable, 5xx), not that the request was bad."""
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code >= 500
+    if isinstance(error, CircuitOpenError):
+        # breaker ปฏิเสธเองโดยไม่ได้ติดต่อ Ollama แม้จะเป็น ConnectionError ก็ไม่นับเป็นความล้มเหลว
+        return False
+    return isinstance(error, (DeadlineExceeded, httpx.TimeoutException) + RETRYABLE_ERRORS)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for retry number `attempt` (0-based)."""
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Fails fast after `failure_threshold` consecutive backend failures.
+
+    After `reset_seconds` one trial call is let through (half-open); its success
+    closes the circuit again and its failure keeps it open for another period.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._rejected = 0
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_seconds - (time.monotonic() - self._opened_at)
+            if remaining <= 0 and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self._rejected += 1
+        raise CircuitOpenError(f"ระบบ AI ไม่ตอบสนองชั่วคราว กรุณาลองใหม่ในอีก {max(1, int(remaining))} วินาที")
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print("✅ [circuit_breaker]: Ollama backend recovered, circuit closed.")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or (self._opened_at is None and self._failures >= self.failure_threshold):
+                print(f"🚨 [circuit_breaker]: {self._failures} consecutive Ollama failures, circuit open for {self.reset_seconds:.0f}s.")
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def record_neutral(self):
+        """Ends a half-open trial that failed for a reason unrelated to backend health."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._opened_at is None:
+                state = "closed"
+            elif time.monotonic() - self._opened_at >= self.reset_seconds:
+                state = "half-open"
+            else:
+                state = "open"
+            return {"state": state, "consecutive_failures": self._failures, "rejected": self._rejected}
+
+
+ollama_breaker = CircuitBreaker()
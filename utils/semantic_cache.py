@@ -0,0 +1,101 @@
+import os
+import threading
+import uuid
+import numpy as np
+
+from utils.cache_store import CACHE_DIR
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "500"))
+KB_VERSION_FILE = os.path.join(CACHE_DIR, "knowledge_base_version")
+
+
+def current_kb_version() -> str:
+    try:
+        with open(KB_VERSION_FILE, encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def mark_knowledge_base_updated() -> str:
+    """Called after re-ingesting the knowledge base; invalidates every cached answer."""
+    version = uuid.uuid4().hex
+    os.makedirs(os.path.dirname(KB_VERSION_FILE) or ".", exist_ok=True)
+    with open(KB_VERSION_FILE, "w", encoding="utf-8") as f:
+        f.write(version)
+    semantic_cache.clear()
+    print(f"♻️ Knowledge base version is now {version}; semantic answer cache cleared.")
+    return version
+
+
+class SemanticAnswerCache:
+    """Answers keyed by query embedding; a new query reuses an answer whose cached
+    question is at least `threshold` cosine-similar to it."""
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._entries = []
+        self._kb_version = current_kb_version()
+        self._stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        length = np.linalg.norm(vector)
+        return vector / length if length else vector
+
+    def _check_kb_version(self):
+        # ถ้ามีการ ingest ฐานความรู้ใหม่ (แม้จาก process อื่น) ให้ล้างคำตอบเก่าทั้งหมด
+        version = current_kb_version()
+        if version != self._kb_version:
+            self._vectors = None
+            self._entries = []
+            self._kb_version = version
+
+    def lookup(self, query_embedding):
+        query_vector = self._normalize(query_embedding)
+        with self._lock:
+            self._check_kb_version()
+            if self._vectors is None:
+                self._stats["misses"] += 1
+                return None
+            scores = self._vectors @ query_vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            entry = dict(self._entries[best])
+            entry["score"] = float(scores[best])
+            return entry
+
+    def add(self, query: str, query_embedding, answer: str, context: str = ""):
+        query_vector = self._normalize(query_embedding)
+        with self._lock:
+            self._check_kb_version()
+            entry = {"query": query, "answer": answer, "context": context}
+            if self._vectors is None:
+                self._vectors = query_vector[np.newaxis, :]
+            else:
+                self._vectors = np.vstack([self._vectors, query_vector])
+            self._entries.append(entry)
+            if len(self._entries) > self.max_entries:
+                self._vectors = self._vectors[1:]
+                self._entries = self._entries[1:]
+
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            self._entries = []
+            self._kb_version = current_kb_version()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+semantic_cache = SemanticAnswerCache()
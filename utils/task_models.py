@@ -0,0 +1,87 @@
+import os
+import json
+import threading
+
+from collections import deque
+
+LLM_MODEL = os.getenv("LLM_MODEL", "scb10x/llama3.1-typhoon2-8b-instruct:latest")
+SMALL_LLM_MODEL = os.getenv("SMALL_LLM_MODEL", "scb10x/llama3.2-typhoon2-3b-instruct:latest")
+
+# งานง่าย (คัดแยกคำถาม, สกัดฟิลด์จาก OCR) ใช้โมเดลเล็กที่เร็วกว่า งานร่างหนังสือใช้ Typhoon 8B
+# ถ้าใช้หลายโมเดลพร้อมกัน ต้องตั้ง OLLAMA_MAX_LOADED_MODELS ของแต่ละเครื่องให้พอกับจำนวนโมเดล
+TASK_MODELS = {
+    "query_router": SMALL_LLM_MODEL,
+    "extract_structured_data": SMALL_LLM_MODEL,
+    "draft_generation": LLM_MODEL,
+    "replySec1_generation": LLM_MODEL,
+    "replySec234_generation": LLM_MODEL,
+    "call_chatbot": LLM_MODEL,
+    "summarize_chat_memory": SMALL_LLM_MODEL,
+}
+# override ผ่าน env เป็น JSON เช่น LLM_TASK_MODELS='{"extract_structured_data": "scb10x/llama3.1-typhoon2-8b-instruct:latest"}'
+TASK_MODELS.update(json.loads(os.getenv("LLM_TASK_MODELS", "{}")))
+# options ที่ทับค่าในโค้ดรายงาน เช่น LLM_TASK_OPTIONS='{"call_chatbot": {"temperature": 0.2}}'
+TASK_OPTION_OVERRIDES = json.loads(os.getenv("LLM_TASK_OPTIONS", "{}"))
+# num_ctx คงที่ต่อโมเดล: Ollama reload runner ทุกครั้งที่ num_ctx ของโมเดลเดียวกันเปลี่ยน จึงไม่ปรับตามขนาดของแต่ละ request
+# (ปรับเฉพาะ num_predict และการตัด input) งานที่ต้องการ context ต่างกันมากให้แยกไปใช้ model tag หรือเครื่องอื่น
+# override ผ่าน env เป็น JSON เช่น LLM_MODEL_NUM_CTX='{"scb10x/llama3.2-typhoon2-3b-instruct:latest": 16384}'
+MODEL_NUM_CTX = {
+    SMALL_LLM_MODEL: 8192,
+    LLM_MODEL: 16384,
+}
+MODEL_NUM_CTX.update(json.loads(os.getenv("LLM_MODEL_NUM_CTX", "{}")))
+DEFAULT_NUM_CTX = int(os.getenv("LLM_DEFAULT_NUM_CTX", "8192"))
+LATENCY_HISTORY_SIZE = 200
+
+_latency_lock = threading.Lock()
+_latencies = {}
+
+
+def model_for(task: str) -> str:
+    return TASK_MODELS.get(task, LLM_MODEL)
+
+
+def num_ctx_for(model: str) -> int:
+    """The one `num_ctx` every request and warm-up for `model` uses."""
+    return MODEL_NUM_CTX.get(model, DEFAULT_NUM_CTX)
+
+
+def tiered_models() -> list:
+    """Every distinct model some task is mapped to, default model first."""
+    models = [LLM_MODEL]
+    for model in TASK_MODELS.values():
+        if model not in models:
+            models.append(model)
+    return models
+
+
+def options_for(task: str, options: dict = None) -> dict:
+    overrides = TASK_OPTION_OVERRIDES.get(task)
+    if not overrides:
+        return options
+    return dict(options or {}, **overrides)
+
+
+def record_latency(task: str, model: str, seconds: float):
+    with _latency_lock:
+        history = _latencies.get((task, model))
+        if history is None:
+            history = _latencies[(task, model)] = deque(maxlen=LATENCY_HISTORY_SIZE)
+        history.append(seconds)
+
+
+def latency_stats() -> list:
+    """Count, mean, p50 and p95 of recent call latencies (seconds) per task and model."""
+    with _latency_lock:
+        snapshot = {key: sorted(history) for key, history in _latencies.items()}
+    stats = []
+    for (task, model), values in sorted(snapshot.items()):
+        stats.append({
+            "task": task,
+            "model": model,
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        })
+    return stats
@@ -0,0 +1,170 @@
+import os
+import hashlib
+import threading
+
+from collections import OrderedDict
+from utils.task_models import model_for, num_ctx_for
+
+# tokenizer ของโมเดลบน Hugging Face ที่ใช้นับ token (ต้องตรงกับโมเดลที่ Ollama รันอยู่)
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "scb10x/llama3.1-typhoon2-8b-instruct")
+# โฟลเดอร์ tokenizer ที่ download_models.py บันทึกไว้ ถ้ามีจะโหลดจากที่นี่ก่อน
+LLM_TOKENIZER_PATH = os.getenv("LLM_TOKENIZER_PATH", "./models/tokenizer")
+# ค่าเริ่มต้นไม่ดาวน์โหลดจาก Hugging Face (เครื่องที่ไม่มี internet จะรอ timeout นาน) ใช้เฉพาะไฟล์ในเครื่องหรือ cache
+LLM_TOKENIZER_ALLOW_DOWNLOAD = os.getenv("LLM_TOKENIZER_ALLOW_DOWNLOAD", "0") == "1"
+MESSAGE_OVERHEAD_TOKENS = 8  # header ของ chat template ต่อ message
+SAFETY_MARGIN_TOKENS = 64
+TOKEN_COUNT_CACHE_SIZE = 2048
+FALLBACK_CHARS_PER_TOKEN = 2  # ใช้ประมาณเมื่อโหลด tokenizer ไม่ได้ (ภาษาไทยมักได้ราว 2-3 ตัวอักษรต่อ token จึงประมาณเผื่อไว้)
+TRIM_MARKER = "\n...[ตัดเนื้อหาบางส่วนออกเพื่อให้พอดีกับขนาด context ของโมเดล]...\n"
+
+_tokenizer = None
+_tokenizer_failed = False
+_tokenizer_lock = threading.Lock()
+_count_cache = OrderedDict()
+_count_cache_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def load_tokenizer():
+    """Loads the tokenizer once from local files; returns None (and logs once) when it is unavailable,
+    in which case token counts are estimated from characters."""
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is not None or _tokenizer_failed:
+        return _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None and not _tokenizer_failed:
+            source = LLM_TOKENIZER_PATH if os.path.isdir(LLM_TOKENIZER_PATH) else LLM_TOKENIZER
+            try:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(source, local_files_only=not LLM_TOKENIZER_ALLOW_DOWNLOAD)
+                print(f"✅ Tokenizer '{source}' loaded for token budgeting.")
+            except Exception as e:
+                _tokenizer_failed = True
+                print(
+                    f"⚠️ WARN [token_budget]: tokenizer '{source}' is not available locally ({e}); "
+                    f"estimating tokens as {FALLBACK_CHARS_PER_TOKEN} characters each. "
+                    f"Run download_models.py or set LLM_TOKENIZER_PATH to a local copy."
+                )
+    return _tokenizer
+
+
+def preload_tokenizer():
+    """Loads the tokenizer in the background at startup so the first LLM request does not wait for it."""
+    threading.Thread(target=load_tokenizer, name="tokenizer-load", daemon=True).start()
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in `text` according to the model's tokenizer; counts are cached by content."""
+    if not text:
+        return 0
+    key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    with _count_cache_lock:
+        if key in _count_cache:
+            _count_cache.move_to_end(key)
+            return _count_cache[key]
+
+    tokenizer = load_tokenizer()
+    if tokenizer is not None:
+        count = len(tokenizer.encode(text, add_special_tokens=False))
+    else:
+        count = len(text) // FALLBACK_CHARS_PER_TOKEN + 1
+
+    with _count_cache_lock:
+        _count_cache[key] = count
+        if len(_count_cache) > TOKEN_COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return count
+
+
+def count_message_tokens(messages: list) -> int:
+    return sum(count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def context_budget(task: str) -> int:
+    """The task's model's fixed `num_ctx` (see `task_models.MODEL_NUM_CTX`); prompts are trimmed to fit it."""
+    return num_ctx_for(model_for(task))
+
+
+def _record(task: str, prompt_tokens: int, trimmed_tokens: int = 0):
+    with _stats_lock:
+        entry = _stats.setdefault(task, {"requests": 0, "trimmed": 0, "tokens_trimmed": 0, "max_prompt_tokens": 0})
+        entry["requests"] += 1
+        entry["max_prompt_tokens"] = max(entry["max_prompt_tokens"], prompt_tokens)
+        if trimmed_tokens:
+            entry["trimmed"] += 1
+            entry["tokens_trimmed"] += trimmed_tokens
+
+
+def budget_stats() -> dict:
+    """Per-task request and trim counts, including how often trimming happened (`trim_rate`)."""
+    with _stats_lock:
+        return {
+            task: dict(entry, trim_rate=entry["trimmed"] / entry["requests"] if entry["requests"] else 0.0)
+            for task, entry in _stats.items()
+        }
+
+
+def _longest_prefix_within(text: str, max_tokens: int) -> int:
+    """Largest character length `n` such that `text[:n]` fits in `max_tokens`."""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def trim_middle(text: str, max_tokens: int) -> str:
+    """Keeps the beginning and end of `text` (e.g. an OCR document's header and signature block) and drops the middle."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    available = max(0, max_tokens - count_tokens(TRIM_MARKER))
+    head_tokens = available * 2 // 3
+    head = text[:_longest_prefix_within(text, head_tokens)]
+    reversed_tail = text[::-1]
+    tail = reversed_tail[:_longest_prefix_within(reversed_tail, available - head_tokens)][::-1]
+    return head + TRIM_MARKER + tail
+
+
+def trim_tail(text: str, max_tokens: int) -> str:
+    """Keeps the beginning of `text`, cut back to a line break; suits ranked RAG results where the last blocks matter least."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    kept = text[:_longest_prefix_within(text, max(0, max_tokens - count_tokens(TRIM_MARKER)))]
+    if "\n" in kept:
+        kept = kept[:kept.rindex("\n")]
+    return kept + TRIM_MARKER
+
+
+def record_prompt(task: str, messages: list, num_predict: int):
+    """Records the prompt size of a request whose prompt is not trimmed (e.g. user-typed text),
+    and warns when it plus `num_predict` generated tokens will not fit the model's `num_ctx`."""
+    prompt_tokens = count_message_tokens(messages)
+    _record(task, prompt_tokens)
+    budget = context_budget(task)
+    needed = prompt_tokens + num_predict + SAFETY_MARGIN_TOKENS
+    if needed > budget:
+        print(f"WARN [token_budget]: '{task}' needs {needed} tokens, over its budget of {budget}; Ollama will truncate the prompt.")
+
+
+def fit_variable_section(task: str, build_messages, text: str, num_predict: int, trim=trim_middle) -> list:
+    """Builds messages with `build_messages(text)`, trimming `text` so the prompt and output fit the task's budget."""
+    budget = context_budget(task)
+    fixed_tokens = count_message_tokens(build_messages(""))
+    available = max(0, budget - fixed_tokens - num_predict - SAFETY_MARGIN_TOKENS)
+    text = text or ""
+    text_tokens = count_tokens(text)
+
+    trimmed_tokens = 0
+    if text_tokens > available:
+        text = trim(text, available)
+        trimmed_tokens = text_tokens - count_tokens(text)
+        print(f"INFO [token_budget]: trimmed {trimmed_tokens} tokens from '{task}' input to fit {budget} tokens.")
+
+    messages = build_messages(text)
+    prompt_tokens = count_message_tokens(messages)
+    _record(task, prompt_tokens, trimmed_tokens)
+    return messages
@@ -1,11 +1,16 @@
 import streamlit as st
 from pathlib import Path
+from contextlib import contextmanager
 from .file_helper import image_to_base64
-from utils.llm_helper import init_ollama_client
-
-OLLAMA_AVAILABLE = init_ollama_client()
+from utils.llm_clients import get_ollama_client, ollama_available
+from utils.llm_gateway import queue_listener
+from utils.prefetch_helper import discard_prefetch
 
 def render_sidebar():
+    # สถานะอ่านจากผล health check ล่าสุดใน background จึงไม่มีการเรียก network ระหว่าง render
+    get_ollama_client()
+    ai_online = ollama_available()
+
     # โหลด Assets
     sidebar_logo_b64 = image_to_base64(Path("assets/logo.png"))
 
@@ -45,7 +50,7 @@ def render_sidebar():
                 </div>
             </div>
             """.format(
-                status_text="Online" if OLLAMA_AVAILABLE else "Offline"
+                status_text="Online" if ai_online else "Offline"
             ),
             unsafe_allow_html=True
         )
@@ -53,6 +58,8 @@ def render_sidebar():
 def reset_workflow_states():
     
     st.session_state.ocr_text_content = None
+    st.session_state.ocr_page_texts = None
+    st.session_state.ocr_page_sources = None
     st.session_state.extracted_data = None
     st.session_state.current_doc_type_for_data = None
     st.session_state.reply_content = ""
@@ -62,6 +69,22 @@ def reset_workflow_states():
     st.session_state.is_draft_generated = False
     st.session_state.opening_options = []
     st.session_state.selected_opening = ""
+    discard_prefetch(st.session_state, "opening_options_prefetch")
     # ไม่ต้องล้าง log การแก้ไขก็ได้ เพื่อให้ผู้ใช้ยังเห็น feedback ของตัวเองอยู่
     # st.session_state.opening_corrections_log = [] 
-    st.toast("เริ่มต้นกระบวนการสำหรับไฟล์ใหม่", icon="🔄")
\ No newline at end of file
+    st.toast("เริ่มต้นกระบวนการสำหรับไฟล์ใหม่", icon="🔄")
+
+
+@contextmanager
+def queue_position_notice():
+    """Shows the caller's position in the LLM queue while its request waits for a free slot."""
+    placeholder = st.empty()
+
+    def show_position(position):
+        placeholder.info(f"ระบบ AI กำลังให้บริการผู้ใช้อื่นอยู่ คำขอของคุณอยู่ในคิวลำดับที่ {position}", icon="⏳")
+
+    try:
+        with queue_listener(show_position):
+            yield
+    finally:
+        placeholder.empty()